@@ -0,0 +1,352 @@
+"""
+Columnar archive of sealed event days
+
+Analytics scans need two or three fields per event, but reading Event rows
+means fetching and decoding the whole JSON `data` column. Sealed days are
+compacted, per site and day, into columnar files with typed columns:
+
+    session_id, page_id (-1 when unknown)        int64
+    timestamp (milliseconds since the epoch)     int64
+    event_type, device_type, target_tag          int32 codes into the
+                                                 archive's dictionaries
+    x, y, scroll_percentage                      float32, NaN when missing
+
+Files are Parquet when pyarrow is installed and otherwise one .npy file per
+column; both are read memory-mapped. numpy is needed either way. Each
+EventArchive row records one written day.
+
+The task workers run the compact_event_archives task every
+EVENT_ARCHIVE_COMPACT_EVERY seconds; `manage.py archive_events` does the same
+on demand or from cron when that is disabled.
+
+Archived days form one contiguous run per site, because compaction always
+continues after the last archived day. scan_events reads that run from the
+files and everything outside it from the database, which in practice is the
+live tail of the last EVENT_ARCHIVE_LAG_DAYS + 1 days.
+
+The database rows are kept until retention (events.partitions) removes
+them, and compaction drops archived days past the same retention. Events
+that arrive for a day after it was archived are only picked up when that
+day is rebuilt (`manage.py archive_events --rebuild`).
+"""
+import math
+import os
+import shutil
+import time as time_module
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+from analytics.models import EventArchive
+from events.models import Event
+
+try:
+    import numpy as np
+except ImportError:  # The archive needs numpy, scans fall back to the database
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet is optional, .npy column files are used without it
+    pa = pq = None
+
+DTYPES = {
+    'session_id': 'int64',
+    'page_id': 'int64',
+    'timestamp': 'int64',
+    'event_type': 'int32',
+    'device_type': 'int32',
+    'target_tag': 'int32',
+    'x': 'float32',
+    'y': 'float32',
+    'scroll_percentage': 'float32',
+}
+COLUMNS = tuple(DTYPES)
+CODE_COLUMNS = ('event_type', 'device_type', 'target_tag')
+
+# Database values the columns are built from, in the order _build_columns reads them
+SOURCE_FIELDS = (
+    'session_id', 'page_id', 'timestamp', 'event_type', 'session__device_type',
+    'data__target', 'x', 'y', 'scroll_depth',
+)
+ROW_CHUNK_SIZE = 5000
+
+
+def archive_available():
+    return np is not None
+
+
+def archive_format():
+    """Format for new archives: EVENT_ARCHIVE_FORMAT, or the best one installed"""
+    fmt = settings.EVENT_ARCHIVE_FORMAT or ('parquet' if pa is not None else 'npy')
+    if fmt not in ('parquet', 'npy'):
+        raise ImproperlyConfigured(f'Unknown EVENT_ARCHIVE_FORMAT {fmt}')
+    if fmt == 'parquet' and pa is None:
+        raise ImproperlyConfigured('EVENT_ARCHIVE_FORMAT is parquet but pyarrow is not installed')
+    return fmt
+
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def _epoch_ms(value):
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return int(value.timestamp() * 1000)
+
+
+def _float(value):
+    if isinstance(value, bool):
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class _Dictionary:
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+
+    def code(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _build_columns(rows):
+    """Typed columns and code dictionaries from SOURCE_FIELDS value rows"""
+    dictionaries = {name: _Dictionary() for name in CODE_COLUMNS}
+    values = {name: [] for name in COLUMNS}
+    for session_id, page_id, timestamp, event_type, device_type, target, x, y, percentage in rows:
+        values['session_id'].append(session_id)
+        values['page_id'].append(-1 if page_id is None else page_id)
+        values['timestamp'].append(_epoch_ms(timestamp))
+        values['event_type'].append(dictionaries['event_type'].code(event_type))
+        values['device_type'].append(dictionaries['device_type'].code(device_type or ''))
+        values['target_tag'].append(dictionaries['target_tag'].code(target if isinstance(target, str) else ''))
+        values['x'].append(_float(x))
+        values['y'].append(_float(y))
+        values['scroll_percentage'].append(_float(percentage))
+    columns = {name: np.asarray(values[name], dtype=DTYPES[name]) for name in COLUMNS}
+    return columns, {name: dictionary.values for name, dictionary in dictionaries.items()}
+
+
+def _full_path(relative):
+    return os.path.join(settings.EVENT_ARCHIVE_DIR, relative)
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _write(relative, columns, fmt):
+    """Write under a temporary name and rename, so readers never see a partial archive"""
+    path = _full_path(relative)
+    tmp = f'{path}.tmp'
+    _remove(tmp)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if fmt == 'parquet':
+        pq.write_table(pa.table({name: columns[name] for name in COLUMNS}), tmp)
+    else:
+        os.makedirs(tmp)
+        for name in COLUMNS:
+            np.save(os.path.join(tmp, f'{name}.npy'), columns[name])
+    os.replace(tmp, path)
+
+
+def _read(archive, names):
+    path = _full_path(archive.path)
+    if archive.format == 'parquet':
+        table = pq.read_table(path, columns=list(names), memory_map=True)
+        return {name: table.column(name).to_numpy() for name in names}
+    return {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in names}
+
+
+def archive_day(site_id, day, fmt=None):
+    """Write (or rewrite) the archive of one site and day. Returns the EventArchive."""
+    fmt = fmt or archive_format()
+    start, end = _day_bounds(day)
+    rows = Event.objects.filter(
+        session__site_id=site_id, timestamp__gte=start, timestamp__lt=end
+    ).order_by('timestamp', 'id').values_list(*SOURCE_FIELDS).iterator(chunk_size=ROW_CHUNK_SIZE)
+    columns, dictionaries = _build_columns(rows)
+    row_count = len(columns['timestamp'])
+
+    # Every write gets a new name, readers holding the previous row keep a valid file
+    path = ''
+    if row_count:
+        name = f"{day.isoformat()}.{int(time_module.time() * 1000)}"
+        path = os.path.join(str(site_id), f'{name}.parquet' if fmt == 'parquet' else name)
+        _write(path, columns, fmt)
+
+    previous = EventArchive.objects.filter(site_id=site_id, day=day).values_list('path', flat=True).first()
+    archive, _ = EventArchive.objects.update_or_create(
+        site_id=site_id,
+        day=day,
+        defaults={'format': fmt, 'path': path, 'row_count': row_count, 'dictionaries': dictionaries}
+    )
+    if previous and previous != path:
+        _remove(_full_path(previous))
+    return archive
+
+
+def delete_archives(site_id, before_day=None):
+    """Remove a site's archives (all, or those before a day). Returns the number removed."""
+    archives = EventArchive.objects.filter(site_id=site_id)
+    if before_day is not None:
+        archives = archives.filter(day__lt=before_day)
+    removed = 0
+    for archive in list(archives):
+        if archive.path:
+            _remove(_full_path(archive.path))
+        archive.delete()
+        removed += 1
+    return removed
+
+
+def sealed_through(today=None):
+    """Last day that may be archived"""
+    today = today or timezone.localdate()
+    return today - timedelta(days=settings.EVENT_ARCHIVE_LAG_DAYS + 1)
+
+
+def compact_event_archives(site_ids, today=None, retention=None):
+    """
+    Archive every sealed day after each site's last archived day and drop
+    archives past retention ({site_id: cutoff datetime}). Returns the number
+    of days written.
+    """
+    through = sealed_through(today)
+    retention = retention or {}
+    written = 0
+    for site_id in site_ids:
+        cutoff = retention.get(site_id)
+        if cutoff is not None:
+            delete_archives(site_id, timezone.localdate(cutoff))
+
+        last = EventArchive.objects.filter(site_id=site_id).aggregate(last=Max('day'))['last']
+        if last is not None:
+            day = last + timedelta(days=1)
+        else:
+            first = Event.objects.filter(session__site_id=site_id).aggregate(first=Min('timestamp'))['first']
+            if first is None:
+                continue
+            day = timezone.localdate(first)
+            if cutoff is not None:
+                day = max(day, timezone.localdate(cutoff))
+
+        while day <= through:
+            archive_day(site_id, day)
+            written += 1
+            day += timedelta(days=1)
+    return written
+
+
+class EventColumns:
+    """Column arrays of scanned events plus the values behind coded columns"""
+
+    def __init__(self, columns, dictionaries):
+        self.columns = columns
+        self.dictionaries = dictionaries
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def decode(self, name):
+        """Values of a coded column as an object array"""
+        return np.asarray(self.dictionaries[name] or [''], dtype=object)[self.columns[name]]
+
+
+def _codes_for(dictionary, values):
+    return [code for code, value in enumerate(dictionary) if value in values]
+
+
+def _filter_part(columns, dictionaries, start_ms, end_ms, event_types, page_ids, device_type):
+    timestamps = columns['timestamp']
+    mask = (timestamps >= start_ms) & (timestamps < end_ms)
+    if event_types is not None:
+        mask &= np.isin(columns['event_type'], _codes_for(dictionaries['event_type'], event_types))
+    if page_ids is not None:
+        mask &= np.isin(columns['page_id'], page_ids)
+    if device_type is not None:
+        mask &= np.isin(columns['device_type'], _codes_for(dictionaries['device_type'], {device_type}))
+    return mask
+
+
+def _merge(parts, names):
+    """Concatenate parts, remapping coded columns onto shared dictionaries"""
+    merged = {name: _Dictionary() for name in CODE_COLUMNS if name in names}
+    arrays = {name: [] for name in names}
+    for columns, dictionaries in parts:
+        for name in names:
+            values = np.asarray(columns[name])
+            if name in merged:
+                mapping = np.asarray(
+                    [merged[name].code(value) for value in dictionaries[name]] or [0], dtype='int32'
+                )
+                values = mapping[values]
+            arrays[name].append(values)
+    columns = {
+        name: np.concatenate(arrays[name]) if arrays[name] else np.empty(0, dtype=DTYPES[name])
+        for name in names
+    }
+    return EventColumns(columns, {name: dictionary.values for name, dictionary in merged.items()})
+
+
+def scan_events(site_id, start, end, event_types=None, page_ids=None, device_type=None, columns=COLUMNS):
+    """
+    Columns of a site's events with start <= timestamp < end, optionally
+    limited to some event types, pages (ids) and a device type. Archived days
+    are read from their files, the rest of the range from the database.
+    """
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    if timezone.is_naive(end):
+        end = timezone.make_aware(end)
+    event_types = set(event_types) if event_types is not None else None
+    page_ids = list(page_ids) if page_ids is not None else None
+    start_ms, end_ms = _epoch_ms(start), _epoch_ms(end)
+    names = tuple(columns)
+    needed = set(names) | {'timestamp', 'event_type', 'page_id', 'device_type'}
+
+    parts = []
+    archives = EventArchive.objects.filter(site_id=site_id)
+    span = archives.aggregate(first=Min('day'), last=Max('day'))
+    for archive in archives.filter(
+        day__gte=timezone.localdate(start), day__lte=timezone.localdate(end), row_count__gt=0
+    ):
+        part = _read(archive, needed)
+        mask = _filter_part(part, archive.dictionaries, start_ms, end_ms, event_types, page_ids, device_type)
+        parts.append(({name: np.asarray(part[name])[mask] for name in names}, archive.dictionaries))
+
+    # Everything outside the archived run comes from the database
+    events = Event.objects.filter(session__site_id=site_id, timestamp__gte=start, timestamp__lt=end)
+    if span['first'] is not None:
+        archived_start = _day_bounds(span['first'])[0]
+        archived_end = _day_bounds(span['last'])[1]
+        events = events.filter(Q(timestamp__lt=archived_start) | Q(timestamp__gte=archived_end))
+    if event_types is not None:
+        events = events.filter(event_type__in=event_types)
+    if page_ids is not None:
+        events = events.filter(page_id__in=page_ids)
+    if device_type is not None:
+        events = events.filter(session__device_type=device_type)
+    tail, dictionaries = _build_columns(events.values_list(*SOURCE_FIELDS).iterator(chunk_size=ROW_CHUNK_SIZE))
+    parts.append(({name: tail[name] for name in names}, dictionaries))
+
+    return _merge(parts, names)
@@ -0,0 +1,49 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from analytics import columnar
+from events.partitions import retention_cutoffs
+from sites.models import Site
+
+
+class Command(BaseCommand):
+    help = 'Write sealed days of events to the columnar archive used for historical scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--site', type=int, help='Only archive this site id')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Rewrite already archived days (between --start and --end) to pick up late events')
+        parser.add_argument('--start', help='First day to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Last day to rebuild (YYYY-MM-DD), defaults to the last sealed day')
+
+    def handle(self, *args, **options):
+        if not columnar.archive_available():
+            raise CommandError('The event archive needs numpy')
+
+        sites = Site.objects.all()
+        if options['site']:
+            sites = sites.filter(id=options['site'])
+        site_ids = list(sites.values_list('id', flat=True))
+        self.stdout.write(f"Writing {columnar.archive_format()} archives")
+
+        if options['rebuild']:
+            through = columnar.sealed_through()
+            try:
+                end = date.fromisoformat(options['end']) if options['end'] else through
+                start = date.fromisoformat(options['start']) if options['start'] else None
+            except ValueError as e:
+                raise CommandError(f'Invalid date: {e}')
+            if end > through:
+                raise CommandError(f'--end must not be after {through}, later days are still open')
+
+            rebuilt = 0
+            for site_id in site_ids:
+                days = columnar.EventArchive.objects.filter(site_id=site_id, day__lte=end)
+                if start is not None:
+                    days = days.filter(day__gte=start)
+                for day in days.order_by('day').values_list('day', flat=True):
+                    columnar.archive_day(site_id, day)
+                    rebuilt += 1
+            self.stdout.write(f"Rebuilt {rebuilt} archived days")
+
+        written = columnar.compact_event_archives(site_ids, retention=retention_cutoffs())
+        self.stdout.write(self.style.SUCCESS(f"Archived {written} new site days"))
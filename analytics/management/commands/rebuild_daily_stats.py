@@ -0,0 +1,45 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from analytics.rollups import rebuild_daily_stats
+from sites.models import Site
+
+
+class Command(BaseCommand):
+    help = 'Rebuild DailySiteStats dashboard rollups from sessions, recordings and events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Rebuild the last N closed days (default 30)')
+        parser.add_argument('--start', help='First day to rebuild (YYYY-MM-DD), overrides --days')
+        parser.add_argument('--end', help='Last day to rebuild (YYYY-MM-DD), defaults to yesterday')
+        parser.add_argument('--site', type=int, help='Only rebuild rollups for this site id')
+
+    def handle(self, *args, **options):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        try:
+            end = date.fromisoformat(options['end']) if options['end'] else yesterday
+            start = date.fromisoformat(options['start']) if options['start'] else end - timedelta(days=options['days'] - 1)
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        if start > end:
+            raise CommandError('--start must not be after --end')
+        if end > yesterday:
+            # Today is computed live by the dashboard and must not be stored
+            raise CommandError('--end must be before today')
+
+        sites = Site.objects.all()
+        if options['site']:
+            sites = sites.filter(id=options['site'])
+        site_ids = list(sites.values_list('id', flat=True))
+
+        # One month at a time keeps the aggregation queries bounded
+        total = 0
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(end, chunk_start + timedelta(days=30))
+            written = rebuild_daily_stats(chunk_start, chunk_end, site_ids)
+            total += written
+            self.stdout.write(f"{chunk_start} to {chunk_end}: {written} rows")
+            chunk_start = chunk_end + timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} daily stats rows from {start} to {end}"))
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from analytics.runner import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (analytics.runner) on a pool of threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=settings.TASK_WORKER_THREADS,
+                            help='Number of jobs run concurrently by this process')
+        parser.add_argument('--poll', type=float, default=settings.TASK_POLL_INTERVAL,
+                            help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        # Import task modules so their functions are registered
+        import analytics.tasks  # noqa: F401
+
+        worker = Worker(threads=options['threads'], poll_interval=options['poll'])
+        worker.start()
+        self.stdout.write(f"Task worker {worker.name} running {worker.threads} threads, press Ctrl+C to stop")
+        try:
+            worker.join()
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping, waiting for running jobs to finish')
+            worker.stop()
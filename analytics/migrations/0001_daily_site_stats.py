@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('sites', '0002_site_is_connected_site_last_activity_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySiteStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('sessions', models.IntegerField(default=0)),
+                ('unique_users', models.IntegerField(default=0)),
+                ('user_sketch', models.BinaryField(default=bytes)),
+                ('recordings', models.IntegerField(default=0)),
+                ('total_duration', models.BigIntegerField(default=0)),
+                ('pageviews', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.site')),
+            ],
+            options={
+                'unique_together': {('site', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0002_site_is_connected_site_last_activity_at'),
+        ('analytics', '0002_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('format', models.CharField(max_length=20)),
+                ('path', models.CharField(max_length=500)),
+                ('row_count', models.IntegerField(default=0)),
+                ('dictionaries', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now=True)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.site')),
+            ],
+            options={
+                'unique_together': {('site', 'day')},
+            },
+        ),
+    ]
@@ -1,3 +1,87 @@
+from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
+from sites.models import Site
 
-# Create your models here.
+
+class DailySiteStats(models.Model):
+    """
+    Dashboard totals for one site and calendar day, rebuilt from sessions,
+    recordings and page views by analytics.rollups
+    """
+    site = models.ForeignKey(Site, on_delete=models.CASCADE)
+    date = models.DateField()
+    sessions = models.IntegerField(default=0)
+    unique_users = models.IntegerField(default=0)
+    user_sketch = models.BinaryField(default=bytes)  # HyperLogLog registers of user identifiers
+    recordings = models.IntegerField(default=0)
+    total_duration = models.BigIntegerField(default=0)  # Sum of recording durations in seconds
+    pageviews = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['site', 'date']
+
+    def __str__(self):
+        return f"Stats for {self.site} on {self.date}"
+
+
+class Job(models.Model):
+    """
+    Background task queued through analytics.runner and executed by
+    `manage.py run_task_worker`
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUSES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    task = models.CharField(max_length=255)  # Dotted path of the registered task function
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUSES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)  # Traceback of the last failed attempt
+    worker = models.CharField(max_length=255, blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Refreshed by the worker while running
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f"{self.task} ({self.status})"
+
+
+class EventArchive(models.Model):
+    """
+    One sealed day of a site's events written to a columnar file by
+    analytics.columnar
+    """
+    site = models.ForeignKey(Site, on_delete=models.CASCADE)
+    day = models.DateField()
+    format = models.CharField(max_length=20)  # parquet or npy
+    path = models.CharField(max_length=500)  # Relative to EVENT_ARCHIVE_DIR
+    row_count = models.IntegerField(default=0)
+    dictionaries = models.JSONField(default=dict)  # Column name -> values its integer codes refer to
+    created_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['site', 'day']
+
+    def __str__(self):
+        return f"Event archive for {self.site} on {self.day}"
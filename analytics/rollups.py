@@ -0,0 +1,192 @@
+"""
+Daily per-site rollups for the dashboard
+
+DailySiteStats holds one row per site and day with session, user,
+recording, duration and page view totals, so the dashboard reads a date
+range with one indexed query instead of counting raw rows per day.
+
+Closed days are written by rebuild_daily_stats (the compact_daily_stats task
+and the rebuild_daily_stats command); days a reader finds missing are
+computed and stored on the spot. The task workers run compact_daily_stats
+every DAILY_STATS_COMPACT_EVERY seconds, rebuilding the last closed days so
+late sessions, recordings and events are counted. Today keeps changing, so
+it is always computed live and never stored.
+
+Unique users cannot be summed across days, so every row also stores a
+HyperLogLog sketch of its user identifiers. Sketches of any set of rows merge
+into an estimate of distinct users over the range (about 3% error, within
+a few users for small counts).
+"""
+import hashlib
+import math
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from analytics.models import DailySiteStats
+from events.models import Event, Session
+from recordings.models import Recording
+
+SKETCH_PRECISION = 10
+SKETCH_REGISTERS = 1 << SKETCH_PRECISION
+
+COUNTERS = ('sessions', 'unique_users', 'recordings', 'total_duration', 'pageviews')
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def user_sketch(identifiers):
+    """HyperLogLog registers for a collection of user identifiers"""
+    registers = bytearray(SKETCH_REGISTERS)
+    rest_bits = 64 - SKETCH_PRECISION
+    for identifier in identifiers:
+        value = _hash64(identifier)
+        index = value >> rest_bits
+        rest = value & ((1 << rest_bits) - 1)
+        rank = rest_bits - rest.bit_length() + 1
+        if rank > registers[index]:
+            registers[index] = rank
+    return bytes(registers)
+
+
+def merge_sketches(sketches):
+    merged = bytearray(SKETCH_REGISTERS)
+    for sketch in sketches:
+        if not sketch:
+            continue
+        for index, rank in enumerate(bytes(sketch)):
+            if rank > merged[index]:
+                merged[index] = rank
+    return bytes(merged)
+
+
+def estimate_users(sketch):
+    if not sketch:
+        return 0
+    registers = bytes(sketch)
+    m = SKETCH_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / sum(2.0 ** -rank for rank in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * m and zeros:
+        # Linear counting is far more accurate for small cardinalities
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+
+def _bounds(start_day, end_day):
+    """Aware datetimes covering [start_day, end_day] in the current time zone"""
+    start = timezone.make_aware(datetime.combine(start_day, time.min))
+    end = timezone.make_aware(datetime.combine(end_day + timedelta(days=1), time.min))
+    return start, end
+
+
+def _site_days(site_ids, start_day, end_day):
+    day = start_day
+    while day <= end_day:
+        for site_id in site_ids:
+            yield site_id, day
+        day += timedelta(days=1)
+
+
+def compute_daily_stats(site_ids, start_day, end_day):
+    """
+    Aggregate raw rows into {(site_id, day): DailySiteStats} for every site and
+    day in the range (days without activity included), without saving them
+    """
+    start, end = _bounds(start_day, end_day)
+    rows = {
+        (site_id, day): DailySiteStats(site_id=site_id, date=day, user_sketch=b'')
+        for site_id, day in _site_days(site_ids, start_day, end_day)
+    }
+
+    sessions = Session.objects.filter(site_id__in=site_ids, started_at__gte=start, started_at__lt=end)
+    for row in sessions.annotate(day=TruncDate('started_at')).values('site_id', 'day').annotate(count=Count('id')):
+        rows[(row['site_id'], row['day'])].sessions = row['count']
+
+    users = {}
+    for site_id, day, identifier in sessions.filter(user_identifier__isnull=False).annotate(
+        day=TruncDate('started_at')
+    ).values_list('site_id', 'day', 'user_identifier').distinct():
+        users.setdefault((site_id, day), []).append(identifier)
+    for key, identifiers in users.items():
+        rows[key].unique_users = len(identifiers)
+        rows[key].user_sketch = user_sketch(identifiers)
+
+    recordings = Recording.objects.filter(
+        session__site_id__in=site_ids, created_at__gte=start, created_at__lt=end
+    ).annotate(day=TruncDate('created_at')).values('session__site_id', 'day').annotate(
+        count=Count('id'), duration=Sum('duration')
+    )
+    for row in recordings:
+        stats = rows[(row['session__site_id'], row['day'])]
+        stats.recordings = row['count']
+        stats.total_duration = row['duration'] or 0
+
+    pageviews = Event.objects.filter(
+        session__site_id__in=site_ids, event_type='page_view', timestamp__gte=start, timestamp__lt=end
+    ).annotate(day=TruncDate('timestamp')).values('session__site_id', 'day').annotate(count=Count('id'))
+    for row in pageviews:
+        rows[(row['session__site_id'], row['day'])].pageviews = row['count']
+
+    return rows
+
+
+def rebuild_daily_stats(start_day, end_day, site_ids):
+    """
+    Recompute and replace the stored rollups of the given sites for a
+    closed date range. Returns the number of rows written.
+    """
+    rows = compute_daily_stats(site_ids, start_day, end_day)
+    with transaction.atomic():
+        DailySiteStats.objects.filter(
+            site_id__in=site_ids, date__gte=start_day, date__lte=end_day
+        ).delete()
+        DailySiteStats.objects.bulk_create(rows.values(), batch_size=500)
+    return len(rows)
+
+
+def daily_stats(site_ids, start_day, end_day):
+    """
+    Per-day totals summed over the given sites, plus the estimated number of
+    distinct users over the whole range. Returns (days, unique_users) where
+    days is a list of dicts ordered by date.
+    """
+    site_ids = list(site_ids)
+    today = timezone.localdate()
+    sealed_end = min(end_day, today - timedelta(days=1))
+
+    rows = list(DailySiteStats.objects.filter(
+        site_id__in=site_ids, date__gte=start_day, date__lte=sealed_end
+    ))
+
+    if start_day <= sealed_end:
+        stored = {(row.site_id, row.date) for row in rows}
+        expected = len(site_ids) * ((sealed_end - start_day).days + 1)
+        if len(stored) < expected:
+            # Fill closed days the compaction job has not written yet
+            missing_days = sorted({
+                day for site_id, day in _site_days(site_ids, start_day, sealed_end) if (site_id, day) not in stored
+            })
+            computed = compute_daily_stats(site_ids, missing_days[0], missing_days[-1])
+            new_rows = [row for key, row in computed.items() if key not in stored]
+            DailySiteStats.objects.bulk_create(new_rows, batch_size=500, ignore_conflicts=True)
+            rows.extend(new_rows)
+
+    if end_day >= today:
+        rows.extend(compute_daily_stats(site_ids, max(start_day, today), today).values())
+
+    days = {}
+    day = start_day
+    while day <= end_day:
+        days[day] = {'date': day.isoformat(), **{counter: 0 for counter in COUNTERS}}
+        day += timedelta(days=1)
+    for row in rows:
+        totals = days[row.date]
+        for counter in COUNTERS:
+            totals[counter] += getattr(row, counter)
+
+    return list(days.values()), estimate_users(merge_sketches(row.user_sketch for row in rows))
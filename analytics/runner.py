@@ -0,0 +1,296 @@
+"""
+Database-backed task runner
+
+Functions decorated with shared_task keep working as plain calls and gain
+Celery-style delay()/apply_async(), which store a Job row and return it
+immediately. `manage.py run_task_worker` runs queued jobs on a pool of
+threads. It needs no broker: jobs are claimed with a conditional UPDATE, so
+any number of worker processes can share the table on PostgreSQL or SQLite.
+
+Failed attempts are retried with exponential backoff (TASK_RETRY_DELAY,
+doubling) until the job's max_attempts. Workers refresh heartbeat_at of
+their running jobs every TASK_HEARTBEAT_INTERVAL seconds; a running job
+without a heartbeat for TASK_TIMEOUT seconds belonged to a dead worker and
+is requeued, however long a live worker takes.
+
+Tasks registered with @shared_task(every=seconds) are periodic: every
+TASK_SCHEDULE_INTERVAL seconds a worker queues those whose last job was
+created more than `every` seconds ago and that have none queued or running.
+Two workers checking at the same moment can both queue one, so periodic
+tasks must be safe to run twice.
+
+With TASK_WORKER_IN_PROCESS the web process starts a worker on the first
+enqueue, like the event spool flusher, so deployments without a separate
+worker process still run their jobs. With TASK_ALWAYS_EAGER the job is
+still recorded but runs inline, for development without a worker.
+"""
+import functools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+from analytics.models import Job
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+class Task:
+    """Registered task function with Celery-style enqueueing"""
+
+    def __init__(self, func, max_attempts=None, every=None):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.name = f"{func.__module__}.{func.__name__}"
+        self.max_attempts = max_attempts
+        self.every = every  # Seconds between periodic runs, None when only queued on demand
+        _registry[self.name] = self
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        return self.apply_async(args, kwargs)
+
+    def apply_async(self, args=(), kwargs=None, owner=None, countdown=None):
+        """Queue a job and return it; args and kwargs must be JSON serializable"""
+        job = self.create_job(args, kwargs, owner, countdown)
+        if settings.TASK_ALWAYS_EAGER and not countdown:
+            if claim_job(job.id, 'eager'):
+                job.refresh_from_db()
+                run_job(job)
+                job.refresh_from_db()
+        elif settings.TASK_WORKER_IN_PROCESS:
+            ensure_worker()
+        return job
+
+    def create_job(self, args=(), kwargs=None, owner=None, countdown=None):
+        """Store a queued job without running or starting a worker"""
+        return Job.objects.create(
+            task=self.name,
+            args=list(args),
+            kwargs=kwargs or {},
+            owner=owner,
+            max_attempts=self.max_attempts or settings.TASK_MAX_ATTEMPTS,
+            run_after=timezone.now() + timedelta(seconds=countdown or 0),
+        )
+
+
+def shared_task(func=None, max_attempts=None, every=None):
+    """
+    Register a task, usable as @shared_task or @shared_task(max_attempts=5).
+    every=seconds makes it periodic, queued by the workers' schedule.
+    """
+    if func is None:
+        return lambda f: Task(f, max_attempts, every)
+    return Task(func, max_attempts, every)
+
+
+def get_task(name):
+    if name not in _registry:
+        # Task modules register on import
+        module = name.rsplit('.', 1)[0]
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+    return _registry.get(name)
+
+
+def _jsonable(value):
+    try:
+        json.dumps(value)
+        return value
+    except (TypeError, ValueError):
+        return repr(value)
+
+
+def claim_job(job_id, worker):
+    """Atomically move a queued job to running; False if another worker won"""
+    now = timezone.now()
+    return bool(Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+        status=Job.RUNNING,
+        worker=worker,
+        started_at=now,
+        heartbeat_at=now,
+        attempts=F('attempts') + 1,
+    ))
+
+
+def claim_next(worker):
+    """Claim the oldest due job, or return None"""
+    candidates = Job.objects.filter(
+        status=Job.QUEUED, run_after__lte=timezone.now()
+    ).order_by('run_after', 'id').values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        if claim_job(job_id, worker):
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def run_job(job):
+    """Execute a claimed job and record its outcome"""
+    task = get_task(job.task)
+    try:
+        if task is None:
+            raise LookupError(f"Unknown task {job.task}")
+        result = task.func(*job.args, **job.kwargs)
+    except Exception:
+        job.error = traceback.format_exc()
+        job.worker = ''
+        if task is not None and job.attempts < job.max_attempts:
+            delay = settings.TASK_RETRY_DELAY * 2 ** (job.attempts - 1)
+            job.status = Job.QUEUED
+            job.run_after = timezone.now() + timedelta(seconds=delay)
+            logger.warning('Job %s (%s) failed, retry %s in %ss', job.id, job.task, job.attempts, delay)
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+            logger.error('Job %s (%s) failed permanently', job.id, job.task)
+        job.save(update_fields=['status', 'error', 'worker', 'run_after', 'finished_at'])
+    else:
+        job.status = Job.SUCCEEDED
+        job.result = _jsonable(result)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'result', 'finished_at'])
+
+
+def heartbeat(job_ids):
+    """Mark running jobs as alive"""
+    if not job_ids:
+        return 0
+    return Job.objects.filter(id__in=job_ids, status=Job.RUNNING).update(heartbeat_at=timezone.now())
+
+
+def requeue_stale_jobs():
+    """
+    Return jobs of dead workers, whose heartbeat stopped, to the queue (or
+    fail them when out of attempts)
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.TASK_TIMEOUT)
+    stale = Job.objects.filter(status=Job.RUNNING).filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, error='Timed out', finished_at=timezone.now()
+    )
+    requeued = stale.update(status=Job.QUEUED, worker='', run_after=timezone.now())
+    return requeued, failed
+
+
+def schedule_periodic_tasks():
+    """Queue the periodic tasks that are due; returns the new jobs"""
+    now = timezone.now()
+    queued = []
+    for task in list(_registry.values()):
+        if not task.every:
+            continue
+        jobs = Job.objects.filter(task=task.name)
+        if jobs.filter(
+            Q(status__in=[Job.QUEUED, Job.RUNNING]) | Q(created_at__gt=now - timedelta(seconds=task.every))
+        ).exists():
+            continue
+        queued.append(task.create_job())
+    return queued
+
+
+class Worker:
+    """Pool of threads that claim and run jobs until stopped"""
+
+    def __init__(self, threads=None, poll_interval=None):
+        self.threads = threads or settings.TASK_WORKER_THREADS
+        self.poll_interval = poll_interval or settings.TASK_POLL_INTERVAL
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads = []
+        self._running = set()  # Ids of the jobs this process is running
+        self._running_lock = threading.Lock()
+        self._next_schedule = 0.0
+
+    def start(self):
+        for index in range(self.threads):
+            thread = threading.Thread(
+                target=self._loop, args=(index,), name=f'task-worker-{index}', daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat_loop, name='task-worker-heartbeat', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def is_alive(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def join(self):
+        for thread in self._threads:
+            while thread.is_alive():
+                thread.join(1)
+
+    def _loop(self, index):
+        worker = f"{self.name}:{index}"
+        while not self._stop.is_set():
+            try:
+                if index == 0:
+                    requeue_stale_jobs()
+                    if time.monotonic() >= self._next_schedule:
+                        self._next_schedule = time.monotonic() + settings.TASK_SCHEDULE_INTERVAL
+                        schedule_periodic_tasks()
+                job = claim_next(worker)
+                if job is not None:
+                    with self._running_lock:
+                        self._running.add(job.id)
+                    try:
+                        run_job(job)
+                    finally:
+                        with self._running_lock:
+                            self._running.discard(job.id)
+            except Exception:
+                logger.exception('Task worker %s error', worker)
+                job = None
+            finally:
+                close_old_connections()
+            if job is None:
+                self._stop.wait(self.poll_interval)
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(settings.TASK_HEARTBEAT_INTERVAL):
+            with self._running_lock:
+                running = list(self._running)
+            try:
+                heartbeat(running)
+            except Exception:
+                logger.exception('Task worker %s heartbeat failed', self.name)
+            finally:
+                close_old_connections()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def ensure_worker():
+    """Start the in-process worker if it is not already running"""
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            # Task modules register on import
+            import analytics.tasks  # noqa: F401
+            _worker = Worker(threads=settings.TASK_WORKER_IN_PROCESS_THREADS)
+            _worker.start()
+    return _worker
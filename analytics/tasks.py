@@ -1,78 +1,37 @@
 # from celery import shared_task
+from django.conf import settings
 from django.db.models import Count
 from events.models import Event
-from heatmaps.models import HeatmapData
+from heatmaps.aggregation import HEATMAP_EVENT_TYPES
+from heatmaps.cache import cached_tile_counts
 from datetime import datetime, timedelta
+from analytics.runner import shared_task
 
-# Dummy decorator if celery is not available
-def shared_task(func):
-    return func
 
 @shared_task
 def generate_heatmap_data(site_id, page_url, heatmap_type='click', device_type='desktop', days=7):
     """
-    Generate heatmap data by aggregating events
+    Warm the HeatmapData cache entry that the dashboard reads for this
+    page, type, device and date range
     """
     from sites.models import Site
     
     try:
         site = Site.objects.get(id=site_id)
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=days)
-        
-        # Fetch events for the specified page and type
-        events = Event.objects.filter(
-            session__site=site,
-            page_url=page_url,
-            event_type=heatmap_type,
-            timestamp__date__gte=start_date,
-            timestamp__date__lte=end_date,
-            session__device_type=device_type
-        )
-        
-        # Aggregate coordinates
-        heatmap_points = []
-        for event in events:
-            if 'x' in event.data and 'y' in event.data:
-                heatmap_points.append({
-                    'x': event.data['x'],
-                    'y': event.data['y'],
-                    'value': 1
-                })
-        
-        # Aggregate duplicate points
-        aggregated = {}
-        for point in heatmap_points:
-            key = f"{point['x']},{point['y']}"
-            if key in aggregated:
-                aggregated[key]['value'] += 1
-            else:
-                aggregated[key] = point
-        
-        heatmap_data = list(aggregated.values())
-        
-        # Save or update heatmap
-        HeatmapData.objects.update_or_create(
-            site=site,
-            page_url=page_url,
-            heatmap_type=heatmap_type,
-            device_type=device_type,
-            date_range_start=start_date,
-            date_range_end=end_date,
-            defaults={
-                'data': heatmap_data,
-                'session_count': Event.objects.filter(
-                    session__site=site,
-                    page_url=page_url,
-                    timestamp__date__gte=start_date,
-                    timestamp__date__lte=end_date
-                ).values('session').distinct().count()
-            }
-        )
-        
-        return f"Heatmap generated for {page_url}"
-    except Exception as e:
-        return f"Error generating heatmap: {str(e)}"
+    except Site.DoesNotExist:
+        return f"Error generating heatmap: site {site_id} not found"
+    
+    # Other errors propagate so the task runner can retry the job
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=days)
+    
+    counts, total_events, session_count, cache_status = cached_tile_counts(
+        site, page_url, heatmap_type,
+        HEATMAP_EVENT_TYPES.get(heatmap_type, 'click'),
+        device_type, start_date, end_date
+    )
+    
+    return f"Heatmap generated for {page_url} ({cache_status}, {len(counts)} points)"
 
 
 @shared_task
@@ -119,35 +78,82 @@ def process_recording(session_id):
 @shared_task
 def calculate_funnel_metrics(funnel_id):
     """
-    Calculate conversion metrics for a funnel
+    Bring a funnel's stored daily results up to date
     """
     from funnels.models import Funnel
-    from events.models import Session, Event
+    from funnels.results import refresh_funnel_results
     
     try:
-        funnel = Funnel.objects.get(id=funnel_id)
-        steps = funnel.steps
-        
-        # This is a simplified implementation
-        # In production, you'd track sessions through each step
-        
-        metrics = {
-            'total_sessions': Session.objects.filter(site=funnel.site).count(),
-            'steps': []
-        }
-        
-        for step in steps:
-            step_sessions = Event.objects.filter(
-                session__site=funnel.site,
-                page_url=step.get('url', '')
-            ).values('session').distinct().count()
-            
-            metrics['steps'].append({
-                'name': step.get('name', ''),
-                'sessions': step_sessions,
-                'conversion_rate': (step_sessions / metrics['total_sessions'] * 100) if metrics['total_sessions'] > 0 else 0
-            })
-        
-        return f"Funnel metrics calculated: {metrics}"
-    except Exception as e:
-        return f"Error calculating funnel metrics: {str(e)}"
+        funnel = Funnel.objects.select_related('site').get(id=funnel_id)
+        days = refresh_funnel_results(funnel)
+        return f"Funnel {funnel_id} results refreshed ({days} days evaluated)"
+    except Funnel.DoesNotExist:
+        return f"Error calculating funnel metrics: funnel {funnel_id} not found"
+
+
+@shared_task(every=settings.FUNNEL_REFRESH_EVERY)
+def refresh_all_funnel_results():
+    """
+    Refresh every funnel past its watermark, run periodically from the task
+    workers' schedule
+    """
+    from funnels.models import Funnel
+    
+    funnel_ids = Funnel.objects.values_list('id', flat=True)
+    return [calculate_funnel_metrics(funnel_id) for funnel_id in funnel_ids]
+
+
+@shared_task(every=settings.DAILY_STATS_COMPACT_EVERY)
+def compact_daily_stats(days=2):
+    """
+    Rebuild the dashboard rollups of the last closed days, picking up
+    recordings and events that arrived after a day was first rolled up.
+    Runs periodically from the task workers' schedule.
+    """
+    from django.utils import timezone
+    from sites.models import Site
+    from analytics.rollups import rebuild_daily_stats
+    
+    end_day = timezone.localdate() - timedelta(days=1)
+    start_day = end_day - timedelta(days=days - 1)
+    site_ids = list(Site.objects.values_list('id', flat=True))
+    written = rebuild_daily_stats(start_day, end_day, site_ids)
+    return f"Daily stats rebuilt for {start_day} to {end_day} ({written} rows)"
+
+
+@shared_task(every=settings.EVENT_ARCHIVE_COMPACT_EVERY)
+def compact_event_archives(site_id=None):
+    """
+    Write sealed event days to the columnar archive and drop archived days
+    past each site's retention. Runs periodically from the task workers'
+    schedule.
+    """
+    from sites.models import Site
+    from analytics.columnar import archive_available, compact_event_archives as compact
+    from events.partitions import retention_cutoffs
+
+    if not archive_available():
+        return "numpy is not installed, nothing archived"
+
+    sites = Site.objects.all()
+    if site_id is not None:
+        sites = sites.filter(id=site_id)
+    written = compact(list(sites.values_list('id', flat=True)), retention=retention_cutoffs())
+    return f"Archived {written} site days"
+
+
+@shared_task(every=settings.SCROLL_DEPTH_COMPACT_EVERY)
+def compact_scroll_depth(days=2):
+    """
+    Rebuild the stored scroll depth histograms of the last closed days,
+    picking up late events. Runs periodically from the task workers' schedule.
+    """
+    from django.utils import timezone
+    from sites.models import Site
+    from heatmaps.scroll import rebuild_scroll_depth
+
+    yesterday = timezone.localdate() - timedelta(days=1)
+    written = 0
+    for site_id in Site.objects.values_list('id', flat=True):
+        written += rebuild_scroll_depth(site_id, yesterday - timedelta(days=days - 1), yesterday)
+    return f"Scroll depth rebuilt for {days} days ({written} rows)"
@@ -1,3 +1,227 @@
-from django.test import TestCase
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from analytics.models import DailySiteStats, Job
+from analytics.rollups import daily_stats, estimate_users, merge_sketches, user_sketch
+from analytics.runner import claim_job, get_task, heartbeat, requeue_stale_jobs, schedule_periodic_tasks
+from events.models import Session
+from events.session_cache import get_session_cache
+from funnels.models import Funnel, FunnelResult
+from recordings.models import Recording
+from sites.models import Site
 
-# Create your tests here.
+
+@override_settings(TASK_WORKER_IN_PROCESS=False)
+class QueryCountTestCase(TestCase):
+    """
+    Base class for endpoint query-count regressions: the number of queries an
+    endpoint runs must not grow with the amount of data it reads
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='secret')
+        self.site = Site.objects.create(owner=self.user, name='Shop', domain='shop.example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.sequence = 0
+        # Session ids are reused between tests, cached lookups must not leak
+        get_session_cache().clear()
+
+    def create_session(self, pages=('/',), recording=True, **fields):
+        """Session with one page view per page, created through the ingest endpoint"""
+        session = Session.objects.create(
+            site=self.site, device_type='desktop', browser='Chrome', os='Linux', viewport={}, **fields
+        )
+        now = timezone.now()
+        events = [{
+            'session': session.id,
+            'event_type': 'page_view',
+            'timestamp': (now + timedelta(seconds=i)).isoformat(),
+            'page_url': f'https://shop.example.com{page}',
+            'data': {},
+        } for i, page in enumerate(pages)]
+        response = self.client.post('/api/track/events/', events, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        if recording:
+            self.sequence += 1
+            Recording.objects.create(session=session, recording_id=f'rec_{self.sequence}', duration=90)
+        return session
+
+    def count_queries(self, path, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path, params or {})
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, path, grow, params=None, max_queries=None):
+        """
+        Call the endpoint, add data with grow(), call it again and require
+        the same number of queries both times
+        """
+        # First call fills read-through rollups, only steady state counts
+        self.count_queries(path, params)
+        before = self.count_queries(path, params)
+        grow()
+        self.count_queries(path, params)
+        after = self.count_queries(path, params)
+        self.assertEqual(before, after, f'{path} went from {before} to {after} queries as data grew')
+        if max_queries is not None:
+            self.assertLessEqual(after, max_queries)
+
+
+class DashboardStatsQueryTests(QueryCountTestCase):
+    path = '/api/analytics/dashboard/'
+
+    def test_query_count_does_not_grow_with_recordings(self):
+        for _ in range(2):
+            self.create_session()
+
+        def grow():
+            for _ in range(10):
+                self.create_session(pages=('/pricing', '/checkout'))
+
+        self.assertConstantQueries(self.path, grow, {'days': 30}, max_queries=10)
+
+    def test_recent_recordings_show_landing_page(self):
+        self.create_session(pages=('/pricing', '/checkout'))
+        response = self.client.get(self.path)
+        self.assertEqual(response.data['recent_recordings'][0]['page'], 'https://shop.example.com/pricing')
+
+    def test_landing_page_falls_back_to_first_page_view(self):
+        session = self.create_session(pages=('/docs', '/pricing'))
+        Session.objects.filter(id=session.id).update(landing_page=None)
+        response = self.client.get(self.path)
+        self.assertEqual(response.data['recent_recordings'][0]['page'], 'https://shop.example.com/docs')
+
+    def test_landing_page_is_kept_by_later_batches(self):
+        session = self.create_session(pages=('/blog',))
+        self.client.post('/api/track/events/', [{
+            'session': session.id,
+            'event_type': 'page_view',
+            'timestamp': timezone.now().isoformat(),
+            'page_url': 'https://shop.example.com/about',
+            'data': {},
+        }], format='json')
+        session.refresh_from_db()
+        self.assertEqual(session.landing_page, 'https://shop.example.com/blog')
+
+
+class FunnelAnalyticsQueryTests(QueryCountTestCase):
+
+    def test_query_count_does_not_grow_with_sessions(self):
+        funnel = Funnel.objects.create(site=self.site, name='Checkout', steps=[
+            {'name': 'Pricing', 'url': '/pricing'},
+            {'name': 'Checkout', 'url': '/checkout'},
+        ])
+        self.create_session(pages=('/pricing',), recording=False)
+
+        def grow():
+            for _ in range(10):
+                self.create_session(pages=('/pricing', '/checkout'), recording=False)
+
+        self.assertConstantQueries(f'/api/analytics/funnels/{funnel.id}/', grow)
+
+    def test_stale_results_are_refreshed_in_the_background(self):
+        funnel = Funnel.objects.create(site=self.site, name='Checkout', steps=[
+            {'name': 'Pricing', 'url': '/pricing'},
+            {'name': 'Checkout', 'url': '/checkout'},
+        ])
+        self.create_session(pages=('/pricing', '/checkout'), recording=False)
+        old = self.create_session(pages=('/pricing',), recording=False)
+        Session.objects.filter(id=old.id).update(
+            started_at=timezone.now() - timedelta(days=settings.FUNNEL_RESULT_DAYS + 10)
+        )
+
+        for _ in range(2):
+            response = self.client.get(f'/api/analytics/funnels/{funnel.id}/')
+        self.assertFalse(FunnelResult.objects.filter(funnel=funnel).exists())
+        self.assertEqual(Job.objects.filter(task='analytics.tasks.calculate_funnel_metrics').count(), 1)
+        self.assertIsNone(response.data['freshness']['stale_days'])
+        self.assertIsNotNone(response.data['freshness']['refresh_job'])
+        # Sessions outside the stored window do not dilute the conversion
+        self.assertEqual(response.data['total_sessions'], 1)
+        self.assertEqual(response.data['overall_conversion'], 100.0)
+
+
+class JobHeartbeatTests(TestCase):
+
+    def setUp(self):
+        self.job = Job.objects.create(task='analytics.tasks.compact_daily_stats')
+        self.assertTrue(claim_job(self.job.id, 'test'))
+        self.long_ago = timezone.now() - timedelta(seconds=settings.TASK_TIMEOUT + 60)
+
+    def test_long_running_job_with_heartbeat_is_kept(self):
+        Job.objects.filter(id=self.job.id).update(started_at=self.long_ago)
+        heartbeat([self.job.id])
+        self.assertEqual(requeue_stale_jobs(), (0, 0))
+        self.assertEqual(Job.objects.get(id=self.job.id).status, Job.RUNNING)
+
+    def test_job_without_heartbeat_is_requeued(self):
+        Job.objects.filter(id=self.job.id).update(started_at=self.long_ago, heartbeat_at=self.long_ago)
+        self.assertEqual(requeue_stale_jobs(), (1, 0))
+        self.assertEqual(Job.objects.get(id=self.job.id).status, Job.QUEUED)
+
+
+class PeriodicTaskTests(TestCase):
+
+    def setUp(self):
+        self.task = get_task('analytics.tasks.compact_daily_stats')
+
+    def scheduled(self):
+        return [job.task for job in schedule_periodic_tasks()]
+
+    def test_due_task_is_queued_once(self):
+        self.assertIn(self.task.name, self.scheduled())
+        self.assertNotIn(self.task.name, self.scheduled())
+        self.assertEqual(Job.objects.filter(task=self.task.name).count(), 1)
+
+    def test_task_is_queued_again_after_its_interval(self):
+        job = self.task.create_job()
+        Job.objects.filter(id=job.id).update(status=Job.SUCCEEDED)
+        self.assertNotIn(self.task.name, self.scheduled())
+        Job.objects.filter(id=job.id).update(created_at=timezone.now() - timedelta(seconds=self.task.every + 1))
+        self.assertIn(self.task.name, self.scheduled())
+
+
+class UserSketchTests(TestCase):
+
+    def test_small_counts_are_close(self):
+        for count in (0, 1, 7, 20):
+            self.assertEqual(estimate_users(user_sketch(f'user-{i}' for i in range(count))), count)
+        for count in (100, 500):
+            estimate = estimate_users(user_sketch(f'user-{i}' for i in range(count)))
+            self.assertAlmostEqual(estimate / count, 1, delta=0.05)
+
+    def test_large_counts_stay_within_error(self):
+        estimate = estimate_users(user_sketch(f'user-{i}' for i in range(20000)))
+        self.assertAlmostEqual(estimate / 20000, 1, delta=0.08)
+
+    def test_merge_equals_sketch_of_union(self):
+        monday = [f'user-{i}' for i in range(0, 3000)]
+        tuesday = [f'user-{i}' for i in range(2000, 5000)]
+        merged = merge_sketches([user_sketch(monday), user_sketch(tuesday), b''])
+        self.assertEqual(merged, user_sketch(set(monday) | set(tuesday)))
+
+    def test_daily_stats_count_returning_users_once(self):
+        user = User.objects.create_user(username='owner', password='secret')
+        site = Site.objects.create(owner=user, name='Shop', domain='shop.example.com')
+        today = timezone.localdate()
+        for days_ago, users in ((0, ['a', 'b']), (1, ['a', 'c']), (3, ['a', 'b', 'd'])):
+            for identifier in users:
+                session = Session.objects.create(
+                    site=site, device_type='desktop', browser='b', os='o', viewport={}, user_identifier=identifier
+                )
+                Session.objects.filter(id=session.id).update(started_at=timezone.now() - timedelta(days=days_ago))
+
+        days, unique_users = daily_stats([site.id], today - timedelta(days=4), today)
+        self.assertEqual(unique_users, 4)
+        self.assertEqual([day['unique_users'] for day in days], [0, 3, 0, 2, 2])
+        # Closed days were stored on the first read, the second read merges their sketches
+        self.assertEqual(DailySiteStats.objects.filter(site=site).count(), 4)
+        self.assertEqual(daily_stats([site.id], today - timedelta(days=4), today)[1], 4)
@@ -1,7 +1,8 @@
 from django.urls import path
-from .views import dashboard_stats, funnel_analytics
+from .views import dashboard_stats, funnel_analytics, job_status
 
 urlpatterns = [
     path('dashboard/', dashboard_stats, name='dashboard_stats'),
     path('funnels/<int:funnel_id>/', funnel_analytics, name='funnel_analytics'),
+    path('jobs/<int:job_id>/', job_status, name='job_status'),
 ]
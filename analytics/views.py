@@ -1,9 +1,15 @@
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.db.models import Count, Avg, F
+from django.conf import settings
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from events.models import Session, Event
+from funnels.results import funnel_results
 from recordings.models import Recording
+from analytics.models import Job
+from analytics.rollups import daily_stats
 from datetime import datetime, timedelta
 
 @api_view(['GET'])
@@ -21,30 +27,17 @@ def dashboard_stats(request):
     from sites.models import Site
     user_sites = Site.objects.filter(owner=request.user)
     
-    # Total sessions
-    total_sessions = Session.objects.filter(
-        site__in=user_sites,
-        started_at__gte=start_date
-    ).count()
-    
-    # Active users (unique user_identifiers)
-    active_users = Session.objects.filter(
-        site__in=user_sites,
-        started_at__gte=start_date,
-        user_identifier__isnull=False
-    ).values('user_identifier').distinct().count()
-    
-    # Total recordings
-    total_recordings = Recording.objects.filter(
-        session__site__in=user_sites,
-        created_at__gte=start_date
-    ).count()
-    
-    # Average session duration
-    avg_duration = Recording.objects.filter(
-        session__site__in=user_sites,
-        created_at__gte=start_date
-    ).aggregate(avg=Avg('duration'))['avg'] or 0
+    # Sessions, users, recordings and durations from the daily rollups
+    end_day = timezone.localdate()
+    trend_days, active_users = daily_stats(
+        user_sites.values_list('id', flat=True),
+        end_day - timedelta(days=days - 1),
+        end_day
+    )
+    total_sessions = sum(day['sessions'] for day in trend_days)
+    total_recordings = sum(day['recordings'] for day in trend_days)
+    total_duration = sum(day['total_duration'] for day in trend_days)
+    avg_duration = total_duration / total_recordings if total_recordings else 0
     
     # Top pages by session count
     top_pages = Event.objects.filter(
@@ -55,33 +48,28 @@ def dashboard_stats(request):
         count=Count('id')
     ).order_by('-count')[:10]
     
-    # Recent recordings
+    # Recent recordings, with the landing page stored at ingest (sessions
+    # from before that fall back to their first page view in the same query)
+    first_page_view = Event.objects.filter(
+        session=OuterRef('session'),
+        event_type='page_view'
+    ).order_by('timestamp', 'id').values('page_url')[:1]
     recent_recordings = Recording.objects.filter(
         session__site__in=user_sites
-    ).select_related('session').order_by('-created_at')[:10]
+    ).select_related('session').annotate(
+        landing_page=Coalesce(F('session__landing_page'), Subquery(first_page_view))
+    ).order_by('-created_at')[:10]
     
     recent_recordings_data = [{
         'id': r.recording_id,
         'user': r.session.user_identifier or 'Anonymous',
         'duration': f"{r.duration // 60}m {r.duration % 60}s",
-        'page': Event.objects.filter(session=r.session, event_type='page_view').first().page_url if Event.objects.filter(session=r.session, event_type='page_view').exists() else '/',
+        'page': r.landing_page or '/',
         'timestamp': r.created_at.isoformat()
     } for r in recent_recordings]
     
     # Sessions trend (daily breakdown)
-    sessions_trend = []
-    for i in range(days):
-        day = start_date + timedelta(days=i)
-        day_end = day + timedelta(days=1)
-        count = Session.objects.filter(
-            site__in=user_sites,
-            started_at__gte=day,
-            started_at__lt=day_end
-        ).count()
-        sessions_trend.append({
-            'date': day.strftime('%Y-%m-%d'),
-            'count': count
-        })
+    sessions_trend = [{'date': day['date'], 'count': day['sessions']} for day in trend_days]
     
     return Response({
         'total_sessions': total_sessions,
@@ -115,31 +103,28 @@ def funnel_analytics(request, funnel_id):
     steps = funnel.steps
     analytics = []
     
-    # Get all sessions for this site
-    all_sessions = Session.objects.filter(site=funnel.site)
-    total_sessions = all_sessions.count()
+    # Optional window in days (default: the FUNNEL_RESULT_DAYS of stored
+    # history); sessions and step counts cover the same days
+    days = int(request.GET.get('days') or settings.FUNNEL_RESULT_DAYS + 1)
+    start_day = timezone.localdate() - timedelta(days=days - 1)
+    total_sessions = Session.objects.filter(site=funnel.site, started_at__date__gte=start_day).count()
     
-    previous_step_sessions = set(all_sessions.values_list('id', flat=True))
+    # Sessions reaching each step in order, from the stored daily results
+    step_counts, freshness = funnel_results(funnel, start_day)
     
+    previous_count = total_sessions
     for index, step in enumerate(steps):
-        # Find sessions that reached this step
-        step_events = Event.objects.filter(
-            session__in=previous_step_sessions,
-            page_url__icontains=step.get('url', '')
-        ).values_list('session_id', flat=True).distinct()
-        
-        step_sessions = set(step_events)
-        step_count = len(step_sessions)
+        step_count = step_counts[index]
         
         # Calculate conversion rate
         if index == 0:
             conversion_rate = 100.0
         else:
-            conversion_rate = (step_count / len(previous_step_sessions) * 100) if previous_step_sessions else 0
+            conversion_rate = (step_count / previous_count * 100) if previous_count else 0
         
         # Calculate drop-off
-        drop_off_count = len(previous_step_sessions) - step_count
-        drop_off_rate = (drop_off_count / len(previous_step_sessions) * 100) if previous_step_sessions else 0
+        drop_off_count = previous_count - step_count
+        drop_off_rate = (drop_off_count / previous_count * 100) if previous_count else 0
         
         analytics.append({
             'step_number': index + 1,
@@ -152,12 +137,42 @@ def funnel_analytics(request, funnel_id):
             'overall_conversion': round((step_count / total_sessions * 100) if total_sessions else 0, 2)
         })
         
-        previous_step_sessions = step_sessions
+        previous_count = step_count
     
     return Response({
         'funnel_id': funnel_id,
         'funnel_name': funnel.name,
+        'start_day': start_day.isoformat(),
         'total_sessions': total_sessions,
         'steps': analytics,
-        'overall_conversion': analytics[-1]['overall_conversion'] if analytics else 0
+        'overall_conversion': analytics[-1]['overall_conversion'] if analytics else 0,
+        'freshness': freshness
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def job_status(request, job_id):
+    """
+    Status and result of a background job
+    """
+    try:
+        job = Job.objects.get(id=job_id)
+    except Job.DoesNotExist:
+        return Response({'error': 'Job not found'}, status=404)
+    if job.owner_id != request.user.id and not request.user.is_staff:
+        return Response({'error': 'Job not found'}, status=404)
+    
+    error = job.error.strip().splitlines()[-1] if job.error else None
+    return Response({
+        'id': job.id,
+        'task': job.task.rsplit('.', 1)[-1],
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'result': job.result,
+        'error': error,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
     })
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 from pathlib import Path
 import os
 import dj_database_url
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -49,6 +50,9 @@ CORS_ALLOWED_ORIGINS = [
 ]
 CORS_ALLOW_ALL_ORIGINS = True  # Keep true for dev, but above list is for explicit support
 
+# Tracking scripts send compressed recording payloads
+CORS_ALLOW_HEADERS = (*default_headers, 'content-encoding')
+
 
 # Application definition
 
@@ -224,3 +228,119 @@ CACHES = {
 #         }
 #     }
 # }
+
+# Event ingestion spool (write-behind buffer for /api/track/events/)
+# When enabled, event batches are appended to segment files on local disk and
+# acknowledged immediately; a background thread flushes them to the database.
+# Set EVENT_SPOOL_WORKER=False to flush only from `manage.py flush_event_spool`.
+EVENT_SPOOL_ENABLED = os.environ.get('EVENT_SPOOL_ENABLED', 'False') == 'True'
+EVENT_SPOOL_WORKER = os.environ.get('EVENT_SPOOL_WORKER', 'True') == 'True'
+EVENT_SPOOL_DIR = os.environ.get('EVENT_SPOOL_DIR', str(BASE_DIR / 'spool' / 'events'))
+EVENT_SPOOL_SEGMENT_BYTES = int(os.environ.get('EVENT_SPOOL_SEGMENT_BYTES', 4 * 1024 * 1024))
+EVENT_SPOOL_SEGMENT_AGE = float(os.environ.get('EVENT_SPOOL_SEGMENT_AGE', 30))  # Seconds before a segment is sealed however small
+EVENT_SPOOL_MAX_BYTES = int(os.environ.get('EVENT_SPOOL_MAX_BYTES', 512 * 1024 * 1024))
+EVENT_SPOOL_FLUSH_INTERVAL = float(os.environ.get('EVENT_SPOOL_FLUSH_INTERVAL', 2.0))
+EVENT_SPOOL_FSYNC = os.environ.get('EVENT_SPOOL_FSYNC', 'False') == 'True'
+
+# Session recording storage
+# Chunks are compressed with zstd when the zstandard package is installed, zlib otherwise
+RECORDING_CHUNK_CODEC = os.environ.get('RECORDING_CHUNK_CODEC', 'zstd')
+# Upper bound for a decompressed recording upload (guards against compression bombs)
+RECORDING_MAX_DECOMPRESSED_BYTES = int(os.environ.get('RECORDING_MAX_DECOMPRESSED_BYTES', 50 * 1024 * 1024))
+
+# Heatmap tiles (heatmaps.tiles): ingested counts are buffered per process
+# and written to HeatmapTile every this many seconds, 0 to write on commit
+HEATMAP_TILE_FLUSH_INTERVAL = float(os.environ.get('HEATMAP_TILE_FLUSH_INTERVAL', 5))
+
+# Heatmap read-through cache (HeatmapData): maximum age of a cached entry in seconds
+HEATMAP_CACHE_TTL = int(os.environ.get('HEATMAP_CACHE_TTL', 6 * 60 * 60))
+# Page width classes for breakpoint heatmaps, "name:min_width" in ascending order
+HEATMAP_BREAKPOINTS = [
+    (name, int(width)) for name, width in (
+        item.split(':') for item in os.environ.get('HEATMAP_BREAKPOINTS', 'mobile:0,tablet:768,desktop:1024').split(',')
+    )
+]
+# Width assumed for events recorded without a viewport width, by session
+# device type, "device:width"; other device types count as desktop
+HEATMAP_DEVICE_WIDTHS = {
+    name: int(width) for name, width in (
+        item.split(':') for item in os.environ.get('HEATMAP_DEVICE_WIDTHS', 'mobile:375,tablet:768,desktop:1280').split(',')
+    )
+}
+
+# Page normalization: default query string policy for canonical page URLs
+# ('drop', 'keep' or a list of parameter names); sites override it with
+# Site.settings['page_query_params']
+PAGE_QUERY_PARAMS = 'drop'
+
+# Event table partitioning (PostgreSQL only, see events/partitions.py and
+# `manage.py manage_event_partitions`)
+EVENT_PARTITION_INTERVAL = os.environ.get('EVENT_PARTITION_INTERVAL', 'week')  # 'day' or 'week'
+EVENT_PARTITIONS_AHEAD = int(os.environ.get('EVENT_PARTITIONS_AHEAD', 4))
+# What happens to partitions past retention: 'drop' or 'detach' (keep the table for archiving)
+EVENT_PARTITION_EXPIRE = os.environ.get('EVENT_PARTITION_EXPIRE', 'drop')
+# Event retention for sites without Site.settings['retention_days']
+EVENT_RETENTION_DAYS = int(os.environ.get('EVENT_RETENTION_DAYS', 365))
+
+# Materialized funnel results (funnels.results): days of history built for a
+# new or edited funnel, and closed days recomputed on every refresh to pick
+# up late events and sessions that cross midnight
+FUNNEL_RESULT_DAYS = int(os.environ.get('FUNNEL_RESULT_DAYS', 90))
+FUNNEL_RESULT_LOOKBACK_DAYS = int(os.environ.get('FUNNEL_RESULT_LOOKBACK_DAYS', 1))
+FUNNEL_REFRESH_EVERY = int(os.environ.get('FUNNEL_REFRESH_EVERY', 15 * 60))  # Seconds between scheduled refreshes of all funnels
+
+# Background tasks (analytics.runner): jobs are stored in the database and
+# run by `manage.py run_task_worker`
+TASK_WORKER_THREADS = int(os.environ.get('TASK_WORKER_THREADS', 4))
+TASK_POLL_INTERVAL = float(os.environ.get('TASK_POLL_INTERVAL', 1.0))
+TASK_MAX_ATTEMPTS = int(os.environ.get('TASK_MAX_ATTEMPTS', 3))
+TASK_RETRY_DELAY = int(os.environ.get('TASK_RETRY_DELAY', 30))  # Seconds before the first retry, doubled each time
+TASK_HEARTBEAT_INTERVAL = int(os.environ.get('TASK_HEARTBEAT_INTERVAL', 30))  # Seconds between worker heartbeats
+TASK_TIMEOUT = int(os.environ.get('TASK_TIMEOUT', 5 * 60))  # Running jobs without a heartbeat for this long are requeued
+TASK_SCHEDULE_INTERVAL = int(os.environ.get('TASK_SCHEDULE_INTERVAL', 60))  # Seconds between checks for due periodic tasks
+DAILY_STATS_COMPACT_EVERY = int(os.environ.get('DAILY_STATS_COMPACT_EVERY', 60 * 60))  # Rebuild of recent daily rollups
+SCROLL_DEPTH_COMPACT_EVERY = int(os.environ.get('SCROLL_DEPTH_COMPACT_EVERY', 60 * 60))  # Rebuild of recent scroll histograms
+# Start a worker inside the web process on the first enqueue; set to False
+# when a dedicated `run_task_worker` process (Procfile worker) is deployed
+TASK_WORKER_IN_PROCESS = os.environ.get('TASK_WORKER_IN_PROCESS', 'True') == 'True'
+TASK_WORKER_IN_PROCESS_THREADS = int(os.environ.get('TASK_WORKER_IN_PROCESS_THREADS', 1))
+# Run jobs inline at enqueue time (development without a worker)
+TASK_ALWAYS_EAGER = os.environ.get('TASK_ALWAYS_EAGER', 'False') == 'True'
+
+# Session lookup cache for ingestion (events.session_cache)
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', 50000))  # Entries kept per process
+SESSION_CACHE_TTL = int(os.environ.get('SESSION_CACHE_TTL', 15 * 60))
+SESSION_CACHE_NEGATIVE_TTL = int(os.environ.get('SESSION_CACHE_NEGATIVE_TTL', 30))  # For unknown session ids
+# Optional shared layer: name of a CACHES alias (e.g. a Redis cache), None for in-process only
+SESSION_CACHE_BACKEND = os.environ.get('SESSION_CACHE_BACKEND') or None
+
+# Site.last_activity_at is written at most once per site per this many
+# seconds (sites.heartbeat)
+SITE_HEARTBEAT_INTERVAL = int(os.environ.get('SITE_HEARTBEAT_INTERVAL', 30))
+
+# Ingestion limits (sites.limits); each site can override these in
+# Site.settings: sampling_rate, events_per_second, burst, daily_event_quota
+INGEST_EVENTS_PER_SECOND = float(os.environ.get('INGEST_EVENTS_PER_SECOND', 200))
+INGEST_BURST = float(os.environ.get('INGEST_BURST', 2000))
+INGEST_DAILY_EVENT_QUOTA = int(os.environ['INGEST_DAILY_EVENT_QUOTA']) if os.environ.get('INGEST_DAILY_EVENT_QUOTA') else None  # None = unlimited
+SITE_POLICY_TTL = int(os.environ.get('SITE_POLICY_TTL', 60))  # Seconds site settings are cached per process
+
+# Tracking script delivery (heatmaps.tracker). Browsers revalidate with
+# If-None-Match after max-age; sites change rarely so the script URL is not
+# versioned
+TRACKING_SCRIPT_MAX_AGE = int(os.environ.get('TRACKING_SCRIPT_MAX_AGE', 300))
+TRACKING_SCRIPT_STALE_WHILE_REVALIDATE = int(os.environ.get('TRACKING_SCRIPT_STALE_WHILE_REVALIDATE', 86400))
+TRACKING_SCRIPT_SITE_TTL = int(os.environ.get('TRACKING_SCRIPT_SITE_TTL', 3600))  # Site id -> tracking id cache
+TRACKING_SCRIPT_CACHE_SIZE = int(os.environ.get('TRACKING_SCRIPT_CACHE_SIZE', 1000))  # Compiled scripts per process
+
+# Columnar event archive (analytics.columnar). Sealed days are written per
+# site to Parquet when pyarrow is installed, otherwise to memory-mappable
+# .npy column files; numpy is required either way. Days are archived once
+# they are more than EVENT_ARCHIVE_LAG_DAYS old, so late events still land
+# in the database copy first.
+EVENT_ARCHIVE_DIR = os.environ.get('EVENT_ARCHIVE_DIR', str(BASE_DIR / 'archive' / 'events'))
+EVENT_ARCHIVE_FORMAT = os.environ.get('EVENT_ARCHIVE_FORMAT') or None  # parquet, npy or None for the best available
+EVENT_ARCHIVE_LAG_DAYS = int(os.environ.get('EVENT_ARCHIVE_LAG_DAYS', 1))
+# Seconds between compact_event_archives runs queued by the task workers, 0 to
+# archive only from `manage.py archive_events`
+EVENT_ARCHIVE_COMPACT_EVERY = int(os.environ.get('EVENT_ARCHIVE_COMPACT_EVERY', 6 * 60 * 60))
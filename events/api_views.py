@@ -1,6 +1,7 @@
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
+from django.core.exceptions import ValidationError
 from events.models import Session, Event
 
 @api_view(['POST'])
@@ -13,12 +14,39 @@ def identify_user(request):
     user_identifier = request.data.get('user_identifier')
     traits = request.data.get('traits', {})
     
+    # A single UPDATE, the row count tells whether the session exists
     try:
-        session = Session.objects.get(session_id=session_id)
-        session.user_identifier = user_identifier
-        session.tags = traits
-        session.save()
-        
-        return Response({'status': 'success', 'message': 'User identified'})
-    except Session.DoesNotExist:
+        updated = Session.objects.filter(session_id=session_id).update(
+            user_identifier=user_identifier,
+            tags=traits
+        )
+    except ValidationError:
+        updated = 0  # Not a UUID
+    
+    if not updated:
         return Response({'status': 'error', 'message': 'Session not found'}, status=404)
+    return Response({'status': 'success', 'message': 'User identified'})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def spool_stats(request):
+    """
+    Queue depth and flush latency of the event write-behind spool
+    """
+    from events.spool import get_event_spool, spool_enabled
+
+    if not spool_enabled():
+        return Response({'enabled': False})
+    return Response({'enabled': True, **get_event_spool().stats()})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def session_cache_stats(request):
+    """
+    Hit rate and size of this process's session lookup cache
+    """
+    from events.session_cache import get_session_cache
+
+    return Response(get_session_cache().stats())
@@ -0,0 +1,242 @@
+"""
+Batch ingestion fast path for tracking events
+
+The tracking script posts events in batches every few seconds. Running each
+event through EventSerializer and saving it individually costs one INSERT per
+event, so batches are validated with a lightweight schema instead and written
+with a single bulk_create.
+"""
+from collections import Counter
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+from events.models import Session, Event
+from sites.heartbeat import record_site_activity
+from heatmaps.tiles import record_heatmap_tiles
+from events.pages import resolve_pages
+from events.session_cache import get_session_cache
+from events.typed_fields import TYPED_FIELDS, typed_event_fields
+
+EVENT_TYPES = {choice for choice, _ in Event.EVENT_TYPES}
+EVENT_FIELDS = ('session_id', 'event_type', 'timestamp', 'page_url', 'page_id', 'data') + TYPED_FIELDS
+BULK_BATCH_SIZE = 1000
+
+
+def _clean_event(index, item):
+    """
+    Validate a single raw event dict and return the cleaned field values
+    """
+    if not isinstance(item, dict):
+        raise serializers.ValidationError({index: 'Expected an object.'})
+
+    errors = {}
+
+    session_id = item.get('session')
+    if isinstance(session_id, bool) or not isinstance(session_id, (int, str)) or not str(session_id).isdigit():
+        errors['session'] = 'A valid session id is required.'
+
+    event_type = item.get('event_type')
+    if event_type not in EVENT_TYPES:
+        errors['event_type'] = f'"{event_type}" is not a valid choice.'
+
+    timestamp = item.get('timestamp')
+    parsed = None
+    if isinstance(timestamp, str):
+        try:
+            parsed = parse_datetime(timestamp)
+        except ValueError:
+            parsed = None
+    if parsed is None:
+        errors['timestamp'] = 'A valid ISO 8601 timestamp is required.'
+    elif timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+
+    page_url = item.get('page_url')
+    if not isinstance(page_url, str) or not page_url:
+        errors['page_url'] = 'This field is required.'
+
+    data = item.get('data')
+    if not isinstance(data, dict):
+        errors['data'] = 'Expected an object.'
+
+    if errors:
+        raise serializers.ValidationError({index: errors})
+
+    return {
+        'session_id': int(session_id),
+        'event_type': event_type,
+        'timestamp': parsed,
+        'page_url': page_url,
+        'data': data,
+    }
+
+
+def clean_event_batch(items):
+    """
+    Schema-only validation of a list of raw event dicts. Does not touch the
+    database, so it can run before events are spooled.
+    """
+    if not isinstance(items, list):
+        raise serializers.ValidationError('Expected a list of events.')
+    return [_clean_event(index, item) for index, item in enumerate(items)]
+
+
+def resolve_sessions(cleaned):
+    """
+    Map every valid session id referenced by the batch to (site_id,
+    device_type), from the session cache when possible and otherwise with one
+    query
+    """
+    session_ids = {event['session_id'] for event in cleaned}
+    return {
+        session_id: (info.site_id, info.device_type)
+        for session_id, info in get_session_cache().get_many(session_ids).items()
+        if info.is_valid
+    }
+
+
+def validate_event_batch(items):
+    """
+    Validate a list of raw event dicts without building serializer instances.
+    Session ids are checked with a single query.
+    Returns (cleaned_events, sessions) where sessions comes from resolve_sessions.
+    """
+    cleaned = clean_event_batch(items)
+    sessions = resolve_sessions(cleaned)
+
+    missing = {event['session_id'] for event in cleaned} - sessions.keys()
+    if missing:
+        raise serializers.ValidationError({
+            'session': f'Invalid session id(s): {sorted(missing)}'
+        })
+
+    return cleaned, sessions
+
+
+def site_event_counts(items):
+    """
+    Count raw events per site before any validation, for quota checks.
+    Items without a known session are skipped; validation rejects them later.
+    """
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list):
+        return {}
+    per_session = Counter()
+    for item in items:
+        session_id = item.get('session') if isinstance(item, dict) else None
+        if isinstance(session_id, (int, str)) and not isinstance(session_id, bool) and str(session_id).isdigit():
+            per_session[int(session_id)] += 1
+    counts = Counter()
+    for session_id, info in get_session_cache().get_many(per_session.keys()).items():
+        if info.is_valid:
+            counts[info.site_id] += per_session[session_id]
+    return dict(counts)
+
+
+def mark_sites_active(site_ids):
+    """
+    Flag sites as connected. Writes are coalesced per site, see
+    sites.heartbeat.
+    """
+    return record_site_activity(site_ids)
+
+
+def assign_pages(cleaned, sessions):
+    """
+    Attach the normalized page to every cleaned event, adding 'page_id' and
+    'canonical_url' keys
+    """
+    urls_by_site = {}
+    for event in cleaned:
+        site_id = sessions[event['session_id']][0]
+        urls_by_site.setdefault(site_id, set()).add(event['page_url'])
+
+    pages = resolve_pages(urls_by_site)
+    for event in cleaned:
+        site_id = sessions[event['session_id']][0]
+        event['page_id'], event['canonical_url'] = pages[(site_id, event['page_url'])]
+
+
+def assign_typed_fields(cleaned):
+    """Copy the hot data keys of every cleaned event into its typed fields"""
+    # Sessions were just resolved, so their viewports come from the cache
+    infos = get_session_cache().get_many({event['session_id'] for event in cleaned})
+    for event in cleaned:
+        event.update(typed_event_fields(event['event_type'], event['data'], infos[event['session_id']].viewport))
+
+
+def record_landing_pages(cleaned):
+    """
+    Store the first page view of each session in the batch as its landing
+    page, unless an earlier batch already set one
+    """
+    first_views = {}
+    for event in cleaned:
+        if event['event_type'] != 'page_view':
+            continue
+        first = first_views.get(event['session_id'])
+        if first is None or event['timestamp'] < first['timestamp']:
+            first_views[event['session_id']] = event
+
+    for session_id, event in first_views.items():
+        Session.objects.filter(id=session_id, landing_page__isnull=True).update(
+            landing_page=event['page_url']
+        )
+
+
+def write_events(cleaned, sessions):
+    """
+    Insert cleaned events with one bulk_create, fold them into the heatmap
+    tiles and touch their sites once
+    """
+    assign_pages(cleaned, sessions)
+    assign_typed_fields(cleaned)
+
+    with transaction.atomic():
+        # Tiles look at already stored events to count new sessions, so they
+        # are updated before the insert
+        record_heatmap_tiles(cleaned, sessions)
+        Event.objects.bulk_create(
+            [Event(**{field: event[field] for field in EVENT_FIELDS}) for event in cleaned],
+            batch_size=BULK_BATCH_SIZE
+        )
+        record_landing_pages(cleaned)
+        mark_sites_active({sessions[event['session_id']][0] for event in cleaned})
+
+
+def ingest_event_batch(items):
+    """
+    Validate and store a batch of events with one bulk_create, then update
+    the owning sites once for the whole batch. Returns the number of events
+    written.
+    """
+    cleaned, sessions = validate_event_batch(items)
+    if not cleaned:
+        return 0
+
+    write_events(cleaned, sessions)
+    return len(cleaned)
+
+
+def ingest_spooled_events(items):
+    """
+    Lenient variant used when flushing the write-behind spool. The request
+    that produced these events was acknowledged long ago, so invalid events
+    and events for deleted sessions are dropped instead of failing the whole
+    flush. Returns (written, dropped).
+    """
+    cleaned = []
+    for index, item in enumerate(items):
+        try:
+            cleaned.append(_clean_event(index, item))
+        except serializers.ValidationError:
+            continue
+
+    sessions = resolve_sessions(cleaned)
+    cleaned = [event for event in cleaned if event['session_id'] in sessions]
+    if cleaned:
+        write_events(cleaned, sessions)
+
+    return len(cleaned), len(items) - len(cleaned)
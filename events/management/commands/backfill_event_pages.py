@@ -0,0 +1,45 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from events.models import Event
+from events.pages import resolve_pages
+
+
+class Command(BaseCommand):
+    help = 'Link existing events to their normalized Page rows, in primary key batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Events per batch (default 5000)')
+        parser.add_argument('--site', type=int, help='Only backfill events of this site id')
+
+    def handle(self, *args, **options):
+        events = Event.objects.filter(page__isnull=True).order_by('id')
+        if options['site']:
+            events = events.filter(session__site_id=options['site'])
+
+        last_id = 0
+        total = 0
+        while True:
+            rows = list(events.filter(id__gt=last_id).values_list(
+                'id', 'session__site_id', 'page_url'
+            )[:options['batch_size']])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            urls_by_site = defaultdict(set)
+            for _, site_id, page_url in rows:
+                urls_by_site[site_id].add(page_url)
+            pages = resolve_pages(urls_by_site)
+
+            ids_by_page = defaultdict(list)
+            for event_id, site_id, page_url in rows:
+                ids_by_page[pages[(site_id, page_url)][0]].append(event_id)
+            for page_id, ids in ids_by_page.items():
+                Event.objects.filter(id__in=ids).update(page_id=page_id)
+
+            total += len(rows)
+            self.stdout.write(f"Linked {total} events")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled pages for {total} events. Run backfill_heatmap_tiles to rebuild tiles on pages."
+        ))
@@ -0,0 +1,68 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from events.ingest import ingest_event_batch
+from events.models import Session, Event
+from events.serializers import EventSerializer
+from sites.models import Site
+
+
+class Command(BaseCommand):
+    help = 'Benchmark event batch ingestion: serializer path vs bulk_create fast path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 5000])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        # Everything runs inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            owner = User.objects.create(username=f'bench-{time.time_ns()}')
+            site = Site.objects.create(owner=owner, name='bench', domain=f'bench-{time.time_ns()}.local')
+            session = Session.objects.create(
+                site=site, device_type='desktop', browser='bench', os='bench',
+                viewport={'width': 1920, 'height': 1080}
+            )
+
+            self.stdout.write(f"{'batch':>8} {'serializer ev/s':>16} {'bulk ev/s':>12} {'speedup':>8}")
+            for size in options['sizes']:
+                batch = self.make_batch(session.id, size)
+                before = self.measure(self.serializer_path, batch, options['repeat'])
+                after = self.measure(ingest_event_batch, batch, options['repeat'])
+                self.stdout.write(
+                    f"{size:>8} {size / before:>16.0f} {size / after:>12.0f} {before / after:>7.1f}x"
+                )
+
+            transaction.set_rollback(True)
+
+    def make_batch(self, session_id, size):
+        now = timezone.now().isoformat()
+        return [{
+            'session': session_id,
+            'event_type': 'click' if i % 3 else 'mouse_move',
+            'timestamp': now,
+            'page_url': 'https://example.com/pricing',
+            'data': {'x': i % 1920, 'y': i % 1080, 'target': 'BUTTON', 'id': '', 'classes': ['cta']},
+        } for i in range(size)]
+
+    def serializer_path(self, batch):
+        """The previous EventViewSet.create implementation"""
+        serializer = EventSerializer(data=batch, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        data = serializer.data
+        site = Event.objects.filter(id=data[0]['id']).select_related('session__site').first().session.site
+        site.is_connected = True
+        site.last_activity_at = timezone.now()
+        site.save(update_fields=['is_connected', 'last_activity_at'])
+
+    def measure(self, func, batch, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(batch)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
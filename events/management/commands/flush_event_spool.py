@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from events.spool import get_event_spool
+
+
+class Command(BaseCommand):
+    help = 'Flush the event write-behind spool to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep flushing every EVENT_SPOOL_FLUSH_INTERVAL seconds (dedicated worker mode)'
+        )
+        parser.add_argument(
+            '--recover', action='store_true',
+            help='Adopt segments from every process, including live ones. Only use while web workers are stopped.'
+        )
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='Queue segments that failed to flush (.failed files) again'
+        )
+
+    def handle(self, *args, **options):
+        spool = get_event_spool()
+        if options['retry_failed']:
+            self.stdout.write(f"Retrying {spool.retry_failed()} failed segments")
+
+        written = spool.flush(adopt_all=options['recover'])
+        self.stdout.write(f"Flushed {written} events from {settings.EVENT_SPOOL_DIR}")
+
+        if options['loop']:
+            self.stdout.write('Flushing continuously, press Ctrl+C to stop')
+            try:
+                spool.run_forever()
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from events import partitions
+from events.models import Event
+
+
+class Command(BaseCommand):
+    help = (
+        'Create upcoming Event partitions and expire events past each site\'s retention. '
+        'Without PostgreSQL partitioning, retention falls back to batched deletes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='Convert events_event into a partitioned table (PostgreSQL, one-time)')
+        parser.add_argument('--interval', choices=['day', 'week'], default=settings.EVENT_PARTITION_INTERVAL)
+        parser.add_argument('--ahead', type=int, default=settings.EVENT_PARTITIONS_AHEAD,
+                            help='Number of future partitions to keep created')
+        parser.add_argument('--expire', choices=['drop', 'detach'], default=settings.EVENT_PARTITION_EXPIRE,
+                            help='What to do with partitions past retention')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per delete batch')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be done')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        dry_run = options['dry_run']
+
+        if options['convert']:
+            if not partitions.is_supported():
+                raise CommandError('Partitioning needs PostgreSQL')
+            if partitions.is_partitioned():
+                raise CommandError('events_event is already partitioned')
+            if not dry_run:
+                first = partitions.convert_to_partitioned(options['ahead'], interval)
+                self.stdout.write(self.style.SUCCESS(f"Converted events_event, partitions start at {first}"))
+            else:
+                self.stdout.write('Would convert events_event into a partitioned table')
+
+        partitioned = partitions.is_partitioned()
+        if partitioned:
+            for start in partitions.missing_partitions(options['ahead'], interval):
+                if not dry_run:
+                    partitions.create_partition(start, interval)
+                self.stdout.write(f"{'Would create' if dry_run else 'Created'} {partitions.partition_name(start)}")
+        else:
+            self.stdout.write('events_event is not partitioned, applying retention with batched deletes')
+
+        cutoffs = partitions.retention_cutoffs()
+        if not cutoffs:
+            return
+
+        if partitioned:
+            # A partition can only go once every site's retention has passed it
+            oldest_kept = min(cutoffs.values())
+            for name in partitions.expired_partitions(oldest_kept):
+                if not dry_run:
+                    partitions.expire_partition(name, options['expire'])
+                self.stdout.write(f"{'Would expire' if dry_run else 'Expired'} {name} ({options['expire']})")
+
+        verb = 'would delete' if dry_run else 'deleted'
+        deleted = 0
+        for site_id, cutoff in cutoffs.items():
+            if dry_run:
+                count = Event.objects.filter(session__site_id=site_id, timestamp__lt=cutoff).count()
+            else:
+                count = partitions.purge_site_events(site_id, cutoff, options['batch_size'])
+            if count:
+                self.stdout.write(f"Site {site_id}: {verb} {count} events before {cutoff:%Y-%m-%d}")
+            deleted += count
+
+        self.stdout.write(self.style.SUCCESS(f"Done at {timezone.now():%Y-%m-%d %H:%M}, {verb} {deleted} rows"))
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0002_site_is_connected_site_last_activity_at'),
+        ('events', '0002_alter_event_event_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Page',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.TextField()),
+                ('url_hash', models.CharField(max_length=40)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.site'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='page',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='events.page'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='page',
+            unique_together={('site', 'url_hash')},
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['page', 'event_type', 'timestamp'], name='events_even_page_id_842647_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0003_event_pages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='landing_page',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,103 @@
+import hashlib
+import math
+from django.db import migrations, transaction
+
+BATCH_SIZE = 2000
+# Columns that exist at this point of the migration history
+FIELDS = ('x', 'y', 'viewport_x', 'viewport_y', 'scroll_depth', 'target_hash')
+
+
+# Frozen copy of events.typed_fields as of this migration, so what it writes
+# does not change with that module
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _viewport_size(data, viewport):
+    for source in (data.get('viewport'), viewport):
+        if isinstance(source, dict):
+            width, height = _number(source.get('width')), _number(source.get('height'))
+            if width or height:
+                return width, height
+    return None, None
+
+
+def _target_selector(data):
+    tag = data.get('target')
+    if not isinstance(tag, str) or not tag:
+        return None
+    selector = tag.lower()
+    if isinstance(data.get('id'), str) and data['id']:
+        selector += f"#{data['id']}"
+    classes = data.get('classes')
+    if isinstance(classes, list):
+        selector += ''.join(f'.{name}' for name in classes if isinstance(name, str) and name)
+    return selector
+
+
+def typed_event_fields(event_type, data, viewport=None):
+    fields = dict.fromkeys(FIELDS)
+    if not isinstance(data, dict):
+        return fields
+
+    x, y = _number(data.get('x')), _number(data.get('y'))
+    fields['x'], fields['y'] = x, y
+    if event_type == 'scroll':
+        fields['scroll_depth'] = _number(data.get('percentage'))
+    else:
+        width, height = _viewport_size(data, viewport)
+        if x is not None and width:
+            fields['viewport_x'] = x / width
+        if y is not None and height:
+            fields['viewport_y'] = y / height
+
+    selector = _target_selector(data)
+    if selector:
+        fields['target_hash'] = int.from_bytes(hashlib.sha1(selector.encode('utf-8')).digest()[:8], 'big', signed=True)
+    return fields
+
+
+def backfill_typed_fields(apps, schema_editor):
+    """
+    Fill the typed columns of existing events in primary key order, one
+    transaction per batch so locks are short and progress survives an
+    interruption
+    """
+    Event = apps.get_model('events', 'Event')
+    last_id = 0
+    while True:
+        rows = list(
+            Event.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'event_type', 'data', 'session__viewport')[:BATCH_SIZE]
+        )
+        if not rows:
+            return
+        events = []
+        for event_id, event_type, data, viewport in rows:
+            event = Event(id=event_id)
+            values = typed_event_fields(event_type, data, viewport)
+            for field in FIELDS:
+                setattr(event, field, values[field])
+            events.append(event)
+        with transaction.atomic():
+            Event.objects.bulk_update(events, FIELDS)
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('events', '0005_event_typed_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_typed_fields, migrations.RunPython.noop, elidable=True),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0006_backfill_event_typed_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='element_x',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='element_y',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='page_x',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='page_y',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='viewport_width',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,79 @@
+import math
+from django.db import migrations, transaction
+
+BATCH_SIZE = 2000
+# Columns added by 0007
+FIELDS = ('page_x', 'page_y', 'element_x', 'element_y', 'viewport_width')
+
+
+# Frozen copy of the events.typed_fields extraction of these columns as of
+# this migration, so what it writes does not change with that module
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _viewport_width(data, viewport):
+    for source in (data.get('viewport'), viewport):
+        if isinstance(source, dict):
+            width, height = _number(source.get('width')), _number(source.get('height'))
+            if width or height:
+                return width
+    return None
+
+
+def typed_event_fields(event_type, data, viewport=None):
+    fields = dict.fromkeys(FIELDS)
+    if not isinstance(data, dict):
+        return fields
+
+    fields['viewport_width'] = _viewport_width(data, viewport)
+    if event_type != 'scroll':
+        fields['page_x'], fields['page_y'] = _number(data.get('page_x')), _number(data.get('page_y'))
+        fields['element_x'], fields['element_y'] = _number(data.get('offset_x')), _number(data.get('offset_y'))
+    return fields
+
+
+def backfill_document_coordinates(apps, schema_editor):
+    """
+    Fill the document/element coordinate columns of existing events in
+    primary key order, one transaction per batch. Older events only get a
+    viewport width (from the session), they never sent the other values.
+    """
+    Event = apps.get_model('events', 'Event')
+    last_id = 0
+    while True:
+        rows = list(
+            Event.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'event_type', 'data', 'session__viewport')[:BATCH_SIZE]
+        )
+        if not rows:
+            return
+        events = []
+        for event_id, event_type, data, viewport in rows:
+            event = Event(id=event_id)
+            values = typed_event_fields(event_type, data, viewport)
+            for field in FIELDS:
+                setattr(event, field, values[field])
+            events.append(event)
+        with transaction.atomic():
+            Event.objects.bulk_update(events, FIELDS)
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('events', '0007_event_document_coordinates'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_document_coordinates, migrations.RunPython.noop, elidable=True),
+    ]
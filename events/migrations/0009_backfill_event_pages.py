@@ -0,0 +1,176 @@
+import hashlib
+from collections import OrderedDict, defaultdict
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from django.conf import settings
+from django.db import migrations, transaction
+
+BATCH_SIZE = 2000
+# Events linked here; larger tables are left to `manage.py backfill_event_pages`
+# so the release phase is not held up by a full table pass
+MAX_EVENTS = 100_000
+# (site_id, raw_url) pairs remembered between batches
+RESOLVER_CACHE_SIZE = 10_000
+
+
+# Frozen copy of the page normalization in events.pages at the time of this
+# migration, so what it writes does not change with that module
+
+def query_policy(site_settings):
+    policy = (site_settings or {}).get('page_query_params', getattr(settings, 'PAGE_QUERY_PARAMS', 'drop'))
+    if policy in ('drop', 'keep') or isinstance(policy, (list, tuple)):
+        return policy
+    return 'drop'
+
+
+def canonical_page_url(url, policy='drop'):
+    parts = urlsplit(url.strip())
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+
+    query = ''
+    if policy != 'drop' and parts.query:
+        params = parse_qsl(parts.query, keep_blank_values=True)
+        if policy != 'keep':
+            allowed = set(policy)
+            params = [(key, value) for key, value in params if key in allowed]
+        query = urlencode(sorted(params))
+
+    return f"{path}?{query}" if query else path
+
+
+def page_hash(canonical_url):
+    return hashlib.sha1(canonical_url.encode('utf-8')).hexdigest()
+
+
+class PageResolver:
+    """Page id of (site_id, raw_url), creating missing pages, with a bounded LRU cache"""
+
+    def __init__(self, apps):
+        self.Page = apps.get_model('events', 'Page')
+        self.policies = {
+            site_id: query_policy(site_settings)
+            for site_id, site_settings in apps.get_model('sites', 'Site').objects.values_list('id', 'settings')
+        }
+        self.pages = OrderedDict()
+
+    def resolve(self, keys):
+        resolved = {}
+        wanted = {}
+        for site_id, url in keys:
+            if (site_id, url) in self.pages:
+                self.pages.move_to_end((site_id, url))
+                resolved[(site_id, url)] = self.pages[(site_id, url)]
+            else:
+                canonical = canonical_page_url(url, self.policies.get(site_id, 'drop'))
+                wanted[(site_id, url)] = (canonical, page_hash(canonical))
+        if wanted:
+            self.Page.objects.bulk_create([
+                self.Page(site_id=site_id, url=canonical, url_hash=url_hash)
+                for (site_id, _), (canonical, url_hash) in wanted.items()
+            ], ignore_conflicts=True)
+            hashes_by_site = defaultdict(set)
+            for (site_id, _), (_, url_hash) in wanted.items():
+                hashes_by_site[site_id].add(url_hash)
+            found = {}
+            for site_id, hashes in hashes_by_site.items():
+                for page_id, url_hash in self.Page.objects.filter(
+                    site_id=site_id, url_hash__in=hashes
+                ).values_list('id', 'url_hash'):
+                    found[(site_id, url_hash)] = page_id
+            for (site_id, url), (canonical, url_hash) in wanted.items():
+                resolved[(site_id, url)] = self.pages[(site_id, url)] = (found[(site_id, url_hash)], canonical)
+            while len(self.pages) > RESOLVER_CACHE_SIZE:
+                self.pages.popitem(last=False)
+        return resolved
+
+
+def backfill_event_pages(apps, schema_editor):
+    """
+    Link existing events to their Page, in primary key batches with one
+    transaction each, so locks are short and progress survives an
+    interruption. Stops after MAX_EVENTS; the backfill_event_pages command
+    links the rest without blocking the deploy.
+    """
+    Event = apps.get_model('events', 'Event')
+    resolver = PageResolver(apps)
+    last_id = 0
+    linked = 0
+    while True:
+        if linked >= MAX_EVENTS:
+            if Event.objects.filter(page__isnull=True).exists():
+                print(
+                    f"\n  Linked the first {linked} events to pages; run "
+                    "`manage.py backfill_event_pages` for the rest."
+                )
+            break
+        rows = list(
+            Event.objects.filter(id__gt=last_id, page__isnull=True).order_by('id')
+            .values_list('id', 'session__site_id', 'page_url')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        pages = resolver.resolve({(site_id, page_url) for _, site_id, page_url in rows})
+        ids_by_page = defaultdict(list)
+        for event_id, site_id, page_url in rows:
+            ids_by_page[pages[(site_id, page_url)][0]].append(event_id)
+        with transaction.atomic():
+            for page_id, ids in ids_by_page.items():
+                Event.objects.filter(id__in=ids).update(page_id=page_id)
+        last_id = rows[-1][0]
+        linked += len(rows)
+
+    link_tile_pages(apps, resolver)
+
+
+def link_tile_pages(apps, resolver):
+    """
+    Move tiles stored before pages existed (keyed by raw URL) onto their
+    Page, merging tiles whose URLs share a canonical page. Session counts of
+    merged tiles are summed, so a session that used two URL variants of a
+    page on the same day is counted twice.
+    """
+    HeatmapTile = apps.get_model('heatmaps', 'HeatmapTile')
+    tiles = list(HeatmapTile.objects.filter(page__isnull=True))
+    if not tiles:
+        return
+    pages = resolver.resolve({(tile.site_id, tile.page_url) for tile in tiles})
+
+    merged = {}
+    for tile in tiles:
+        page_id, canonical = pages[(tile.site_id, tile.page_url)]
+        key = (tile.site_id, page_id, tile.device_type, tile.event_type, tile.day)
+        target = merged.get(key)
+        if target is None:
+            target = HeatmapTile.objects.filter(
+                site_id=tile.site_id, page_id=page_id, device_type=tile.device_type,
+                event_type=tile.event_type, day=tile.day
+            ).first()
+            if target is None:
+                target = HeatmapTile(
+                    site_id=tile.site_id, page_id=page_id, page_url=canonical, device_type=tile.device_type,
+                    event_type=tile.event_type, day=tile.day, resolution=tile.resolution, counts={}
+                )
+            merged[key] = target
+        for cell, count in tile.counts.items():
+            target.counts[cell] = target.counts.get(cell, 0) + count
+        target.event_count += tile.event_count
+        target.session_count += tile.session_count
+
+    with transaction.atomic():
+        HeatmapTile.objects.filter(id__in=[tile.id for tile in tiles]).delete()
+        for tile in merged.values():
+            tile.save()
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('events', '0008_backfill_document_coordinates'),
+        ('heatmaps', '0004_tile_page'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_event_pages, migrations.RunPython.noop, elidable=True),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0009_backfill_event_pages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpoolSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('flushed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
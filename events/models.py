@@ -14,10 +14,28 @@ class Session(models.Model):
     location = models.JSONField(null=True) # Country, city from IP
     viewport = models.JSONField() # Width, height
     tags = models.JSONField(default=list)
+    landing_page = models.TextField(null=True, blank=True)  # page_url of the first page view, set at ingest
 
     def __str__(self):
         return f"Session {self.session_id} - {self.site.name}"
 
+class Page(models.Model):
+    """
+    Canonical page of a site (path plus the query string allowed by the
+    site's policy). Events reference pages by key so URL filters resolve
+    against this small table instead of scanning Event.page_url.
+    """
+    site = models.ForeignKey(Site, on_delete=models.CASCADE)
+    url = models.TextField()  # Canonical URL, see events.pages.canonical_page_url
+    url_hash = models.CharField(max_length=40)  # sha1 of url
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['site', 'url_hash']
+
+    def __str__(self):
+        return self.url
+
 class Event(models.Model):
     EVENT_TYPES = [
         ('click', 'Click'),
@@ -33,13 +51,39 @@ class Event(models.Model):
     event_type = models.CharField(max_length=50, choices=EVENT_TYPES)
     timestamp = models.DateTimeField()
     page_url = models.TextField()
+    page = models.ForeignKey(Page, on_delete=models.SET_NULL, null=True, blank=True)
     data = models.JSONField()  # Event-specific data
+    # Typed copies of hot data keys, filled at ingest (events.typed_fields)
+    x = models.FloatField(null=True, blank=True)
+    y = models.FloatField(null=True, blank=True)
+    viewport_x = models.FloatField(null=True, blank=True)  # x / viewport width
+    viewport_y = models.FloatField(null=True, blank=True)  # y / viewport height
+    scroll_depth = models.FloatField(null=True, blank=True)  # Scroll percentage
+    target_hash = models.BigIntegerField(null=True, blank=True)  # Hash of the click target selector
+    page_x = models.FloatField(null=True, blank=True)  # Position in the document
+    page_y = models.FloatField(null=True, blank=True)
+    element_x = models.FloatField(null=True, blank=True)  # Position inside the target element, 0..1
+    element_y = models.FloatField(null=True, blank=True)
+    viewport_width = models.FloatField(null=True, blank=True)  # Picks the breakpoint in heatmaps
 
     class Meta:
         indexes = [
             models.Index(fields=['session', 'timestamp']),
             models.Index(fields=['page_url', 'event_type']),
+            models.Index(fields=['page', 'event_type', 'timestamp']),
         ]
 
     def __str__(self):
         return f"{self.event_type} at {self.timestamp}"
+
+class SpoolSegment(models.Model):
+    """
+    Spool segment already written to the database, recorded in the same
+    transaction as its events so a segment replayed after a crash is not
+    inserted twice (events.spool)
+    """
+    name = models.CharField(max_length=100, unique=True)  # <time_ns>-<pid>.sealed
+    flushed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
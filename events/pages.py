@@ -0,0 +1,135 @@
+"""
+Page normalization and matching
+
+Raw page URLs are reduced to a canonical form (path plus the query string
+allowed by the site's policy) and stored once in the Page table. Page
+filters for heatmaps and funnels are resolved against that table, so the
+Event scans become integer-key lookups on Event.page.
+
+Query string policy comes from Site.settings['page_query_params']:
+    'drop' (default)  ignore the query string
+    'keep'            keep every parameter, sorted
+    ['id', 'tab']     keep only the listed parameters, sorted
+"""
+import hashlib
+import re
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from django.conf import settings
+from events.models import Page
+from sites.models import Site
+
+MATCH_MODES = ('contains', 'exact', 'prefix', 'glob')
+
+
+def query_policy(site_settings):
+    policy = (site_settings or {}).get('page_query_params', settings.PAGE_QUERY_PARAMS)
+    if policy in ('drop', 'keep') or isinstance(policy, (list, tuple)):
+        return policy
+    return 'drop'
+
+
+def canonical_page_url(url, policy='drop'):
+    """
+    Canonical form of a page URL: path without trailing slash (except for
+    the root), no fragment, query string filtered by policy
+    """
+    parts = urlsplit(url.strip())
+    path = parts.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/') or '/'
+
+    query = ''
+    if policy != 'drop' and parts.query:
+        params = parse_qsl(parts.query, keep_blank_values=True)
+        if policy != 'keep':
+            allowed = set(policy)
+            params = [(key, value) for key, value in params if key in allowed]
+        query = urlencode(sorted(params))
+
+    return f"{path}?{query}" if query else path
+
+
+def page_hash(canonical_url):
+    return hashlib.sha1(canonical_url.encode('utf-8')).hexdigest()
+
+
+def resolve_pages(urls_by_site):
+    """
+    Map raw page URLs to Page rows, creating missing pages.
+    urls_by_site is {site_id: {raw_url, ...}}.
+    Returns {(site_id, raw_url): (page_id, canonical_url)}.
+    """
+    if not urls_by_site:
+        return {}
+
+    site_settings = dict(
+        Site.objects.filter(id__in=urls_by_site.keys()).values_list('id', 'settings')
+    )
+
+    canonical = {}
+    for site_id, urls in urls_by_site.items():
+        policy = query_policy(site_settings.get(site_id))
+        for url in urls:
+            canonical[(site_id, url)] = canonical_page_url(url, policy)
+
+    wanted = {(site_id, page_hash(url)): url for (site_id, _), url in canonical.items()}
+
+    def existing():
+        found = {}
+        for site_id in urls_by_site:
+            hashes = [h for (s, h) in wanted if s == site_id]
+            for page_id, url_hash in Page.objects.filter(
+                site_id=site_id, url_hash__in=hashes
+            ).values_list('id', 'url_hash'):
+                found[(site_id, url_hash)] = page_id
+        return found
+
+    found = existing()
+    missing = [key for key in wanted if key not in found]
+    if missing:
+        Page.objects.bulk_create(
+            [Page(site_id=site_id, url=wanted[(site_id, url_hash)], url_hash=url_hash)
+             for site_id, url_hash in missing],
+            ignore_conflicts=True
+        )
+        found = existing()
+
+    return {
+        key: (found[(key[0], page_hash(url))], url)
+        for key, url in canonical.items()
+    }
+
+
+def glob_to_regex(pattern):
+    """Anchored regex for a shell-style pattern (* and ? wildcards)"""
+    regex = ''.join(
+        '.*' if char == '*' else '.' if char == '?' else re.escape(char)
+        for char in pattern
+    )
+    return f'^{regex}$'
+
+
+def match_pages(site, pattern, mode='contains'):
+    """
+    Pages of a site matching a URL pattern:
+    - contains: case-insensitive substring of the canonical URL (legacy behavior)
+    - exact:    canonical form of the pattern
+    - prefix:   canonical URL starts with the pattern
+    - glob:     shell-style wildcards on the canonical URL, e.g. /blog/*
+    Absolute URLs are reduced to their canonical path first.
+    Returns a Page queryset, usable as a subquery (page__in=...).
+    """
+    if not isinstance(site, Site):
+        site = Site.objects.get(id=site)
+    policy = query_policy(site.settings)
+    if mode == 'exact' or '://' in pattern:
+        pattern = canonical_page_url(pattern, policy)
+
+    pages = Page.objects.filter(site=site)
+    if mode == 'exact':
+        return pages.filter(url_hash=page_hash(pattern))
+    if mode == 'prefix':
+        return pages.filter(url__startswith=pattern)
+    if mode == 'glob':
+        return pages.filter(url__regex=glob_to_regex(pattern))
+    return pages.filter(url__icontains=pattern)
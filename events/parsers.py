@@ -0,0 +1,10 @@
+from rest_framework.parsers import JSONParser
+
+
+class BeaconJSONParser(JSONParser):
+    """
+    JSON sent as text/plain. The tracker uses this content type for
+    navigator.sendBeacon so the request stays a simple CORS request
+    without a preflight, which browsers will not wait for on page unload.
+    """
+    media_type = 'text/plain'
@@ -0,0 +1,257 @@
+"""
+Time partitioning and retention for the Event table
+
+On PostgreSQL events_event can be converted into a native range-partitioned
+table on "timestamp" with one partition per day or week (EVENT_PARTITION_INTERVAL):
+
+    events_event            partitioned parent, primary key (id, timestamp)
+    events_event_legacy     the pre-existing table, attached for [MINVALUE, first boundary)
+    events_event_p20261012  one partition per interval, named after its first day
+    events_event_default    catches rows outside every partition (bad client clocks)
+
+Retention comes from Site.settings['retention_days'] (EVENT_RETENTION_DAYS
+when unset). Partitions hold every site, so a partition is dropped (or
+detached, EVENT_PARTITION_EXPIRE) once it is past the longest retention of
+any site; sites with a shorter retention have their older rows deleted in
+batches. On other databases, and before conversion, retention always uses
+batched deletes, so development on SQLite works unchanged.
+
+Everything is driven by `manage.py manage_event_partitions`.
+"""
+import re
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from events.models import Event
+from sites.models import Site
+
+TABLE = 'events_event'
+LEGACY_TABLE = 'events_event_legacy'
+DEFAULT_PARTITION = 'events_event_default'
+PARTITION_PREFIX = 'events_event_p'
+
+UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def is_supported():
+    return connection.vendor == 'postgresql'
+
+
+def is_partitioned():
+    if not is_supported():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = %s AND pg_table_is_visible(c.oid)",
+            [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def interval_start(day, interval=None):
+    """First day of the partition interval containing day"""
+    interval = interval or settings.EVENT_PARTITION_INTERVAL
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def interval_end(start, interval=None):
+    interval = interval or settings.EVENT_PARTITION_INTERVAL
+    return start + timedelta(days=7 if interval == 'week' else 1)
+
+
+def _bound(day):
+    # Partition boundaries are UTC midnights
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+def partition_name(start):
+    return f"{PARTITION_PREFIX}{start:%Y%m%d}"
+
+
+def list_partitions():
+    """
+    Attached partitions as (name, upper_bound) sorted by bound; upper_bound
+    is None for the default partition
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s AND pg_table_is_visible(p.oid)",
+            [TABLE]
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        match = UPPER_BOUND.search(bound)
+        partitions.append((name, datetime.fromisoformat(match.group(1)) if match else None))
+    return sorted(partitions, key=lambda p: (p[1] is None, p[1]))
+
+
+def missing_partitions(ahead, interval=None, today=None):
+    """Start days of the partitions needed to cover today plus `ahead` intervals"""
+    today = today or timezone.now().date()
+    partitions = list_partitions()
+    existing = {name for name, _ in partitions}
+    covered_until = max((bound for _, bound in partitions if bound), default=None)
+
+    missing = []
+    start = interval_start(today, interval)
+    for _ in range(ahead + 1):
+        # Never overlap the legacy partition or an existing range
+        if partition_name(start) not in existing and (covered_until is None or _bound(start) >= covered_until):
+            missing.append(start)
+        start = interval_end(start, interval)
+    return missing
+
+
+def create_partition(start, interval=None):
+    """
+    Create and attach the partition starting at `start`. Rows that already
+    landed in the default partition for that range are moved into it, since
+    Postgres refuses to attach a range the default partition has rows for.
+    """
+    name = partition_name(start)
+    lower, upper = _bound(start), _bound(interval_end(start, interval))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE "{name}" (LIKE "{TABLE}")')
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" '
+            f'WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+            f'INSERT INTO "{name}" SELECT * FROM moved',
+            [lower, upper]
+        )
+        cursor.execute(
+            f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{name}" FOR VALUES FROM (%s) TO (%s)',
+            [lower, upper]
+        )
+    return name
+
+
+def site_retention_days(site_settings):
+    try:
+        return int((site_settings or {}).get('retention_days', settings.EVENT_RETENTION_DAYS))
+    except (TypeError, ValueError):
+        return settings.EVENT_RETENTION_DAYS
+
+
+def retention_cutoffs(now=None):
+    """{site_id: cutoff datetime}, events older than the cutoff are expired"""
+    now = now or timezone.now()
+    return {
+        site_id: now - timedelta(days=site_retention_days(site_settings))
+        for site_id, site_settings in Site.objects.values_list('id', 'settings')
+    }
+
+
+def expired_partitions(cutoff):
+    """Partitions whose whole range is older than cutoff"""
+    return [name for name, bound in list_partitions() if bound is not None and bound <= cutoff]
+
+
+def expire_partition(name, mode=None):
+    """Drop a partition, or detach it and leave the table for archiving"""
+    mode = mode or settings.EVENT_PARTITION_EXPIRE
+    with connection.cursor() as cursor:
+        if mode == 'detach':
+            cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+        else:
+            cursor.execute(f'DROP TABLE "{name}"')
+
+
+def purge_site_events(site_id, cutoff, batch_size=5000):
+    """
+    Delete a site's events older than cutoff in primary key batches, so no
+    single statement holds locks for long. Returns the number deleted.
+    """
+    events = Event.objects.filter(session__site_id=site_id, timestamp__lt=cutoff)
+    deleted = 0
+    while True:
+        ids = list(events.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += Event.objects.filter(id__in=ids, timestamp__lt=cutoff).delete()[0]
+
+
+def _column_default(cursor, table, column):
+    cursor.execute(
+        "SELECT is_identity, column_default FROM information_schema.columns "
+        "WHERE table_name = %s AND column_name = %s AND table_schema = current_schema()",
+        [table, column]
+    )
+    return cursor.fetchone()
+
+
+def convert_to_partitioned(ahead, interval=None):
+    """
+    Turn the plain events_event table into a partitioned one in a single
+    transaction. The existing table is kept as-is and attached as the legacy
+    partition covering everything before the first new boundary (the interval
+    after its newest row), so no rows are copied. Returns the first
+    boundary.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'SELECT max("id"), max("timestamp") FROM "{TABLE}"')
+        max_id, max_timestamp = cursor.fetchone()
+        newest = max(max_timestamp, timezone.now()) if max_timestamp else timezone.now()
+        first = interval_end(interval_start(newest.astimezone(dt_timezone.utc).date(), interval), interval)
+
+        # Remember index and foreign key definitions before freeing their names
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes "
+            "WHERE tablename = %s AND schemaname = current_schema()",
+            [TABLE]
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass",
+            [TABLE]
+        )
+        constraints = cursor.fetchall()
+        primary_keys = {name for name, contype, _ in constraints if contype == 'p'}
+        foreign_keys = [(name, definition) for name, contype, definition in constraints if contype == 'f']
+
+        cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{LEGACY_TABLE}"')
+        for name, _ in indexes:
+            cursor.execute(f'ALTER INDEX "{name}" RENAME TO "{name[:56]}_legacy"')
+        for name, _ in foreign_keys:
+            cursor.execute(f'ALTER TABLE "{LEGACY_TABLE}" RENAME CONSTRAINT "{name}" TO "{name[:56]}_legacy"')
+
+        # The id sequence moves to the parent; partitions must not own one
+        is_identity, default = _column_default(cursor, LEGACY_TABLE, 'id')
+        if is_identity == 'YES':
+            cursor.execute(f'ALTER TABLE "{LEGACY_TABLE}" ALTER COLUMN "id" DROP IDENTITY')
+        elif default:
+            cursor.execute(f'ALTER TABLE "{LEGACY_TABLE}" ALTER COLUMN "id" DROP DEFAULT')
+
+        cursor.execute(f'CREATE TABLE "{TABLE}" (LIKE "{LEGACY_TABLE}") PARTITION BY RANGE ("timestamp")')
+        cursor.execute(f'CREATE SEQUENCE "{TABLE}_id_seq" OWNED BY "{TABLE}"."id"')
+        cursor.execute('SELECT setval(%s, %s, %s)', [f'"{TABLE}_id_seq"', max_id or 1, max_id is not None])
+        cursor.execute(f'ALTER TABLE "{TABLE}" ALTER COLUMN "id" SET DEFAULT nextval(\'"{TABLE}_id_seq"\')')
+
+        # Unique constraints on a partitioned table must include the partition key
+        cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_pkey" PRIMARY KEY ("id", "timestamp")')
+        for name, definition in indexes:
+            if name not in primary_keys:
+                cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{name}" {definition}')
+
+        cursor.execute(
+            f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{LEGACY_TABLE}" FOR VALUES FROM (MINVALUE) TO (%s)',
+            [_bound(first)]
+        )
+        cursor.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{TABLE}" DEFAULT')
+
+    for start in missing_partitions(ahead, interval, today=first):
+        create_partition(start, interval)
+    return first
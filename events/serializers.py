@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Session, Event
+from .typed_fields import TYPED_FIELDS, typed_event_fields
 
 from sites.models import Site
 
@@ -10,6 +11,7 @@ class SessionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Session
         fields = '__all__'
+        read_only_fields = ('landing_page',)
 
     def create(self, validated_data):
         tracking_id = validated_data.pop('tracking_id')
@@ -24,3 +26,9 @@ class EventSerializer(serializers.ModelSerializer):
     class Meta:
         model = Event
         fields = '__all__'
+        read_only_fields = ('page',) + TYPED_FIELDS
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        attrs.update(typed_event_fields(attrs['event_type'], attrs['data'], attrs['session'].viewport))
+        return attrs
@@ -0,0 +1,150 @@
+"""
+Session lookup cache for the ingestion hot path
+
+Maps a session primary key to (site_id, device_type, is_valid, viewport) so event
+batches and recording flushes can be validated and routed without reading
+the sessions table. Unknown ids are cached too (is_valid False, shorter
+TTL) so a client sending a bad id does not hit the database every time.
+
+Two layers:
+- an in-process LRU bounded by SESSION_CACHE_SIZE entries, entries expire
+  after SESSION_CACHE_TTL seconds (SESSION_CACHE_NEGATIVE_TTL when invalid)
+- optionally a shared Django cache (SESSION_CACHE_BACKEND, e.g. Redis) so
+  new processes start warm
+
+Sessions never change site or device, so entries only go stale when a
+session is deleted; deletes through the API invalidate them and the TTL
+bounds everything else.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.core.cache import caches
+from events.models import Session
+
+# viewport defaults to None for entries cached before it was added
+SessionInfo = namedtuple('SessionInfo', ['site_id', 'device_type', 'is_valid', 'viewport'], defaults=[None])
+
+INVALID = SessionInfo(None, None, False)
+KEY_PREFIX = 'session_info:'
+
+
+class SessionCache:
+
+    def __init__(self, max_size=None, ttl=None, negative_ttl=None, backend=None):
+        self.max_size = max_size or settings.SESSION_CACHE_SIZE
+        self.ttl = ttl or settings.SESSION_CACHE_TTL
+        self.negative_ttl = negative_ttl or settings.SESSION_CACHE_NEGATIVE_TTL
+        self.backend = backend
+        self._entries = OrderedDict()  # session id -> (SessionInfo, expires_at)
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _shared(self):
+        return caches[self.backend] if self.backend else None
+
+    def _ttl(self, info):
+        return self.ttl if info.is_valid else self.negative_ttl
+
+    def _store_local(self, session_id, info):
+        with self._lock:
+            self._entries[session_id] = (info, time.monotonic() + self._ttl(info))
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.metrics['evictions'] += 1
+
+    def put(self, session_id, info):
+        self._store_local(session_id, info)
+        shared = self._shared()
+        if shared is not None:
+            shared.set(f'{KEY_PREFIX}{session_id}', tuple(info), self._ttl(info))
+
+    def prime(self, session):
+        """Cache a session that was just created"""
+        self.put(session.id, SessionInfo(session.site_id, session.device_type, True, session.viewport))
+
+    def invalidate(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+        shared = self._shared()
+        if shared is not None:
+            shared.delete(f'{KEY_PREFIX}{session_id}')
+
+    def clear(self):
+        """Forget every local entry (tests, or after bulk session deletes)"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_many(self, session_ids):
+        """
+        Return {session_id: SessionInfo} for every requested id, reading the
+        database once for all ids missing from both cache layers
+        """
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for session_id in session_ids:
+                entry = self._entries.get(session_id)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(session_id)
+                    found[session_id] = entry[0]
+                else:
+                    missing.append(session_id)
+            self.metrics['hits'] += len(found)
+
+        shared = self._shared()
+        if missing and shared is not None:
+            cached = shared.get_many([f'{KEY_PREFIX}{session_id}' for session_id in missing])
+            for session_id in list(missing):
+                value = cached.get(f'{KEY_PREFIX}{session_id}')
+                if value is not None:
+                    info = SessionInfo(*value)
+                    self._store_local(session_id, info)
+                    found[session_id] = info
+                    missing.remove(session_id)
+                    self.metrics['shared_hits'] += 1
+
+        if missing:
+            self.metrics['misses'] += len(missing)
+            rows = {
+                session_id: SessionInfo(site_id, device_type, True, viewport)
+                for session_id, site_id, device_type, viewport in Session.objects.filter(
+                    id__in=missing
+                ).values_list('id', 'site_id', 'device_type', 'viewport')
+            }
+            for session_id in missing:
+                info = rows.get(session_id, INVALID)
+                self.put(session_id, info)
+                found[session_id] = info
+
+        return found
+
+    def get(self, session_id):
+        return self.get_many([session_id])[session_id]
+
+    def stats(self):
+        lookups = self.metrics['hits'] + self.metrics['shared_hits'] + self.metrics['misses']
+        hits = self.metrics['hits'] + self.metrics['shared_hits']
+        return {
+            **self.metrics,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+            'shared_backend': self.backend,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_session_cache():
+    """Process-wide SessionCache configured from settings"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SessionCache(backend=settings.SESSION_CACHE_BACKEND)
+    return _cache
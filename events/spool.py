@@ -0,0 +1,358 @@
+"""
+Write-behind spool for tracking events
+
+When EVENT_SPOOL_ENABLED is set, /api/track/events/ appends each accepted
+batch to a segmented, append-only log on local disk and returns immediately.
+A background thread (or the flush_event_spool management command) seals
+segments and bulk-inserts them into the Event table.
+
+Segment files live in EVENT_SPOOL_DIR and move through three states:
+
+    <time_ns>-<pid>.open                   being appended to by <pid>
+    <time_ns>-<pid>.sealed                 ready to flush
+    <time_ns>-<pid>.sealed.<pid2>.claim    being flushed by <pid2>
+    <time_ns>-<pid>.failed                 could not be written, set aside
+
+Claims are taken with an atomic rename so several gunicorn workers can share
+one directory. Segments left behind by a crashed process (open or claimed by
+a pid that no longer exists) are adopted on the next flush.
+
+Segments are sealed when they reach EVENT_SPOOL_SEGMENT_BYTES or, on the next
+append, once they are EVENT_SPOOL_SEGMENT_AGE seconds old. A writer never
+appends to an older segment, so any flusher (including the flush_event_spool
+command of a deployment without in-process flushers) adopts open segments
+of live processes after twice that age. Events of a quiet site therefore
+wait at most about 2 * EVENT_SPOOL_SEGMENT_AGE.
+
+A segment whose events cannot be written is renamed to .failed and logged,
+so it does not hold back the segments after it; `flush_event_spool
+--retry-failed` queues those again. When the database itself is unavailable
+the segment is put back and the flush stops, to be retried as a whole.
+
+A segment's events are inserted in one transaction together with a
+SpoolSegment row named after it, and the file is removed afterwards. A crash
+between the commit and the removal replays the segment on the next flush,
+which finds the row and only removes the file, so no event is inserted twice.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+from django.utils import timezone
+from events.ingest import ingest_spooled_events
+from events.models import SpoolSegment
+
+logger = logging.getLogger(__name__)
+
+# Flushed segment names are kept this long, far beyond any replay
+SEGMENT_RECORD_DAYS = 7
+
+
+class SpoolFull(Exception):
+    """Raised when the on-disk backlog exceeds EVENT_SPOOL_MAX_BYTES"""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class EventSpool:
+    def __init__(self, directory, segment_bytes, max_bytes, flush_interval, fsync=False, segment_age=30):
+        self.directory = str(directory)
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._segment = None
+        self._segment_path = None
+        self._segment_size = 0
+        self._segment_opened = 0  # time_ns in the segment's name
+        self._pending_bytes = self._disk_usage()
+        self._worker = None
+        self._stop = threading.Event()
+
+        self.metrics = {
+            'accepted_batches': 0,
+            'accepted_events': 0,
+            'rejected_batches': 0,
+            'flushed_events': 0,
+            'dropped_events': 0,
+            'flushed_segments': 0,
+            'failed_segments': 0,
+            'flush_errors': 0,
+            'last_flush_seconds': None,
+            'max_flush_seconds': None,
+            'last_flush_at': None,
+        }
+
+    # Appending
+
+    def append(self, items):
+        """
+        Durably queue a batch of (schema-validated) raw events.
+        Raises SpoolFull when the backlog is over its limit.
+        """
+        line = json.dumps(items, separators=(',', ':')).encode('utf-8') + b'\n'
+
+        with self._lock:
+            if self._pending_bytes + len(line) > self.max_bytes:
+                self.metrics['rejected_batches'] += 1
+                raise SpoolFull()
+
+            if self._segment is not None and time.time_ns() - self._segment_opened >= self.segment_age * 1e9:
+                # Old segments may be adopted by other flushers, never write to them
+                self._seal_segment()
+            if self._segment is None:
+                self._open_segment()
+
+            self._segment.write(line)
+            self._segment.flush()
+            if self.fsync:
+                os.fsync(self._segment.fileno())
+
+            self._segment_size += len(line)
+            self._pending_bytes += len(line)
+            self.metrics['accepted_batches'] += 1
+            self.metrics['accepted_events'] += len(items)
+
+            if self._segment_size >= self.segment_bytes:
+                self._seal_segment()
+
+    def _open_segment(self):
+        self._segment_opened = time.time_ns()
+        name = f"{self._segment_opened}-{os.getpid()}.open"
+        self._segment_path = os.path.join(self.directory, name)
+        self._segment = open(self._segment_path, 'ab')
+        self._segment_size = 0
+
+    def _seal_segment(self):
+        """Close the current segment and hand it to the flusher. Caller holds _lock."""
+        if self._segment is None:
+            return
+        self._segment.close()
+        try:
+            if self._segment_size:
+                os.rename(self._segment_path, self._segment_path[:-len('.open')] + '.sealed')
+            else:
+                os.remove(self._segment_path)
+        except FileNotFoundError:
+            pass  # Aged segment adopted by another flusher
+        self._segment = None
+        self._segment_path = None
+        self._segment_size = 0
+
+    # Flushing
+
+    def flush(self, adopt_all=False):
+        """
+        Seal the current segment and write every sealed segment to the
+        database. With adopt_all, segments owned by other live processes are
+        taken over too (only safe when no web workers are running).
+        Returns the number of events written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._seal_segment()
+
+            self._adopt_orphans(adopt_all)
+
+            written = 0
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith('.sealed'):
+                    continue
+                path = os.path.join(self.directory, name)
+                claimed = f"{path}.{os.getpid()}.claim"
+                try:
+                    os.rename(path, claimed)
+                except FileNotFoundError:
+                    continue  # Another process claimed it first
+
+                start = time.perf_counter()
+                try:
+                    count, dropped = self._write_segment(name, claimed)
+                except OperationalError:
+                    # Database unavailable, every segment would fail alike
+                    os.rename(claimed, path)
+                    self.metrics['flush_errors'] += 1
+                    raise
+                except Exception:
+                    logger.exception('Event spool segment %s failed, set aside', name)
+                    os.rename(claimed, path[:-len('.sealed')] + '.failed')
+                    self.metrics['flush_errors'] += 1
+                    self.metrics['failed_segments'] += 1
+                    continue
+                os.remove(claimed)
+                elapsed = time.perf_counter() - start
+
+                written += count
+                self.metrics['flushed_events'] += count
+                self.metrics['dropped_events'] += dropped
+                self.metrics['flushed_segments'] += 1
+                self.metrics['last_flush_seconds'] = round(elapsed, 4)
+                self.metrics['max_flush_seconds'] = round(
+                    max(elapsed, self.metrics['max_flush_seconds'] or 0), 4
+                )
+                self.metrics['last_flush_at'] = timezone.now().isoformat()
+
+            with self._lock:
+                self._pending_bytes = self._disk_usage()
+
+            SpoolSegment.objects.filter(
+                flushed_at__lt=timezone.now() - timedelta(days=SEGMENT_RECORD_DAYS)
+            ).delete()
+            return written
+
+    def retry_failed(self):
+        """Queue set aside segments for another flush; returns how many"""
+        count = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.failed'):
+                path = os.path.join(self.directory, name)
+                os.rename(path, path[:-len('.failed')] + '.sealed')
+                count += 1
+        return count
+
+    def _write_segment(self, name, path):
+        """Insert a claimed segment once; returns (written, dropped)"""
+        with transaction.atomic():
+            if SpoolSegment.objects.filter(name=name).exists():
+                # Written before a crash kept its file around
+                return 0, 0
+            count, dropped = ingest_spooled_events(self._read_segment(path))
+            SpoolSegment.objects.create(name=name)
+        return count, dropped
+
+    def _read_segment(self, path):
+        items = []
+        with open(path, 'rb') as segment:
+            for line in segment:
+                try:
+                    batch = json.loads(line)
+                except ValueError:
+                    continue  # Torn write from a crash mid-append
+                if isinstance(batch, list):
+                    items.extend(batch)
+        return items
+
+    def _adopt_orphans(self, adopt_all=False):
+        """
+        Re-queue segments whose owning process has gone away, and open
+        segments its writer no longer appends to because of their age. Called
+        with _flush_lock held, so claims carrying our own pid are leftovers
+        from a previous process that happened to reuse it.
+        """
+        own_pid = os.getpid()
+        aged = time.time_ns() - 2 * self.segment_age * 1e9
+        with self._lock:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.endswith('.open'):
+                    if path == self._segment_path:
+                        continue
+                    opened, pid = (int(part) for part in name[:-len('.open')].rsplit('-', 1))
+                    if pid == own_pid or adopt_all or opened < aged or not _pid_alive(pid):
+                        os.rename(path, path[:-len('.open')] + '.sealed')
+                elif name.endswith('.claim'):
+                    sealed, pid = name[:-len('.claim')].rsplit('.', 1)
+                    pid = int(pid)
+                    if pid == own_pid or adopt_all or not _pid_alive(pid):
+                        os.rename(path, os.path.join(self.directory, sealed))
+
+    # Background worker
+
+    def ensure_worker(self):
+        """Start the background flusher thread if it is not already running"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name='event-spool-flusher', daemon=True)
+            self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join()
+
+    def run_forever(self):
+        """Flush in the foreground until stop() is called"""
+        self._run()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Event spool flush failed')
+            finally:
+                close_old_connections()
+
+    # Metrics
+
+    def _disk_usage(self):
+        """Bytes waiting to be flushed; failed segments do not count against the limit"""
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.failed'):
+                continue
+            try:
+                total += os.path.getsize(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+        return total
+
+    def stats(self):
+        names = os.listdir(self.directory)
+        with self._lock:
+            return {
+                'pending_bytes': self._pending_bytes,
+                'pending_segments': sum(1 for name in names if not name.endswith(('.open', '.failed'))),
+                'failed_segment_files': sum(1 for name in names if name.endswith('.failed')),
+                'open_segments': sum(1 for name in names if name.endswith('.open')),
+                'max_bytes': self.max_bytes,
+                'worker_running': self._worker is not None and self._worker.is_alive(),
+                **self.metrics,
+            }
+
+
+_spool = None
+_spool_lock = threading.Lock()
+
+
+def spool_enabled():
+    return getattr(settings, 'EVENT_SPOOL_ENABLED', False)
+
+
+def get_event_spool():
+    """Return the process-wide spool, creating it on first use"""
+    global _spool
+    if _spool is None:
+        with _spool_lock:
+            if _spool is None:
+                _spool = EventSpool(
+                    directory=settings.EVENT_SPOOL_DIR,
+                    segment_bytes=settings.EVENT_SPOOL_SEGMENT_BYTES,
+                    max_bytes=settings.EVENT_SPOOL_MAX_BYTES,
+                    flush_interval=settings.EVENT_SPOOL_FLUSH_INTERVAL,
+                    fsync=settings.EVENT_SPOOL_FSYNC,
+                    segment_age=settings.EVENT_SPOOL_SEGMENT_AGE,
+                )
+    return _spool
@@ -1,3 +1,167 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APIClient
+from events.ingest import ingest_event_batch, validate_event_batch
+from events.models import Event, Session, SpoolSegment
+from events.session_cache import get_session_cache
+from events import spool as event_spool
+from events.spool import EventSpool, _pid_alive
+from sites.models import Site
 
-# Create your tests here.
+
+@override_settings(TASK_WORKER_IN_PROCESS=False)
+class EventIngestTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='owner', password='secret')
+        site = Site.objects.create(owner=user, name='Shop', domain='shop.example.com')
+        self.session = Session.objects.create(site=site, device_type='desktop', browser='b', os='o', viewport={})
+        get_session_cache().clear()
+        self.client = APIClient()
+
+    def event(self, session_id=None, **fields):
+        return {
+            'session': self.session.id if session_id is None else session_id,
+            'event_type': 'click',
+            'timestamp': timezone.now().isoformat(),
+            'page_url': 'https://shop.example.com/',
+            'data': {'x': 1, 'y': 2},
+            **fields,
+        }
+
+    def test_batch_is_stored_with_typed_fields_and_page(self):
+        self.assertEqual(ingest_event_batch([self.event(), self.event(event_type='page_view')]), 2)
+        click = Event.objects.get(event_type='click')
+        self.assertEqual((click.x, click.y), (1, 2))
+        self.assertEqual(click.page.url, '/')
+
+    def test_batch_with_an_unknown_session_is_rejected_whole(self):
+        with self.assertRaises(serializers.ValidationError) as raised:
+            validate_event_batch([self.event(), self.event(session_id=self.session.id + 100)])
+        self.assertIn(str(self.session.id + 100), str(raised.exception.detail['session']))
+
+        response = self.client.post(
+            '/api/track/events/', [self.event(), self.event(session_id=self.session.id + 100)], format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Event.objects.exists())
+
+    def test_invalid_items_are_reported_by_index(self):
+        response = self.client.post(
+            '/api/track/events/', [self.event(), self.event(event_type='hover'), 'click'], format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.data), [1])
+        self.assertIn('event_type', response.data[1])
+        self.assertFalse(Event.objects.exists())
+
+    def test_non_list_bodies(self):
+        with self.assertRaises(serializers.ValidationError):
+            validate_event_batch({'events': []})
+        # A single object takes the serializer path
+        response = self.client.post('/api/track/events/', self.event(), format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/track/events/', '"click"', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_beacon_body_sent_as_text_plain(self):
+        response = self.client.post(
+            '/api/track/events/', json.dumps([self.event(), self.event()]), content_type='text/plain'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Event.objects.count(), 2)
+
+
+class EventSpoolTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='owner', password='secret')
+        site = Site.objects.create(owner=user, name='Shop', domain='shop.example.com')
+        self.session = Session.objects.create(site=site, device_type='desktop', browser='b', os='o', viewport={})
+        get_session_cache().clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.spool = EventSpool(self.directory, segment_bytes=1 << 20, max_bytes=1 << 24, flush_interval=60)
+
+    def batch(self, size=2):
+        return [{
+            'session': self.session.id,
+            'event_type': 'click',
+            'timestamp': timezone.now().isoformat(),
+            'page_url': 'https://shop.example.com/',
+            'data': {'x': 1, 'y': 2},
+        } for _ in range(size)]
+
+    def write_segment(self, name, lines):
+        with open(os.path.join(self.directory, name), 'wb') as segment:
+            segment.write(b''.join(lines))
+
+    def dead_pid(self):
+        return next(pid for pid in range(4_000_000, 4_100_000) if not _pid_alive(pid))
+
+    def test_torn_last_line_is_skipped(self):
+        line = json.dumps(self.batch(3)).encode('utf-8') + b'\n'
+        self.write_segment('1-1.sealed', [line, line[:len(line) // 2]])
+        self.assertEqual(self.spool.flush(), 3)
+        self.assertEqual(Event.objects.count(), 3)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_segments_of_dead_processes_are_adopted(self):
+        pid = self.dead_pid()
+        line = json.dumps(self.batch()).encode('utf-8') + b'\n'
+        self.write_segment(f'1-{pid}.open', [line])
+        self.write_segment(f'2-1.sealed.{pid}.claim', [line])
+        self.assertEqual(self.spool.flush(), 4)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_replayed_segment_is_not_inserted_twice(self):
+        self.spool.append(self.batch())
+        self.spool.flush()
+        name = SpoolSegment.objects.get().name
+        # A crash after the commit left the claimed file behind
+        self.write_segment(f'{name}.{self.dead_pid()}.claim', [json.dumps(self.batch()).encode('utf-8') + b'\n'])
+        self.assertEqual(self.spool.flush(), 0)
+        self.assertEqual(Event.objects.count(), 2)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_aged_open_segment_of_live_process_is_adopted(self):
+        line = json.dumps(self.batch()).encode('utf-8') + b'\n'
+        live = os.getppid()
+        self.write_segment(f'{time.time_ns() - 61 * 10**9}-{live}.open', [line])
+        self.write_segment(f'{time.time_ns()}-{live}.open', [line])
+        self.assertEqual(self.spool.flush(), 2)
+        self.assertEqual([name.endswith('.open') for name in os.listdir(self.directory)], [True])
+
+    def test_writer_seals_aged_segment_before_appending(self):
+        self.spool.append(self.batch())
+        self.spool._segment_opened -= 31 * 10**9
+        self.spool.append(self.batch())
+        self.assertEqual(sorted(name.rsplit('.', 1)[1] for name in os.listdir(self.directory)), ['open', 'sealed'])
+
+    def test_failing_segment_is_set_aside(self):
+        ingest = event_spool.ingest_spooled_events
+
+        def flaky(items):
+            if len(items) == 2:
+                raise ValueError('broken segment')
+            return ingest(items)
+
+        self.write_segment('1-1.sealed', [json.dumps(self.batch()).encode('utf-8') + b'\n'])
+        self.write_segment('2-1.sealed', [json.dumps(self.batch(3)).encode('utf-8') + b'\n'])
+        with mock.patch('events.spool.ingest_spooled_events', flaky), self.assertLogs('events.spool', 'ERROR'):
+            self.assertEqual(self.spool.flush(), 3)
+        self.assertEqual(os.listdir(self.directory), ['1-1.failed'])
+        self.assertEqual(self.spool.stats()['pending_bytes'], 0)
+
+        self.assertEqual(self.spool.retry_failed(), 1)
+        self.assertEqual(self.spool.flush(), 2)
+        self.assertEqual(Event.objects.count(), 5)
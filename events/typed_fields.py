@@ -0,0 +1,93 @@
+"""
+Typed copies of the hot Event.data fields
+
+Heatmap and scroll queries only read a few keys of Event.data. Ingest copies
+them into nullable columns so SQL can filter, aggregate and bucket them
+without parsing JSON on every row. Missing or non-numeric values stay NULL,
+and data itself is stored unchanged.
+
+Backfill migrations keep their own frozen copy of this extraction; changes
+here only apply to new events.
+"""
+import hashlib
+import math
+
+TYPED_FIELDS = (
+    'x', 'y', 'viewport_x', 'viewport_y', 'scroll_depth', 'target_hash',
+    'page_x', 'page_y', 'element_x', 'element_y', 'viewport_width',
+)
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _viewport_size(data, viewport):
+    """(width, height) the event was recorded in: its own viewport, else the session's"""
+    for source in (data.get('viewport'), viewport):
+        if isinstance(source, dict):
+            width, height = _number(source.get('width')), _number(source.get('height'))
+            if width or height:
+                return width, height
+    return None, None
+
+
+def target_selector(data):
+    """
+    Selector of a click target: the path the tracker sends, or for older
+    events one built from the tag, id and classes, e.g. button#buy.primary
+    """
+    if isinstance(data.get('selector'), str) and data['selector']:
+        return data['selector']
+    tag = data.get('target')
+    if not isinstance(tag, str) or not tag:
+        return None
+    selector = tag.lower()
+    if isinstance(data.get('id'), str) and data['id']:
+        selector += f"#{data['id']}"
+    classes = data.get('classes')
+    if isinstance(classes, list):
+        selector += ''.join(f'.{name}' for name in classes if isinstance(name, str) and name)
+    return selector
+
+
+def selector_hash(selector):
+    """Signed 64-bit hash of a selector, fits a BigIntegerField"""
+    return int.from_bytes(hashlib.sha1(selector.encode('utf-8')).digest()[:8], 'big', signed=True)
+
+
+def typed_event_fields(event_type, data, viewport=None):
+    """
+    Values of TYPED_FIELDS for an event. viewport is the session's
+    {'width', 'height'}, used when the event does not carry its own.
+    """
+    fields = dict.fromkeys(TYPED_FIELDS)
+    if not isinstance(data, dict):
+        return fields
+
+    x, y = _number(data.get('x')), _number(data.get('y'))
+    fields['x'], fields['y'] = x, y
+    width, height = _viewport_size(data, viewport)
+    fields['viewport_width'] = width
+    if event_type == 'scroll':
+        # y is the scroll offset here, not a position in the viewport
+        fields['scroll_depth'] = _number(data.get('percentage'))
+    else:
+        if x is not None and width:
+            fields['viewport_x'] = x / width
+        if y is not None and height:
+            fields['viewport_y'] = y / height
+        # Document and element relative positions, sent by newer trackers
+        fields['page_x'], fields['page_y'] = _number(data.get('page_x')), _number(data.get('page_y'))
+        fields['element_x'], fields['element_y'] = _number(data.get('offset_x')), _number(data.get('offset_y'))
+
+    selector = target_selector(data)
+    if selector:
+        fields['target_hash'] = selector_hash(selector)
+    return fields
@@ -1,7 +1,7 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path
 from .views import SessionViewSet, EventViewSet
-from .api_views import identify_user
+from .api_views import identify_user, spool_stats, session_cache_stats
 from recordings.recording_api import save_recording_events
 
 router = DefaultRouter()
@@ -10,5 +10,7 @@ router.register(r'events', EventViewSet, basename='event')
 
 urlpatterns = [
     path('identify/', identify_user, name='identify_user'),
+    path('spool/stats/', spool_stats, name='spool_stats'),
+    path('session-cache/stats/', session_cache_stats, name='session_cache_stats'),
     path('recording-events/', save_recording_events, name='recording_events'),
 ] + router.urls
@@ -1,8 +1,30 @@
+import uuid
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
-from django.utils import timezone
-from .models import Session, Event
+from rest_framework.settings import api_settings
+from django.conf import settings
+from django.db import transaction
+from .models import Session
 from .serializers import SessionSerializer, EventSerializer
+from .ingest import (
+    assign_pages, ingest_event_batch, mark_sites_active, record_landing_pages, site_event_counts,
+    validate_event_batch
+)
+from heatmaps.tiles import record_heatmap_tiles
+from .spool import SpoolFull, get_event_spool, spool_enabled
+from .session_cache import get_session_cache
+from .parsers import BeaconJSONParser
+from analytics.runner import ensure_worker
+from sites.limits import LimitExceeded, admit_events, admit_session, get_site_policy, record_session
+
+
+def limit_response(exc):
+    return Response(
+        {'status': 'error', 'reason': exc.reason, 'message': 'Ingestion limit exceeded, retry later'},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={'Retry-After': str(exc.retry_after)}
+    )
+
 
 class SessionViewSet(viewsets.ModelViewSet):
     serializer_class = SessionSerializer
@@ -14,39 +36,100 @@ class SessionViewSet(viewsets.ModelViewSet):
             return Session.objects.filter(site__owner=self.request.user)
         return Session.objects.none()
     
+    def create(self, request, *args, **kwargs):
+        """
+        Sampling and rate limits are applied before validation. A sampled out
+        session is not stored and the response has no id, so the tracker
+        stays idle for that visit.
+        """
+        data = request.data if isinstance(request.data, dict) else {}
+        policy = get_site_policy(tracking_id=data.get('tracking_id')) if data.get('tracking_id') else None
+        if policy is not None:
+            # Clients may send their own session_id so reloads keep the same
+            # decision; an admitted session that is sent again is returned as is
+            try:
+                self.session_uuid = uuid.UUID(str(data.get('session_id')))
+            except ValueError:
+                self.session_uuid = uuid.uuid4()
+            else:
+                existing = Session.objects.filter(site_id=policy.site_id, session_id=self.session_uuid).first()
+                if existing is not None:
+                    return Response(self.get_serializer(existing).data)
+            try:
+                if not admit_session(policy, self.session_uuid):
+                    return Response({'sampled': False, 'session_id': str(self.session_uuid)})
+            except LimitExceeded as exc:
+                return limit_response(exc)
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         """Update site's last_activity_at when a new session is created"""
-        session = serializer.save()
-        site = session.site
-        site.is_connected = True
-        site.last_activity_at = timezone.now()
-        site.save(update_fields=['is_connected', 'last_activity_at'])
+        session_uuid = getattr(self, 'session_uuid', None)
+        session = serializer.save(session_id=session_uuid) if session_uuid else serializer.save()
+        # The tracker starts sending events right away
+        get_session_cache().prime(session)
+        record_session(session.site_id)
+        mark_sites_active([session.site_id])
+
+    def perform_destroy(self, instance):
+        get_session_cache().invalidate(instance.id)
+        instance.delete()
 
 class EventViewSet(viewsets.ModelViewSet):
     serializer_class = EventSerializer
     permission_classes = [permissions.AllowAny]
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + [BeaconJSONParser]
 
     def create(self, request, *args, **kwargs):
-        is_many = isinstance(request.data, list)
-        serializer = self.get_serializer(data=request.data, many=is_many)
+        if settings.TASK_WORKER_IN_PROCESS:
+            # Without a worker process, this one also runs the periodic tasks
+            ensure_worker()
+
+        # Quotas are charged from the raw body, before any validation
+        try:
+            admit_events(site_event_counts(request.data))
+        except LimitExceeded as exc:
+            return limit_response(exc)
+
+        # Batches from the tracking script take the bulk ingestion fast path
+        if isinstance(request.data, list):
+            if spool_enabled():
+                return self.spool_batch(request.data)
+            count = ingest_event_batch(request.data)
+            return Response({'status': 'success', 'count': count}, status=status.HTTP_201_CREATED)
+
+        serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        
+        session = serializer.validated_data['session']
+        event = {**serializer.validated_data, 'session_id': session.id}
+        sessions = {session.id: (session.site_id, session.device_type)}
+        assign_pages([event], sessions)
+        with transaction.atomic():
+            record_heatmap_tiles([event], sessions)
+            serializer.save(page_id=event['page_id'])
+            record_landing_pages([event])
+
         # Update site's last_activity_at when events are received
-        if is_many and serializer.data:
-            # Get the first event's session to find the site
-            first_event = Event.objects.filter(id=serializer.data[0]['id']).select_related('session__site').first()
-            if first_event and first_event.session:
-                site = first_event.session.site
-                site.is_connected = True
-                site.last_activity_at = timezone.now()
-                site.save(update_fields=['is_connected', 'last_activity_at'])
-        elif not is_many and serializer.data:
-            event = Event.objects.filter(id=serializer.data['id']).select_related('session__site').first()
-            if event and event.session:
-                site = event.session.site
-                site.is_connected = True
-                site.last_activity_at = timezone.now()
-                site.save(update_fields=['is_connected', 'last_activity_at'])
-        
+        mark_sites_active([serializer.instance.session.site_id])
+
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def spool_batch(self, items):
+        """
+        Acknowledge a batch as soon as it is on the local spool; the
+        background flusher writes it to the database later
+        """
+        # Unknown sessions are rejected before spooling, usually from the session cache
+        validate_event_batch(items)
+        spool = get_event_spool()
+        try:
+            spool.append(items)
+        except SpoolFull:
+            return Response(
+                {'status': 'error', 'message': 'Ingestion backlog is full, retry later'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(int(spool.flush_interval) + 1)}
+            )
+        if settings.EVENT_SPOOL_WORKER:
+            spool.ensure_worker()
+        return Response({'status': 'queued', 'count': len(items)}, status=status.HTTP_202_ACCEPTED)
@@ -0,0 +1,67 @@
+"""
+Ordered funnel evaluation in the database
+
+A session reaches step k when it has a page view matching step k strictly
+after the moment it reached step k-1. Each step is one CTE over page views
+of the step's pages (served by the Event (page, event_type, timestamp)
+index), joined to the previous step on session and time, keeping the
+earliest match per session. The whole funnel is a single query and no
+session ids travel through Python.
+
+Step URLs are resolved with events.pages.match_pages; each step may set
+'match' (contains by default, exact, prefix or glob).
+"""
+from django.db import connection
+from events.models import Event
+from events.pages import match_pages
+
+
+def _page_subquery(site, step):
+    pages = match_pages(site, step.get('url', ''), step.get('match', 'contains')).values('id')
+    return pages.query.get_compiler(connection=connection).as_sql()
+
+
+def funnel_step_sql(site, steps, start=None, end=None):
+    """
+    SQL and params returning one row with the number of sessions that
+    reached each step. start/end (aware datetimes) bound when sessions enter
+    the first step; later steps may happen any time after.
+    """
+    table = Event._meta.db_table
+    ops = connection.ops
+    ctes, params = [], []
+
+    for index, step in enumerate(steps):
+        page_sql, page_params = _page_subquery(site, step)
+        where = ['e.event_type = %s', f'e.page_id IN ({page_sql})']
+        params += ['page_view', *page_params]
+
+        if index == 0:
+            join = ''
+            if start is not None:
+                where.append('e."timestamp" >= %s')
+                params.append(ops.adapt_datetimefield_value(start))
+            if end is not None:
+                where.append('e."timestamp" < %s')
+                params.append(ops.adapt_datetimefield_value(end))
+        else:
+            join = f'JOIN step_{index - 1} p ON p.session_id = e.session_id AND e."timestamp" > p.reached_at'
+
+        ctes.append(
+            f'step_{index} AS ('
+            f'SELECT e.session_id, MIN(e."timestamp") AS reached_at FROM "{table}" e {join} '
+            f'WHERE {" AND ".join(where)} GROUP BY e.session_id)'
+        )
+
+    counts = ', '.join(f'(SELECT COUNT(*) FROM step_{index})' for index in range(len(steps)))
+    return f'WITH {", ".join(ctes)} SELECT {counts}', params
+
+
+def funnel_step_counts(site, steps, start=None, end=None):
+    """Number of sessions reaching each step, in step order"""
+    if not steps:
+        return []
+    sql, params = funnel_step_sql(site, steps, start, end)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return list(cursor.fetchone())
@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from funnels.models import Funnel
+from funnels.results import invalidate_funnel_results, refresh_funnel_results
+
+
+class Command(BaseCommand):
+    help = 'Update materialized funnel results past each funnel\'s watermark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--funnel', type=int, help='Only refresh this funnel id')
+        parser.add_argument('--rebuild', action='store_true', help='Drop stored results and rebuild from scratch')
+        parser.add_argument(
+            '--loop', type=int, metavar='SECONDS',
+            help='Keep refreshing every SECONDS seconds (scheduler mode)'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            funnels = Funnel.objects.select_related('site')
+            if options['funnel']:
+                funnels = funnels.filter(id=options['funnel'])
+
+            for funnel in funnels:
+                if options['rebuild']:
+                    invalidate_funnel_results(funnel)
+                days = refresh_funnel_results(funnel)
+                if days:
+                    self.stdout.write(f"{funnel}: evaluated {days} days, results through {funnel.results_through}")
+
+            if not options['loop']:
+                break
+            options['rebuild'] = False
+            try:
+                time.sleep(options['loop'])
+            except KeyboardInterrupt:
+                break
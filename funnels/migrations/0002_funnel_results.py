@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('funnels', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='funnel',
+            name='results_steps_hash',
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='funnel',
+            name='results_through',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='FunnelResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('step_counts', models.JSONField(default=list)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('funnel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='funnels.funnel')),
+            ],
+            options={
+                'unique_together': {('funnel', 'day')},
+            },
+        ),
+    ]
@@ -8,5 +8,26 @@ class Funnel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Materialized results watermark, see funnels.results
+    results_through = models.DateField(null=True, blank=True)  # Last day with a final FunnelResult
+    results_steps_hash = models.CharField(max_length=40, blank=True)  # sha1 of the steps the results were built for
+
     def __str__(self):
         return self.name
+
+
+class FunnelResult(models.Model):
+    """
+    Step counts of one funnel for the sessions that entered its first step
+    on a given day
+    """
+    funnel = models.ForeignKey(Funnel, on_delete=models.CASCADE, related_name='results')
+    day = models.DateField()
+    step_counts = models.JSONField(default=list)  # Sessions reaching each step, in step order
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['funnel', 'day']
+
+    def __str__(self):
+        return f"{self.funnel} on {self.day}"
@@ -0,0 +1,134 @@
+"""
+Materialized daily funnel results
+
+FunnelResult stores, per funnel and day, how many of the sessions that
+entered the first step that day went on to reach each step. Funnel reads
+sum the stored days and add today live.
+
+Funnel.results_through is the watermark: every day up to it has a final
+result. refresh_funnel_results only evaluates days after the watermark,
+plus FUNNEL_RESULT_LOOKBACK_DAYS before it for late events and sessions
+that cross midnight. Results remember the steps they were built from, so
+editing the steps drops and rebuilds that funnel only.
+
+The task workers run refresh_all_funnel_results every FUNNEL_REFRESH_EVERY
+seconds to move the watermarks forward. Reads never evaluate closed days
+themselves: when the watermark is behind they serve what is stored, queue a
+calculate_funnel_metrics job and report how far behind the result is.
+"""
+import hashlib
+import json
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from funnels.engine import funnel_step_counts
+from funnels.models import FunnelResult
+
+
+def steps_hash(steps):
+    return hashlib.sha1(json.dumps(steps, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def invalidate_funnel_results(funnel):
+    """Drop stored results and rewind the watermark"""
+    with transaction.atomic():
+        FunnelResult.objects.filter(funnel=funnel).delete()
+        funnel.results_through = None
+        funnel.results_steps_hash = steps_hash(funnel.steps)
+        funnel.save(update_fields=['results_through', 'results_steps_hash'])
+
+
+def refresh_funnel_results(funnel, today=None):
+    """
+    Bring the stored results up to yesterday. Returns the number of days
+    evaluated.
+    """
+    today = today or timezone.localdate()
+    yesterday = today - timedelta(days=1)
+
+    if funnel.results_steps_hash != steps_hash(funnel.steps):
+        invalidate_funnel_results(funnel)
+
+    if funnel.results_through is None:
+        first_day = max(
+            today - timedelta(days=settings.FUNNEL_RESULT_DAYS),
+            timezone.localdate(funnel.site.created_at)
+        )
+    else:
+        first_day = funnel.results_through + timedelta(days=1 - settings.FUNNEL_RESULT_LOOKBACK_DAYS)
+
+    day = first_day
+    while day <= yesterday:
+        start, end = _day_bounds(day)
+        FunnelResult.objects.update_or_create(
+            funnel=funnel,
+            day=day,
+            defaults={'step_counts': funnel_step_counts(funnel.site, funnel.steps, start, end)}
+        )
+        day += timedelta(days=1)
+
+    if funnel.results_through != yesterday:
+        funnel.results_through = yesterday
+        funnel.save(update_fields=['results_through'])
+    return max((yesterday - first_day).days + 1, 0)
+
+
+def stale_days(funnel, today=None):
+    """
+    Closed days the stored results are missing: 0 when up to date, None when
+    nothing usable is stored yet
+    """
+    today = today or timezone.localdate()
+    if funnel.results_through is None or funnel.results_steps_hash != steps_hash(funnel.steps):
+        return None
+    return max((today - timedelta(days=1) - funnel.results_through).days, 0)
+
+
+def queue_funnel_refresh(funnel):
+    """Queue a refresh job unless one is already waiting or running. Returns the job."""
+    from analytics.models import Job
+    from analytics.tasks import calculate_funnel_metrics
+
+    pending = Job.objects.filter(
+        task=calculate_funnel_metrics.name,
+        args=[funnel.id],
+        status__in=[Job.QUEUED, Job.RUNNING]
+    ).first()
+    return pending or calculate_funnel_metrics.delay(funnel.id)
+
+
+def funnel_results(funnel, start_day):
+    """
+    Step counts for sessions that entered the funnel since start_day,
+    merging stored days with today's live counts. Returns (step_counts,
+    freshness); when stored results are behind, a refresh is queued and
+    freshness tells how many closed days are missing.
+    """
+    today = timezone.localdate()
+    missing = stale_days(funnel, today)
+    job = queue_funnel_refresh(funnel) if missing != 0 else None
+
+    totals = [0] * len(funnel.steps)
+    if missing is not None:
+        # Results of edited steps are useless, only the live day is counted then
+        results = FunnelResult.objects.filter(funnel=funnel, day__gte=start_day)
+        for step_counts in results.values_list('step_counts', flat=True):
+            for index, count in enumerate(step_counts[:len(totals)]):
+                totals[index] += count
+
+    start, end = _day_bounds(today)
+    for index, count in enumerate(funnel_step_counts(funnel.site, funnel.steps, start, end)):
+        totals[index] += count
+
+    freshness = {
+        'results_through': funnel.results_through.isoformat() if missing is not None else None,
+        'stale_days': missing,
+        'refresh_job': job.id if job is not None else None,
+    }
+    return totals, freshness
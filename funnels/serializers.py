@@ -5,4 +5,4 @@ class FunnelSerializer(serializers.ModelSerializer):
     class Meta:
         model = Funnel
         fields = '__all__'
-        read_only_fields = ('created_at', 'updated_at')
+        read_only_fields = ('created_at', 'updated_at', 'results_through', 'results_steps_hash')
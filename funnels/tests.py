@@ -1,3 +1,83 @@
+import random
+from datetime import timedelta
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.utils import timezone
+from events.ingest import ingest_event_batch
+from events.models import Session
+from events.session_cache import get_session_cache
+from funnels.engine import funnel_step_counts
+from sites.models import Site
 
-# Create your tests here.
+STEPS = [
+    {'name': 'Pricing', 'url': '/pricing'},
+    {'name': 'Signup', 'url': '/signup'},
+    {'name': 'Checkout', 'url': '/checkout'},
+]
+
+
+def brute_force_counts(visits, steps):
+    """Ordered match in Python: earliest visit of each step strictly after the previous one"""
+    counts = [0] * len(steps)
+    for views in visits:
+        reached_at = None
+        for index, step in enumerate(steps):
+            times = [at for page, at in views if step['url'] in page and (reached_at is None or at > reached_at)]
+            if not times:
+                break
+            reached_at = min(times)
+            counts[index] += 1
+    return counts
+
+
+class FunnelEngineTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='secret')
+        self.site = Site.objects.create(owner=self.user, name='Shop', domain='shop.example.com')
+        self.start = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        get_session_cache().clear()
+
+    def visit(self, *views):
+        """A session with page views given as (path, seconds after start)"""
+        session = Session.objects.create(site=self.site, device_type='desktop', browser='b', os='o', viewport={})
+        ingest_event_batch([{
+            'session': session.id,
+            'event_type': 'page_view',
+            'timestamp': (self.start + timedelta(seconds=seconds)).isoformat(),
+            'page_url': f'https://shop.example.com{path}',
+            'data': {},
+        } for path, seconds in views])
+        return session
+
+    def test_steps_must_happen_in_order(self):
+        self.visit(('/pricing', 0), ('/signup', 10), ('/checkout', 20))
+        self.visit(('/signup', 0), ('/pricing', 10), ('/checkout', 20))
+        self.visit(('/checkout', 0), ('/pricing', 10))
+        self.assertEqual(funnel_step_counts(self.site, STEPS), [3, 1, 1])
+
+    def test_same_timestamp_does_not_advance(self):
+        self.visit(('/pricing', 5), ('/signup', 5))
+        self.assertEqual(funnel_step_counts(self.site, STEPS), [1, 0, 0])
+
+    def test_earliest_step_match_is_used(self):
+        # Matching from the first pricing view keeps the later signup reachable
+        self.visit(('/pricing', 0), ('/signup', 10), ('/pricing', 20), ('/checkout', 30))
+        self.assertEqual(funnel_step_counts(self.site, STEPS), [1, 1, 1])
+
+    def test_window_bounds_the_first_step_only(self):
+        self.visit(('/pricing', 0), ('/signup', 4000))
+        self.visit(('/pricing', -100), ('/signup', 10))
+        start = self.start
+        end = self.start + timedelta(seconds=60)
+        self.assertEqual(funnel_step_counts(self.site, STEPS, start, end), [1, 1, 0])
+
+    def test_matches_brute_force_ordering(self):
+        random.seed(13)
+        paths = ['/pricing', '/signup', '/checkout', '/blog']
+        visits = []
+        for _ in range(60):
+            views = [(random.choice(paths), random.randint(0, 30)) for _ in range(random.randint(1, 6))]
+            self.visit(*views)
+            visits.append(views)
+        self.assertEqual(funnel_step_counts(self.site, STEPS), brute_force_counts(visits, STEPS))
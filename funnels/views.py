@@ -1,6 +1,8 @@
 from rest_framework import viewsets, permissions
 from .models import Funnel
 from .serializers import FunnelSerializer
+from .results import invalidate_funnel_results, steps_hash
+from analytics.tasks import calculate_funnel_metrics
 
 class FunnelViewSet(viewsets.ModelViewSet):
     serializer_class = FunnelSerializer
@@ -8,3 +10,11 @@ class FunnelViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         return Funnel.objects.filter(site__owner=self.request.user)
+
+    def perform_update(self, serializer):
+        old_hash = steps_hash(serializer.instance.steps)
+        funnel = serializer.save()
+        # New steps make every stored result wrong; rebuild this funnel only
+        if steps_hash(funnel.steps) != old_hash:
+            invalidate_funnel_results(funnel)
+            calculate_funnel_metrics.apply_async((funnel.id,), owner=self.request.user)
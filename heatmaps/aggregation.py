@@ -0,0 +1,281 @@
+"""
+Heatmap aggregation engines
+
+Each engine turns a set of events into {(x, y): count} grid counts; the
+view then converts those counts into the point format the dashboard
+expects.
+"""
+from collections import Counter
+from collections import defaultdict
+from django.conf import settings
+from django.db.models import (
+    Avg, BigIntegerField, Case, CharField, Count, ExpressionWrapper, F, FloatField, OuterRef, Subquery,
+    Value, When
+)
+from django.db.models.functions import Cast, Ceil, Coalesce, Floor, Mod
+from django.db.models.lookups import Exact, GreaterThan, GreaterThanOrEqual
+from events.typed_fields import target_selector
+from heatmaps.tiles import TILE_RESOLUTION, tile_cell
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, numpy_counts falls back to Python
+    np = None
+
+# Heatmap type (as used by the dashboard) to Event.event_type
+HEATMAP_EVENT_TYPES = {
+    'click': 'click',
+    'scroll': 'scroll',
+    'move': 'mouse_move',
+}
+
+# Above this many grid cells bincount would allocate too much, use unique instead
+MAX_BINCOUNT_CELLS = 4_000_000
+
+
+def python_counts(events, event_type, resolution=None):
+    """
+    Bucket events one at a time in Python. Reads every matching Event row,
+    so it is only used when explicitly requested with source=events.
+    """
+    counts = Counter()
+    for event in events:
+        cell = tile_cell(event_type, event.data, resolution)
+        if cell is not None:
+            counts[cell] += 1
+    return counts
+
+
+def _to_float_array(values):
+    """Convert raw JSON values to floats, turning anything non-numeric into NaN"""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        cleaned = []
+        for value in values:
+            try:
+                cleaned.append(float(value))
+            except (TypeError, ValueError):
+                cleaned.append(np.nan)
+        return np.asarray(cleaned, dtype=np.float64)
+
+
+def bin_coordinates(xs, ys, resolution):
+    """
+    Vectorized equivalent of tile_cell over whole columns: truncate to int,
+    round to the nearest cell (half to even, like round()) and count.
+    Returns {(x, y): count}.
+    """
+    xs = _to_float_array(xs)
+    ys = _to_float_array(ys)
+    valid = np.isfinite(xs) & np.isfinite(ys)
+    if not valid.any():
+        return {}
+
+    ix = np.round(np.trunc(xs[valid]) / resolution).astype(np.int64)
+    iy = np.round(np.trunc(ys[valid]) / resolution).astype(np.int64)
+
+    x_min, y_min = ix.min(), iy.min()
+    width = int(iy.max() - y_min) + 1
+    cells = (int(ix.max() - x_min) + 1) * width
+
+    if cells <= MAX_BINCOUNT_CELLS:
+        bins = np.bincount((ix - x_min) * width + (iy - y_min), minlength=cells)
+        occupied = np.flatnonzero(bins)
+        cell_x = occupied // width + x_min
+        cell_y = occupied % width + y_min
+        values = bins[occupied]
+    else:
+        pairs, values = np.unique(np.stack([ix, iy], axis=1), axis=0, return_counts=True)
+        cell_x, cell_y = pairs[:, 0], pairs[:, 1]
+
+    return {
+        (int(x) * resolution, int(y) * resolution): int(count)
+        for x, y, count in zip(cell_x, cell_y, values)
+    }
+
+
+def numpy_counts(events, event_type, resolution=None):
+    """
+    Pull only the coordinate columns and bin them with NumPy. Falls back to
+    the Python loop over the same columns when NumPy is not installed.
+    """
+    resolution = resolution or TILE_RESOLUTION[event_type]
+
+    # Typed columns filled at ingest, no JSON parsing per row
+    if event_type == 'scroll':
+        ys = list(events.filter(y__isnull=False).values_list('y', flat=True))
+        xs = [0] * len(ys)
+    else:
+        rows = list(events.filter(x__isnull=False, y__isnull=False).values_list('x', 'y'))
+        xs = [row[0] for row in rows]
+        ys = [row[1] for row in rows]
+
+    if np is None:
+        counts = Counter()
+        for x, y in zip(xs, ys):
+            cell = tile_cell('click', {'x': x, 'y': y}, resolution)
+            if cell is not None:
+                counts[cell] += 1
+        return counts
+
+    return bin_coordinates(xs, ys, resolution)
+
+
+def _sql_bucket(value, resolution):
+    """
+    Grid index of a coordinate column (name or expression) computed in SQL
+    with the same rounding as tile_cell: truncate to int, then
+    round(value / resolution) with halves to even. SQL ROUND rounds halves
+    away from zero, so the half case is spelled out with integer arithmetic.
+    """
+    if isinstance(value, str):
+        value = F(value)
+    truncated = Cast(
+        Case(When(GreaterThanOrEqual(value, 0), then=Floor(value)), default=Ceil(value)),
+        BigIntegerField()
+    )
+    quotient = Cast(
+        Floor(ExpressionWrapper(truncated * Value(1.0) / Value(resolution), output_field=FloatField())),
+        BigIntegerField()
+    )
+    remainder2 = (truncated - quotient * Value(resolution)) * Value(2)
+    return Case(
+        When(GreaterThan(remainder2, resolution), then=quotient + Value(1)),
+        When(Exact(remainder2, resolution) & ~Exact(Mod(quotient, Value(2)), 0), then=quotient + Value(1)),
+        default=quotient,
+        output_field=BigIntegerField(),
+    )
+
+
+def sql_counts(events, event_type, resolution=None):
+    """
+    Let the database bin events with GROUP BY over the typed x/y columns, so
+    only one row per occupied cell leaves it. Works on PostgreSQL and SQLite.
+    """
+    resolution = resolution or TILE_RESOLUTION[event_type]
+    if event_type == 'scroll':
+        cells = events.filter(y__isnull=False).annotate(
+            cell_x=Value(0, output_field=BigIntegerField()), cell_y=_sql_bucket('y', resolution)
+        )
+    else:
+        cells = events.filter(x__isnull=False, y__isnull=False).annotate(
+            cell_x=_sql_bucket('x', resolution), cell_y=_sql_bucket('y', resolution)
+        )
+    rows = cells.order_by().values('cell_x', 'cell_y').annotate(count=Count('id')).values_list(
+        'cell_x', 'cell_y', 'count'
+    )
+    return {(int(x) * resolution, int(y) * resolution): count for x, y, count in rows}
+
+
+def breakpoint_for_width(width):
+    """Name of the HEATMAP_BREAKPOINTS class a page width falls into"""
+    name = settings.HEATMAP_BREAKPOINTS[0][0]
+    for candidate, min_width in settings.HEATMAP_BREAKPOINTS:
+        if width >= min_width:
+            name = candidate
+    return name
+
+
+def width_class():
+    """
+    SQL expression naming the HEATMAP_BREAKPOINTS class of an event's
+    viewport width. Events recorded without a width are classed by the
+    HEATMAP_DEVICE_WIDTHS width of their session's device type.
+    """
+    device_widths = settings.HEATMAP_DEVICE_WIDTHS
+    whens = [
+        When(viewport_width__isnull=True, session__device_type=device, then=Value(breakpoint_for_width(width)))
+        for device, width in device_widths.items()
+    ]
+    whens.append(When(
+        viewport_width__isnull=True,
+        then=Value(breakpoint_for_width(device_widths.get('desktop', settings.HEATMAP_BREAKPOINTS[-1][1])))
+    ))
+    for name, min_width in reversed(settings.HEATMAP_BREAKPOINTS[1:]):
+        whens.append(When(viewport_width__gte=min_width, then=Value(name)))
+    return Case(*whens, default=Value(settings.HEATMAP_BREAKPOINTS[0][0]), output_field=CharField())
+
+
+def breakpoint_counts(events, event_type, resolution=None):
+    """
+    Heatmap grid counts for every page width class from one GROUP BY over
+    document coordinates. Returns {class: {(x, y): count}}. Events from
+    trackers that did not send document coordinates fall back to their
+    viewport coordinates.
+    """
+    resolution = resolution or TILE_RESOLUTION[event_type]
+    if event_type == 'scroll':
+        # Scroll offsets are already document positions
+        cells = events.filter(y__isnull=False).annotate(
+            cell_x=Value(0, output_field=BigIntegerField()), cell_y=_sql_bucket('y', resolution)
+        )
+    else:
+        page_x, page_y = Coalesce('page_x', 'x'), Coalesce('page_y', 'y')
+        cells = events.filter(x__isnull=False, y__isnull=False).annotate(
+            cell_x=_sql_bucket(page_x, resolution), cell_y=_sql_bucket(page_y, resolution)
+        )
+    rows = cells.annotate(width_class=width_class()).order_by().values(
+        'width_class', 'cell_x', 'cell_y'
+    ).annotate(count=Count('id')).values_list('width_class', 'cell_x', 'cell_y', 'count')
+
+    counts = defaultdict(dict)
+    for name, x, y, count in rows:
+        counts[name][(int(x) * resolution, int(y) * resolution)] = count
+    return dict(counts)
+
+
+def element_counts(events, limit=50):
+    """
+    Clicks per target element (selector hash) with the average click
+    position inside the element, independent of screen size
+    """
+    example = events.filter(target_hash=OuterRef('target_hash')).order_by().values('data')[:1]
+    rows = events.filter(target_hash__isnull=False).order_by().values('target_hash').annotate(
+        clicks=Count('id'),
+        sessions=Count('session', distinct=True),
+        element_x=Avg('element_x'),
+        element_y=Avg('element_y'),
+        example=Subquery(example),
+    ).order_by('-clicks')[:limit]
+    return [
+        {**{key: value for key, value in row.items() if key != 'example'},
+         'selector': target_selector(row['example'] or {})}
+        for row in rows
+    ]
+
+
+def tile_counts(tiles):
+    """
+    Sum pre-aggregated daily tiles. Returns (counts, event_count, session_count).
+    Session counts are summed per day, so a session spanning midnight is
+    counted once per day.
+    """
+    counts = Counter()
+    event_count = 0
+    session_count = 0
+    for tile_data, tile_events, tile_sessions in tiles.values_list('counts', 'event_count', 'session_count'):
+        for key, count in tile_data.items():
+            x, y = map(int, key.split(','))
+            counts[(x, y)] += count
+        event_count += tile_events
+        session_count += tile_sessions
+    return counts, event_count, session_count
+
+
+def build_points(event_type, counts):
+    """
+    Convert grid counts to heatmap points. Returns (points, max_value).
+    """
+    if event_type == 'scroll':
+        # Scroll depth heatmap (full width bars)
+        points = [
+            {'x': 0, 'y': y, 'value': count, 'width': 1920}
+            for (x, y), count in counts.items()
+        ]
+    else:
+        points = [
+            {'x': x, 'y': y, 'value': count}
+            for (x, y), count in counts.items()
+        ]
+    return points, max(counts.values(), default=0)
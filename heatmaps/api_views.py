@@ -1,8 +1,15 @@
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_GET
 from analytics.tasks import generate_heatmap_data
+from heatmaps.tracker import (
+    etag_for, etag_matches, get_compiled_script, pick_encoding, site_tracking_id
+)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -14,168 +21,53 @@ def trigger_heatmap_generation(request, site_id):
     heatmap_type = request.data.get('heatmap_type', 'click')
     device_type = request.data.get('device_type', 'desktop')
     days = request.data.get('days', 7)
+
+    # Jobs run later, reject what would only fail there
+    if not isinstance(page_url, str) or not page_url:
+        return Response({'error': 'page_url is required'}, status=400)
+    if isinstance(days, str) and days.isdigit():
+        days = int(days)
+    if isinstance(days, bool) or not isinstance(days, int) or days < 1:
+        return Response({'error': 'days must be a positive integer'}, status=400)
     
-    # Trigger task synchronously (Celery removed)
-    # task = generate_heatmap_data.delay(site_id, page_url, heatmap_type, device_type, days)
-    result = generate_heatmap_data(site_id, page_url, heatmap_type, device_type, days)
+    # Queue the task; poll the job status endpoint for the result
+    job = generate_heatmap_data.apply_async(
+        (site_id, page_url, heatmap_type, device_type, days),
+        owner=request.user
+    )
     
     return Response({
-        'status': 'success',
-        'message': 'Heatmap generation completed',
-        'result': result
-    })
-
+        'status': job.status,
+        'message': 'Heatmap generation queued',
+        'job_id': job.id,
+        'status_url': reverse('job_status', args=[job.id])
+    }, status=202)
 
 
-@api_view(['GET'])
-@permission_classes([])  # Allow unauthenticated access
+# Plain Django view: DRF authentication would touch the session and add
+# Vary: Cookie, which keeps shared caches from storing the script
+@require_GET
 def get_tracking_script(request, site_id):
     """
-    Generate tracking script for a specific site
+    Serve the tracking script for a site, minified and precompressed, with
+    ETag / 304 support. Nothing is rebuilt per request, see heatmaps.tracker.
     """
-    from sites.models import Site
-    
-    try:
-        site = Site.objects.get(id=site_id)
-        
-        api_base = request.build_absolute_uri('/api/track')
-        
-        script = f"""
-(function() {{
-    'use strict';
-    const BATCH_INTERVAL = 5000;
-    const MOUSE_MOVE_THROTTLE = 100;
-    const API_BASE = '{api_base}';
-    const TRACKING_ID = '{site.tracking_id}';
-
-    class HotjarClone {{
-        constructor(trackingId) {{
-            this.trackingId = trackingId;
-            this.sessionId = null;
-            this.eventQueue = [];
-            this.init();
-        }}
-
-        async init() {{
-            await this.createSession();
-            if (this.sessionId) {{
-                this.setupEventListeners();
-                this.startBatchSender();
-            }}
-        }}
-        
-        async createSession() {{
-            try {{
-                const response = await fetch(`${{API_BASE}}/sessions/`, {{
-                    method: 'POST',
-                    headers: {{ 'Content-Type': 'application/json' }},
-                    body: JSON.stringify({{
-                        tracking_id: this.trackingId,
-                        device_type: /Mobile|Android|iPhone/i.test(navigator.userAgent) ? 'mobile' : 'desktop',
-                        browser: navigator.userAgent.substring(0, 100),
-                        os: navigator.platform.substring(0, 100),
-                        viewport: {{ width: window.innerWidth, height: window.innerHeight }}
-                    }})
-                }});
-                if (response.ok) {{
-                    const data = await response.json();
-                    this.sessionId = data.id;
-                    console.log('Tracking initialized');
-                }}
-            }} catch (e) {{
-                console.error('Tracking init failed:', e);
-            }}
-        }}
-
-        setupEventListeners() {{
-            document.addEventListener('click', (e) => this.trackClick(e));
-            
-            let lastMouseMove = 0;
-            document.addEventListener('mousemove', (e) => {{
-                const now = Date.now();
-                if (now - lastMouseMove > MOUSE_MOVE_THROTTLE) {{
-                    this.trackMouseMove(e);
-                    lastMouseMove = now;
-                }}
-            }});
-            
-            let scrollTimeout;
-            window.addEventListener('scroll', () => {{
-                clearTimeout(scrollTimeout);
-                scrollTimeout = setTimeout(() => this.trackScroll(), 100);
-            }});
-        }}
-
-        trackClick(event) {{
-            this.queueEvent({{
-                event_type: 'click',
-                timestamp: new Date().toISOString(),
-                session: this.sessionId,
-                page_url: window.location.href,
-                data: {{
-                    x: event.clientX,
-                    y: event.clientY,
-                    target: event.target.tagName,
-                    id: event.target.id,
-                    classes: Array.from(event.target.classList)
-                }}
-            }});
-        }}
-
-        trackMouseMove(event) {{
-            this.queueEvent({{
-                event_type: 'mouse_move',
-                timestamp: new Date().toISOString(),
-                session: this.sessionId,
-                page_url: window.location.href,
-                data: {{ x: event.clientX, y: event.clientY }}
-            }});
-        }}
-
-        trackScroll() {{
-            const scrollPercentage = Math.round(
-                (window.scrollY / (document.body.scrollHeight - window.innerHeight)) * 100
-            );
-            this.queueEvent({{
-                event_type: 'scroll',
-                timestamp: new Date().toISOString(),
-                session: this.sessionId,
-                page_url: window.location.href,
-                data: {{ y: window.scrollY, percentage: scrollPercentage }}
-            }});
-        }}
-
-        queueEvent(event) {{
-            this.eventQueue.push(event);
-        }}
-
-        startBatchSender() {{
-            setInterval(() => {{
-                if (this.eventQueue.length > 0) {{
-                    this.sendEvents();
-                }}
-            }}, BATCH_INTERVAL);
-        }}
-
-        sendEvents() {{
-            const events = this.eventQueue.splice(0);
-            fetch(`${{API_BASE}}/events/`, {{
-                method: 'POST',
-                headers: {{ 'Content-Type': 'application/json' }},
-                body: JSON.stringify(events),
-                keepalive: true
-            }}).catch(err => console.error('Failed to send events:', err));
-        }}
-    }}
-    
-    new HotjarClone(TRACKING_ID);
-}})();
-"""
-        
-        return HttpResponse(script, content_type='application/javascript')
-    except Site.DoesNotExist:
+    tracking_id = site_tracking_id(site_id)
+    if tracking_id is None:
         return HttpResponse('// Site not found', content_type='application/javascript', status=404)
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return HttpResponse(f'// Error generating script: {str(e)}', content_type='application/javascript', status=500)
+
+    script = get_compiled_script(request.build_absolute_uri('/api/track'), tracking_id)
+    encoding, body = pick_encoding(script, request.headers.get('Accept-Encoding'))
+    if etag_matches(script, request.headers.get('If-None-Match')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/javascript; charset=utf-8')
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag_for(script, encoding)
+    response['Cache-Control'] = (
+        f'public, max-age={settings.TRACKING_SCRIPT_MAX_AGE}, '
+        f'stale-while-revalidate={settings.TRACKING_SCRIPT_STALE_WHILE_REVALIDATE}'
+    )
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
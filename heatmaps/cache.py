@@ -0,0 +1,161 @@
+"""
+Read-through heatmap cache on top of HeatmapData
+
+A HeatmapData row keyed on (site, page_url, heatmap_type, device_type,
+date_range_start, date_range_end) stores the summed tiles of the *sealed*
+days of that range (every day before today). Today's tiles keep changing
+as events arrive, so they are always added live on read.
+
+An entry is fresh when it is younger than HEATMAP_CACHE_TTL and no tile in
+its sealed range was updated after it was generated (late events or a
+backfill invalidate it). On a miss, an existing valid entry for an
+overlapping window (typically yesterday's) is reused: only the days that
+fell out of the window are subtracted and the newly sealed days added.
+"""
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from events.pages import match_pages
+from heatmaps.aggregation import tile_counts
+from heatmaps.models import HeatmapData, HeatmapTile
+
+STATS_KEYS = ('hit', 'miss', 'stale', 'incremental')
+STATS_PREFIX = 'heatmap_cache:'
+
+
+def _record(status):
+    key = STATS_PREFIX + status
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def cache_stats():
+    """Hit/miss counters plus the size of the cache table"""
+    counters = cache.get_many([STATS_PREFIX + status for status in STATS_KEYS])
+    stats = {status: counters.get(STATS_PREFIX + status, 0) for status in STATS_KEYS}
+    lookups = sum(stats.values())
+    stats['hit_rate'] = round(stats['hit'] / lookups, 4) if lookups else None
+    stats['entries'] = HeatmapData.objects.count()
+    stats['ttl_seconds'] = settings.HEATMAP_CACHE_TTL
+    return stats
+
+
+def _counts_from_points(points):
+    return Counter({(point['x'], point['y']): point['value'] for point in points})
+
+
+def _points_from_counts(counts):
+    return [{'x': x, 'y': y, 'value': value} for (x, y), value in counts.items() if value > 0]
+
+
+def _is_valid(entry, tiles):
+    """Entry is younger than the TTL and none of its sealed days changed since"""
+    if entry.sealed_through is None:
+        return False
+    if entry.generated_at < timezone.now() - timedelta(seconds=settings.HEATMAP_CACHE_TTL):
+        return False
+    return not tiles.filter(
+        day__gte=entry.date_range_start,
+        day__lte=entry.sealed_through,
+        updated_at__gt=entry.generated_at
+    ).exists()
+
+
+def _sum_days(tiles, first_day, last_day):
+    if first_day > last_day:
+        return Counter(), 0, 0
+    return tile_counts(tiles.filter(day__gte=first_day, day__lte=last_day))
+
+
+def cached_tile_counts(site, page_url, heatmap_type, event_type, device_type, start_day, end_day,
+                       match='contains'):
+    """
+    Tile counts for a heatmap, served from HeatmapData when possible.
+    page_url is a pattern resolved with events.pages.match_pages.
+    Returns (counts, event_count, session_count, cache_status).
+    """
+    today = timezone.localdate()
+    sealed_end = min(end_day, today - timedelta(days=1))
+
+    tiles = HeatmapTile.objects.filter(
+        site=site,
+        page__in=match_pages(site, page_url, match),
+        event_type=event_type,
+        device_type=device_type
+    )
+    key = {
+        'site': site,
+        # Contains patterns keep the pre-existing keys
+        'page_url': page_url if match == 'contains' else f"{match}:{page_url}",
+        'heatmap_type': heatmap_type,
+        'device_type': device_type,
+    }
+
+    entry = HeatmapData.objects.filter(
+        **key, date_range_start=start_day, date_range_end=end_day
+    ).first()
+
+    if entry is not None and entry.sealed_through == sealed_end and _is_valid(entry, tiles):
+        status = 'hit'
+        counts = _counts_from_points(entry.data)
+        event_count, session_count = entry.event_count, entry.session_count
+    else:
+        status = 'stale' if entry is not None else 'miss'
+
+        # Reuse the most recent valid entry whose sealed range overlaps ours
+        base = None
+        candidates = HeatmapData.objects.filter(
+            **key,
+            date_range_start__lte=start_day,
+            sealed_through__gte=start_day - timedelta(days=1),
+            sealed_through__lte=sealed_end
+        ).order_by('-sealed_through', '-date_range_start')[:3]
+        for candidate in candidates:
+            if _is_valid(candidate, tiles):
+                base = candidate
+                break
+
+        if base is not None:
+            status = 'incremental'
+            counts = _counts_from_points(base.data)
+            event_count, session_count = base.event_count, base.session_count
+
+            dropped = _sum_days(tiles, base.date_range_start, start_day - timedelta(days=1))
+            added = _sum_days(tiles, base.sealed_through + timedelta(days=1), sealed_end)
+            counts.subtract(dropped[0])
+            counts.update(added[0])
+            event_count += added[1] - dropped[1]
+            session_count += added[2] - dropped[2]
+
+            # A window that slid forward is superseded by the new entry
+            if base.date_range_end < end_day:
+                base.delete()
+        else:
+            counts, event_count, session_count = _sum_days(tiles, start_day, sealed_end)
+
+        HeatmapData.objects.update_or_create(
+            **key,
+            date_range_start=start_day,
+            date_range_end=end_day,
+            defaults={
+                'data': _points_from_counts(counts),
+                'event_count': event_count,
+                'session_count': session_count,
+                'sealed_through': sealed_end,
+            }
+        )
+        counts = Counter({cell: value for cell, value in counts.items() if value > 0})
+
+    _record(status)
+
+    # Live tail: days that are still receiving events
+    live_counts, live_events, live_sessions = _sum_days(
+        tiles, max(start_day, sealed_end + timedelta(days=1)), end_day
+    )
+    counts.update(live_counts)
+    return counts, event_count + live_events, session_count + live_sessions, status
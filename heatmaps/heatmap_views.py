@@ -1,12 +1,28 @@
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
+from django.conf import settings
 from django.db.models import Count
-from events.models import Event
-from heatmaps.models import HeatmapData
+from events.models import Event, Page
+from events.pages import MATCH_MODES, match_pages
+from heatmaps.models import HeatmapData, HeatmapTile
+from heatmaps.aggregation import (
+    HEATMAP_EVENT_TYPES, python_counts, numpy_counts, sql_counts, tile_counts, build_points, bin_coordinates,
+    breakpoint_counts, element_counts, width_class
+)
+from analytics.columnar import archive_available, scan_events
+from heatmaps.cache import cached_tile_counts, cache_stats
+from heatmaps.scroll import scroll_depth_report
+from heatmaps.tiles import TILE_RESOLUTION, get_tile_buffer
 from sites.models import Site
 from datetime import datetime, timedelta
 
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, source=columnar needs it
+    np = None
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_heatmap_data(request, site_id):
@@ -20,94 +36,143 @@ def get_heatmap_data(request, site_id):
     
     # Get query parameters
     page_url = request.GET.get('page_url', '/')
+    match = request.GET.get('match', 'contains')  # contains, exact, prefix, glob
     heatmap_type = request.GET.get('type', 'click')  # click, scroll, move
     device_type = request.GET.get('device', 'desktop')
     days = int(request.GET.get('days', 7))
+    source = request.GET.get('source', 'tiles')  # tiles, columnar, sql, numpy, events
+    use_cache = request.GET.get('cache', '1') != '0'
+    resolution = request.GET.get('resolution')
+    group = request.GET.get('group')  # breakpoint: every page width class from one scan
+    breakpoint_name = request.GET.get('breakpoint')  # Class shown in 'data' with group=breakpoint
     
     end_date = datetime.now()
     start_date = end_date - timedelta(days=days)
     
     # Map heatmap type to event type
-    event_type_map = {
-        'click': 'click',
-        'scroll': 'scroll',
-        'move': 'mouse_move'
-    }
-    event_type = event_type_map.get(heatmap_type, 'click')
+    event_type = HEATMAP_EVENT_TYPES.get(heatmap_type, 'click')
     
-    # Fetch events
-    events = Event.objects.filter(
-        session__site=site,
-        page_url__icontains=page_url,
-        event_type=event_type,
-        timestamp__gte=start_date,
-        timestamp__lte=end_date,
-        session__device_type=device_type
-    )
+    try:
+        resolution = int(resolution) if resolution else TILE_RESOLUTION[event_type]
+    except ValueError:
+        return Response({'error': 'resolution must be an integer'}, status=400)
+    if resolution < 1:
+        return Response({'error': 'resolution must be positive'}, status=400)
+    if match not in MATCH_MODES:
+        return Response({'error': f"match must be one of {', '.join(MATCH_MODES)}"}, status=400)
+    pages = match_pages(site, page_url, match)
     
-    # Aggregate coordinates
-    heatmap_points = []
-    max_value = 0
+    # Tiles are stored at a fixed resolution, other grids are binned from events
+    if source == 'tiles' and resolution != TILE_RESOLUTION[event_type]:
+        source = 'columnar'
+    if source == 'columnar' and not archive_available():
+        source = 'numpy'
     
-    if event_type in ['click', 'mouse_move']:
-        # For click and move events, aggregate by coordinates
-        coordinate_counts = {}
-        
-        for event in events:
-            if 'x' in event.data and 'y' in event.data:
-                x = int(event.data['x'])
-                y = int(event.data['y'])
-                
-                # Round to nearest 10 pixels for better aggregation
-                x = round(x / 10) * 10
-                y = round(y / 10) * 10
-                
-                key = f"{x},{y}"
-                coordinate_counts[key] = coordinate_counts.get(key, 0) + 1
-                max_value = max(max_value, coordinate_counts[key])
-        
-        # Convert to heatmap format
-        for key, count in coordinate_counts.items():
-            x, y = map(int, key.split(','))
-            heatmap_points.append({
-                'x': x,
-                'y': y,
-                'value': count
+    cache_status = None
+    breakpoints = None
+    if group == 'breakpoint':
+        # All devices in one GROUP BY on document coordinates, bucketed by
+        # page width class. The breakpoint parameter picks the class in
+        # 'data', by default the widest class that has events.
+        source = 'sql'
+        events = Event.objects.filter(
+            session__site=site,
+            page__in=pages,
+            event_type=event_type,
+            timestamp__gte=start_date,
+            timestamp__lte=end_date
+        )
+        per_class = breakpoint_counts(events, event_type, resolution)
+        class_sessions = dict(
+            events.annotate(width_class=width_class()).order_by().values('width_class').annotate(
+                sessions=Count('session', distinct=True)
+            ).values_list('width_class', 'sessions')
+        )
+        breakpoints = []
+        for name, min_width in settings.HEATMAP_BREAKPOINTS:
+            class_points, class_max = build_points(event_type, per_class.get(name, {}))
+            breakpoints.append({
+                'name': name,
+                'min_width': min_width,
+                'data': class_points,
+                'max': class_max,
+                'total_events': sum(per_class.get(name, {}).values()),
+                'session_count': class_sessions.get(name, 0),
             })
+        names = [name for name, _ in settings.HEATMAP_BREAKPOINTS]
+        if breakpoint_name is None:
+            breakpoint_name = next((name for name in reversed(names) if per_class.get(name)), names[-1])
+        elif breakpoint_name not in names:
+            return Response({'error': f"breakpoint must be one of {', '.join(names)}"}, status=400)
+        counts = per_class.get(breakpoint_name, {})
+        total_events = sum(counts.values())
+        session_count = class_sessions.get(breakpoint_name, 0)
+    elif source == 'columnar':
+        # Coordinate columns of archived days plus the live tail from the database
+        scanned = scan_events(
+            site.id, start_date, end_date,
+            event_types=[event_type],
+            page_ids=pages.values_list('id', flat=True),
+            device_type=device_type,
+            columns=('session_id', 'x', 'y')
+        )
+        xs = np.zeros_like(scanned['y']) if event_type == 'scroll' else scanned['x']
+        counts = bin_coordinates(xs, scanned['y'], resolution)
+        session_count = len(set(scanned['session_id'].tolist()))
+        total_events = len(scanned)
+    elif source in ('sql', 'numpy', 'events'):
+        # Bin raw events: GROUP BY in the database, vectorized over the
+        # coordinate columns, or the original per-event loop (kept for
+        # verification and debugging)
+        events = Event.objects.filter(
+            session__site=site,
+            page__in=pages,
+            event_type=event_type,
+            timestamp__gte=start_date,
+            timestamp__lte=end_date,
+            session__device_type=device_type
+        )
+        if source == 'sql':
+            counts = sql_counts(events, event_type, resolution)
+        elif source == 'numpy':
+            counts = numpy_counts(events, event_type, resolution)
+        else:
+            counts = python_counts(events, event_type, resolution)
+        session_count = events.values('session').distinct().count()
+        total_events = events.count()
+    elif use_cache:
+        # Cached sum of sealed days plus today's live tiles
+        counts, total_events, session_count, cache_status = cached_tile_counts(
+            site, page_url, heatmap_type, event_type, device_type,
+            start_date.date(), end_date.date(), match
+        )
+    else:
+        # Sum the pre-aggregated daily tiles
+        tiles = HeatmapTile.objects.filter(
+            site=site,
+            page__in=pages,
+            event_type=event_type,
+            device_type=device_type,
+            day__gte=start_date.date(),
+            day__lte=end_date.date()
+        )
+        counts, total_events, session_count = tile_counts(tiles)
     
-    elif event_type == 'scroll':
-        # For scroll events, create scroll depth heatmap
-        scroll_depths = {}
-        
-        for event in events:
-            if 'y' in event.data:
-                y = int(event.data['y'])
-                # Round to nearest 50 pixels
-                y = round(y / 50) * 50
-                scroll_depths[y] = scroll_depths.get(y, 0) + 1
-                max_value = max(max_value, scroll_depths[y])
-        
-        # Convert to heatmap format (full width bars)
-        for y, count in scroll_depths.items():
-            heatmap_points.append({
-                'x': 0,
-                'y': y,
-                'value': count,
-                'width': 1920  # Full width indicator
-            })
+    heatmap_points, max_value = build_points(event_type, counts)
     
-    # Get session count
-    session_count = events.values('session').distinct().count()
+    # Scroll maps also get per-session depth: histogram and reach curve.
+    # Breakpoint groups have no device type to filter on.
+    scroll_depth = None
+    if event_type == 'scroll' and group != 'breakpoint':
+        scroll_depth = scroll_depth_report(site, pages, device_type, start_date.date(), end_date.date())
     
     # Get available pages for this site
-    available_pages = Event.objects.filter(
-        session__site=site,
-        event_type='page_view'
-    ).values_list('page_url', flat=True).distinct()[:20]
+    available_pages = Page.objects.filter(site=site).order_by('url').values_list('url', flat=True)[:20]
     
     return Response({
         'site_id': site_id,
         'page_url': page_url,
+        'match': match,
         'heatmap_type': heatmap_type,
         'device_type': device_type,
         'date_range': {
@@ -118,11 +183,51 @@ def get_heatmap_data(request, site_id):
         'data': heatmap_points,
         'max': max_value,
         'session_count': session_count,
-        'total_events': events.count(),
+        'total_events': total_events,
+        'source': source,
+        'resolution': resolution,
+        'cache': cache_status,
+        'breakpoint': breakpoint_name if breakpoints is not None else None,
+        'breakpoints': breakpoints,
+        'scroll_depth': scroll_depth,
         'available_pages': list(available_pages)
     })
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_element_clicks(request, site_id):
+    """
+    Most clicked elements of a page with the average click position inside
+    each element, comparable across screen sizes
+    """
+    try:
+        site = Site.objects.get(id=site_id, owner=request.user)
+    except Site.DoesNotExist:
+        return Response({'error': 'Site not found'}, status=404)
+
+    page_url = request.GET.get('page_url', '/')
+    match = request.GET.get('match', 'contains')
+    days = int(request.GET.get('days', 7))
+    if match not in MATCH_MODES:
+        return Response({'error': f"match must be one of {', '.join(MATCH_MODES)}"}, status=400)
+
+    start_date = datetime.now() - timedelta(days=days)
+    events = Event.objects.filter(
+        session__site=site,
+        page__in=match_pages(site, page_url, match),
+        event_type='click',
+        timestamp__gte=start_date
+    )
+    return Response({
+        'site_id': site_id,
+        'page_url': page_url,
+        'match': match,
+        'days': days,
+        'elements': element_counts(events)
+    })
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_page_screenshot(request, site_id):
@@ -138,3 +243,13 @@ def get_page_screenshot(request, site_id):
         'height': 1080,
         'message': 'Screenshot generation not implemented. Heatmap will overlay on live page.'
     })
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_heatmap_cache_stats(request):
+    """
+    Hit/miss counters and size of the heatmap read-through cache, and the
+    state of the ingest tile buffer
+    """
+    return Response({**cache_stats(), 'tile_buffer': get_tile_buffer().stats()})
@@ -0,0 +1,33 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from heatmaps.tiles import rebuild_heatmap_tiles
+
+
+class Command(BaseCommand):
+    help = 'Build heatmap tiles from existing Event rows, replacing tiles for the covered days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Rebuild the last N days (default 30)')
+        parser.add_argument('--start', help='First day to rebuild (YYYY-MM-DD), overrides --days')
+        parser.add_argument('--end', help='Last day to rebuild (YYYY-MM-DD), defaults to today')
+        parser.add_argument('--site', type=int, help='Only rebuild tiles for this site id')
+
+    def handle(self, *args, **options):
+        try:
+            end = date.fromisoformat(options['end']) if options['end'] else timezone.localdate()
+            start = date.fromisoformat(options['start']) if options['start'] else end - timedelta(days=options['days'])
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        if start > end:
+            raise CommandError('--start must not be after --end')
+
+        day = start
+        total = 0
+        while day <= end:
+            written = rebuild_heatmap_tiles(day, site_id=options['site'])
+            total += written
+            self.stdout.write(f"{day}: {written} tiles")
+            day += timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} tiles from {start} to {end}"))
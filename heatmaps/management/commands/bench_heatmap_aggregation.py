@@ -0,0 +1,85 @@
+import random
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from events.models import Session, Event
+from events.typed_fields import typed_event_fields
+from heatmaps.aggregation import np, bin_coordinates, python_counts, numpy_counts
+from heatmaps.tiles import tile_cell
+from sites.models import Site
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark the per-event heatmap loop against the NumPy engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=200_000, help='Click events stored for the end-to-end run')
+        parser.add_argument('--points', type=int, default=2_000_000, help='Points for the in-memory binning run')
+        parser.add_argument('--resolution', type=int, default=10)
+
+    def handle(self, *args, **options):
+        if np is None:
+            self.stderr.write('numpy is not installed, nothing to compare')
+            return
+
+        resolution = options['resolution']
+        rng = random.Random(7)
+
+        # In-memory binning only, no database involved
+        n = options['points']
+        xs = [rng.randint(0, 1920) for _ in range(n)]
+        ys = [int(rng.expovariate(1 / 900)) for _ in range(n)]
+        rows = [{'x': x, 'y': y} for x, y in zip(xs, ys)]
+
+        start = time.perf_counter()
+        loop = {}
+        for data in rows:
+            cell = tile_cell('click', data, resolution)
+            loop[cell] = loop.get(cell, 0) + 1
+        loop_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        binned = bin_coordinates(xs, ys, resolution)
+        numpy_seconds = time.perf_counter() - start
+
+        assert binned == loop, 'NumPy binning disagrees with the Python loop'
+        self.stdout.write(
+            f"binning {n} points: loop {loop_seconds:.2f}s, numpy {numpy_seconds:.3f}s "
+            f"({loop_seconds / numpy_seconds:.0f}x)"
+        )
+
+        # End to end against the database, rolled back afterwards
+        with transaction.atomic():
+            owner = User.objects.create(username=f'bench-{time.time_ns()}')
+            site = Site.objects.create(owner=owner, name='bench', domain=f'bench-{time.time_ns()}.local')
+            session = Session.objects.create(
+                site=site, device_type='desktop', browser='bench', os='bench',
+                viewport={'width': 1920, 'height': 1080}
+            )
+            now = timezone.now()
+            rows = [{'x': xs[i], 'y': ys[i], 'target': 'DIV'} for i in range(options['events'])]
+            # Typed columns filled as at ingest, the NumPy engine reads only those
+            Event.objects.bulk_create([
+                Event(session=session, event_type='click', timestamp=now, page_url='https://example.com/',
+                      data=data, **typed_event_fields('click', data, session.viewport))
+                for data in rows
+            ], batch_size=5000)
+            events = Event.objects.filter(session=session, event_type='click')
+
+            start = time.perf_counter()
+            loop = python_counts(events, 'click', resolution)
+            loop_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            binned = numpy_counts(events, 'click', resolution)
+            numpy_seconds = time.perf_counter() - start
+
+            assert binned == loop, 'NumPy engine disagrees with the Python loop'
+            self.stdout.write(
+                f"end to end {options['events']} events: loop {loop_seconds:.2f}s, "
+                f"numpy {numpy_seconds:.2f}s ({loop_seconds / numpy_seconds:.1f}x)"
+            )
+
+            transaction.set_rollback(True)
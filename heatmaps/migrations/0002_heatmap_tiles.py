@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0002_site_is_connected_site_last_activity_at'),
+        ('heatmaps', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeatmapTile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_url', models.TextField()),
+                ('device_type', models.CharField(max_length=50)),
+                ('event_type', models.CharField(max_length=50)),
+                ('day', models.DateField()),
+                ('resolution', models.IntegerField()),
+                ('counts', models.JSONField(default=dict)),
+                ('event_count', models.IntegerField(default=0)),
+                ('session_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.site')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['site', 'event_type', 'device_type', 'day'], name='heatmaps_he_site_id_9b0627_idx')],
+                'unique_together': {('site', 'page_url', 'device_type', 'event_type', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heatmaps', '0002_heatmap_tiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='heatmapdata',
+            name='event_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='heatmapdata',
+            name='sealed_through',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
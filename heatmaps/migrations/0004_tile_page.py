@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0003_event_pages'),
+        ('sites', '0002_site_is_connected_site_last_activity_at'),
+        ('heatmaps', '0003_heatmapdata_cache_fields'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='heatmaptile',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='heatmaptile',
+            name='page',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='events.page'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='heatmaptile',
+            unique_together={('site', 'page', 'device_type', 'event_type', 'day')},
+        ),
+    ]
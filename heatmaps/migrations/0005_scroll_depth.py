@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0008_backfill_document_coordinates'),
+        ('sites', '0002_site_is_connected_site_last_activity_at'),
+        ('heatmaps', '0004_tile_page'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScrollDepthDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='sites.site')),
+            ],
+            options={
+                'unique_together': {('site', 'day')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ScrollDepth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_type', models.CharField(max_length=50)),
+                ('histogram', models.JSONField(default=list)),
+                ('sessions', models.IntegerField(default=0)),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='events.page')),
+                ('rollup', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='heatmaps.scrolldepthday')),
+            ],
+            options={
+                'unique_together': {('rollup', 'page', 'device_type')},
+            },
+        ),
+    ]
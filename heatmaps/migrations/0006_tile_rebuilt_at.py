@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heatmaps', '0005_scroll_depth'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='heatmaptile',
+            name='rebuilt_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
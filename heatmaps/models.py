@@ -12,6 +12,10 @@ class HeatmapData(models.Model):
     session_count = models.IntegerField()
     generated_at = models.DateTimeField(auto_now=True)
 
+    # Read-through cache bookkeeping (see heatmaps.cache)
+    event_count = models.IntegerField(default=0)
+    sealed_through = models.DateField(null=True, blank=True)  # Last day included in `data`
+
     class Meta:
         unique_together = [
             'site', 'page_url', 'heatmap_type', 
@@ -20,3 +24,65 @@ class HeatmapData(models.Model):
 
     def __str__(self):
         return f"{self.heatmap_type} Heatmap for {self.page_url}"
+
+
+class HeatmapTile(models.Model):
+    """
+    Daily pre-aggregated grid of event counts for one page, device and event
+    type. Updated as events are ingested so heatmap reads only sum tiles.
+    """
+    site = models.ForeignKey(Site, on_delete=models.CASCADE)
+    page = models.ForeignKey('events.Page', on_delete=models.CASCADE, null=True)
+    page_url = models.TextField()  # Canonical URL of page
+    device_type = models.CharField(max_length=50)
+    event_type = models.CharField(max_length=50)  # click, mouse_move, scroll
+    day = models.DateField()
+    resolution = models.IntegerField()  # Grid cell size in pixels
+    counts = models.JSONField(default=dict)  # {"x,y": count} keyed by cell origin
+    event_count = models.IntegerField(default=0)
+    session_count = models.IntegerField(default=0)
+    rebuilt_at = models.DateTimeField(null=True)  # Start of the rebuild that wrote it, see heatmaps.tiles
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['site', 'page', 'device_type', 'event_type', 'day']
+        indexes = [
+            models.Index(fields=['site', 'event_type', 'device_type', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} tile for {self.page_url} on {self.day}"
+
+
+class ScrollDepthDay(models.Model):
+    """
+    Marks a site's day as rolled up into ScrollDepth rows, so days without
+    any scrolling are not recomputed on every read (heatmaps.scroll)
+    """
+    site = models.ForeignKey(Site, on_delete=models.CASCADE)
+    day = models.DateField()
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['site', 'day']
+
+    def __str__(self):
+        return f"Scroll depth rollup for {self.site} on {self.day}"
+
+
+class ScrollDepth(models.Model):
+    """
+    Histogram of the deepest scroll each session reached on one page and
+    device during one day, at 1% resolution
+    """
+    rollup = models.ForeignKey(ScrollDepthDay, on_delete=models.CASCADE, related_name='pages')
+    page = models.ForeignKey('events.Page', on_delete=models.CASCADE)
+    device_type = models.CharField(max_length=50)
+    histogram = models.JSONField(default=list)  # 101 session counts, index = max depth in percent
+    sessions = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['rollup', 'page', 'device_type']
+
+    def __str__(self):
+        return f"Scroll depth of {self.page} ({self.device_type})"
@@ -12,6 +12,8 @@ RRWEB_TRACKING_SCRIPT = """
     
     const BATCH_INTERVAL = 5000;
     const API_BASE = 'http://localhost:8000/api/track';
+    const COMPRESS_MIN_BYTES = 1024;
+    const KEEPALIVE_MAX_BYTES = 60000; // Browsers cap keepalive bodies at 64KB
     
     class HotjarClone {
         constructor(siteId, config = {}) {
@@ -115,14 +117,15 @@ RRWEB_TRACKING_SCRIPT = """
             const events = this.rrwebEvents.splice(0);
             
             try {
+                const { body, headers } = await this.encodeBody({
+                    session_id: this.sessionId,
+                    events: events
+                });
                 await fetch(`${API_BASE}/recording-events/`, {
                     method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({
-                        session_id: this.sessionId,
-                        events: events
-                    }),
-                    keepalive: true
+                    headers: headers,
+                    body: body,
+                    keepalive: body.byteLength <= KEEPALIVE_MAX_BYTES
                 });
             } catch (err) {
                 console.error('Failed to send recording data:', err);
@@ -131,6 +134,21 @@ RRWEB_TRACKING_SCRIPT = """
             }
         }
 
+        async encodeBody(payload) {
+            // gzip large payloads when the browser supports CompressionStream.
+            // Encoded up front so sizes are bytes, not UTF-16 code units
+            const json = new TextEncoder().encode(JSON.stringify(payload));
+            if (!window.CompressionStream || json.byteLength < COMPRESS_MIN_BYTES) {
+                return { body: json, headers: { 'Content-Type': 'application/json' } };
+            }
+            const stream = new Blob([json]).stream().pipeThrough(new CompressionStream('gzip'));
+            const body = await new Response(stream).arrayBuffer();
+            return {
+                body: body,
+                headers: { 'Content-Type': 'application/json', 'Content-Encoding': 'gzip' }
+            };
+        }
+
         async setupSurveys() {
             try {
                 const response = await fetch(`http://localhost:8000/api/surveys/active/${this.siteId}/?page_url=${encodeURIComponent(window.location.pathname)}`);
@@ -0,0 +1,177 @@
+"""
+Scroll depth engine
+
+Scroll maps count sessions, not scroll events. Each session that viewed a
+page is reduced to the deepest point it reached there (Event.scroll_depth,
+the percentage the tracker sends), or 0 when it never scrolled. One
+aggregated query finds the maxima and another the page view sessions.
+Those depths form a histogram at 1% resolution, and the reach curve gives,
+for every depth N, the percentage of sessions that scrolled at least N%
+down the page.
+
+Closed days are stored as ScrollDepth histograms per page, device and day,
+written by the compact_scroll_depth task, which the task workers run every
+SCROLL_DEPTH_COMPACT_EVERY seconds over the last closed days so late events
+are counted. Missing days found on read are built together with the same
+two queries grouped by day, whatever the range. Today is always computed live. Summing days counts a session that
+spans midnight once per day, like heatmap tiles.
+"""
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from events.models import Event
+from heatmaps.models import ScrollDepth, ScrollDepthDay
+
+DEPTH_BUCKETS = 101  # 0..100 percent
+
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def depth_bucket(depth):
+    return min(max(int(depth), 0), DEPTH_BUCKETS - 1)
+
+
+def session_depths(events):
+    """
+    {(day, page_id, device_type, session_id): max_depth} for every session
+    that viewed or scrolled a page, 0 for sessions that never scrolled
+    """
+    events = events.filter(page__isnull=False).annotate(day=TruncDate('timestamp')).order_by()
+    depths = dict(
+        ((day, page_id, device_type, session_id), depth)
+        for day, page_id, device_type, session_id, depth in events.filter(
+            event_type='scroll', scroll_depth__isnull=False
+        ).values('day', 'page', 'session__device_type', 'session').annotate(
+            depth=Max('scroll_depth')
+        ).values_list('day', 'page', 'session__device_type', 'session', 'depth')
+    )
+    viewed = events.filter(event_type='page_view').values_list(
+        'day', 'page', 'session__device_type', 'session'
+    ).distinct()
+    for key in viewed:
+        depths.setdefault(key, 0)
+    return depths
+
+
+def build_histograms(depths):
+    """{(day, page_id, device_type): histogram} from session_depths"""
+    histograms = {}
+    for (day, page_id, device_type, _), depth in depths.items():
+        histogram = histograms.setdefault((day, page_id, device_type), [0] * DEPTH_BUCKETS)
+        histogram[depth_bucket(depth)] += 1
+    return histograms
+
+
+def rebuild_scroll_depth(site_id, first_day, last_day=None):
+    """
+    Store the histograms of closed days first_day to last_day inclusive,
+    computed in one pass. Returns the number of rows written.
+    """
+    last_day = last_day or first_day
+    start, _ = _day_bounds(first_day)
+    _, end = _day_bounds(last_day)
+    events = Event.objects.filter(session__site_id=site_id, timestamp__gte=start, timestamp__lt=end)
+    histograms = build_histograms(session_depths(events))
+
+    days = [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+    with transaction.atomic():
+        ScrollDepthDay.objects.filter(site_id=site_id, day__gte=first_day, day__lte=last_day).delete()
+        rollups = {
+            rollup.day: rollup
+            for rollup in ScrollDepthDay.objects.bulk_create([
+                ScrollDepthDay(site_id=site_id, day=day) for day in days
+            ])
+        }
+        if not all(rollup.pk for rollup in rollups.values()):
+            # Backends that do not return ids from bulk inserts
+            rollups = {
+                rollup.day: rollup
+                for rollup in ScrollDepthDay.objects.filter(site_id=site_id, day__gte=first_day, day__lte=last_day)
+            }
+        ScrollDepth.objects.bulk_create([
+            ScrollDepth(
+                rollup=rollups[day],
+                page_id=page_id,
+                device_type=device_type,
+                histogram=histogram,
+                sessions=sum(histogram)
+            )
+            for (day, page_id, device_type), histogram in histograms.items()
+        ], batch_size=500)
+    return len(histograms)
+
+
+def scroll_depth_histogram(site, pages, device_type, start_day, end_day):
+    """
+    Summed session depth histogram of pages (ids or a Page queryset) for
+    one device from start_day to end_day inclusive
+    """
+    today = timezone.localdate()
+    start_day = max(start_day, timezone.localdate(site.created_at))
+    closed_end = min(end_day, today - timedelta(days=1))
+    histogram = [0] * DEPTH_BUCKETS
+
+    if start_day <= closed_end:
+        done = set(ScrollDepthDay.objects.filter(
+            site=site, day__gte=start_day, day__lte=closed_end
+        ).values_list('day', flat=True))
+        missing = [
+            day for day in (start_day + timedelta(days=offset) for offset in range((closed_end - start_day).days + 1))
+            if day not in done
+        ]
+        if missing:
+            rebuild_scroll_depth(site.id, missing[0], missing[-1])
+
+        stored = ScrollDepth.objects.filter(
+            rollup__site=site,
+            rollup__day__gte=start_day,
+            rollup__day__lte=closed_end,
+            page__in=pages,
+            device_type=device_type
+        ).values_list('histogram', flat=True)
+        for day_histogram in stored:
+            for depth, count in enumerate(day_histogram[:DEPTH_BUCKETS]):
+                histogram[depth] += count
+
+    if end_day >= today:
+        start, end = _day_bounds(today)
+        events = Event.objects.filter(
+            session__site=site,
+            session__device_type=device_type,
+            page__in=pages,
+            timestamp__gte=start,
+            timestamp__lt=end
+        )
+        for day_histogram in build_histograms(session_depths(events)).values():
+            for depth, count in enumerate(day_histogram):
+                histogram[depth] += count
+
+    return histogram
+
+
+def reach_curve(histogram):
+    """
+    Percentage of the page's sessions that reached at least each depth,
+    0..100; sessions that never scrolled only count towards depth 0
+    """
+    total = sum(histogram)
+    curve = []
+    reached = total
+    for count in histogram:
+        curve.append(round(100 * reached / total, 2) if total else 0)
+        reached -= count
+    return curve
+
+
+def scroll_depth_report(site, pages, device_type, start_day, end_day):
+    histogram = scroll_depth_histogram(site, pages, device_type, start_day, end_day)
+    return {
+        'sessions': sum(histogram),
+        'histogram': histogram,
+        'reach': reach_curve(histogram),
+    }
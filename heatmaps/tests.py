@@ -1,3 +1,275 @@
-from django.test import TestCase
+import gzip
+import unittest
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from events.ingest import ingest_event_batch
+from events.models import Event, Page, Session
+from analytics.models import Job
+from events.session_cache import get_session_cache
+from heatmaps import tiles
+from heatmaps.aggregation import sql_counts, width_class
+from heatmaps.models import HeatmapTile, ScrollDepth, ScrollDepthDay
+from heatmaps.scroll import scroll_depth_report
+from heatmaps.tracker import brotli
+from sites.models import Site
 
-# Create your tests here.
+
+class HeatmapTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='secret')
+        self.site = Site.objects.create(owner=self.user, name='Shop', domain='shop.example.com')
+        self.session = Session.objects.create(
+            site=self.site, device_type='desktop', browser='Chrome', os='Linux', viewport={}
+        )
+        get_session_cache().clear()
+
+    def event(self, event_type='click', page='/', session=None, **data):
+        return {
+            'session': (session or self.session).id,
+            'event_type': event_type,
+            'timestamp': timezone.now().isoformat(),
+            'page_url': f'https://shop.example.com{page}',
+            'data': data,
+        }
+
+
+class TileBufferTests(HeatmapTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.buffer = tiles.TileBuffer(interval=60)
+        patcher = mock.patch.object(tiles, '_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ingest(self, events):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_event_batch(events)
+
+    def test_batches_are_merged_until_flush(self):
+        self.ingest([self.event(x=12, y=20), self.event(x=14, y=22)])
+        other = Session.objects.create(site=self.site, device_type='desktop', browser='b', os='o', viewport={})
+        self.ingest([self.event(x=10, y=20, session=other), self.event(x=400, y=500)])
+        self.assertFalse(HeatmapTile.objects.exists())
+
+        self.assertEqual(self.buffer.flush(), 1)
+        tile = HeatmapTile.objects.get()
+        self.assertEqual(tile.counts, {'10,20': 3, '400,500': 1})
+        self.assertEqual(tile.event_count, 4)
+        self.assertEqual(tile.session_count, 2)
+
+    def test_flushed_tiles_match_a_rebuild(self):
+        self.ingest([self.event(x=12, y=20), self.event('scroll', y=130, percentage=10)])
+        self.ingest([self.event(x=33, y=47, page='/pricing'), self.event('scroll', y=160, percentage=12)])
+        self.buffer.flush()
+        flushed = sorted(HeatmapTile.objects.values_list('page_id', 'event_type', 'counts', 'event_count', 'session_count'))
+
+        tiles.rebuild_heatmap_tiles(timezone.localdate())
+        rebuilt = sorted(HeatmapTile.objects.values_list('page_id', 'event_type', 'counts', 'event_count', 'session_count'))
+        self.assertEqual(flushed, rebuilt)
+
+    @mock.patch.object(tiles, 'SLICE_SECONDS', 0)
+    def test_counts_buffered_before_a_rebuild_are_not_added_again(self):
+        self.ingest([self.event(x=12, y=20), self.event(x=14, y=22)])
+        # Another process holds counts for events the rebuild reads
+        buffered = self.buffer._pending
+        self.buffer._pending = {}
+        tiles.rebuild_heatmap_tiles(timezone.localdate())
+        self.buffer.add_back(list(buffered.items()))
+        self.ingest([self.event(x=400, y=500)])
+
+        self.buffer.flush()
+        tile = HeatmapTile.objects.get()
+        self.assertEqual(tile.counts, {'10,20': 2, '400,500': 1})
+        self.assertEqual(tile.event_count, 3)
+
+    def test_counts_are_buffered_only_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            ingest_event_batch([self.event(x=12, y=20)])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.buffer.stats()['pending'], 0)
+
+
+class ScrollDepthTests(HeatmapTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Site.objects.filter(id=self.site.id).update(created_at=timezone.now() - timedelta(days=60))
+        self.site.refresh_from_db()
+
+    def visit(self, days_ago=0, depths=()):
+        """A new session viewing / and scrolling to each depth"""
+        session = Session.objects.create(site=self.site, device_type='desktop', browser='b', os='o', viewport={})
+        timestamp = (timezone.now() - timedelta(days=days_ago)).isoformat()
+        events = [{**self.event('page_view', session=session), 'timestamp': timestamp}]
+        events += [
+            {**self.event('scroll', session=session, y=depth * 10, percentage=depth), 'timestamp': timestamp}
+            for depth in depths
+        ]
+        ingest_event_batch(events)
+
+    def report(self, days):
+        today = timezone.localdate()
+        return scroll_depth_report(self.site, Page.objects.filter(site=self.site), 'desktop', today - timedelta(days=days), today)
+
+    def test_sessions_that_never_scrolled_count_at_depth_zero(self):
+        self.visit(depths=(20, 80, 50))
+        self.visit(depths=(30,))
+        self.visit()
+        self.visit()
+        report = self.report(0)
+        self.assertEqual(report['sessions'], 4)
+        self.assertEqual(report['histogram'][0], 2)
+        self.assertEqual(report['histogram'][80], 1)
+        self.assertEqual(report['reach'][0], 100.0)
+        self.assertEqual(report['reach'][1], 50.0)
+        self.assertEqual(report['reach'][31], 25.0)
+        self.assertEqual(report['reach'][81], 0.0)
+
+    def test_stored_days_match_live_days(self):
+        for days_ago in (0, 3):
+            self.visit(days_ago, depths=(10, 60))
+            self.visit(days_ago)
+        report = self.report(5)
+        self.assertEqual(report['sessions'], 4)
+        self.assertEqual(report['histogram'][0], 2)
+        self.assertEqual(report['histogram'][60], 2)
+        self.assertEqual(ScrollDepth.objects.get().sessions, 2)
+
+    def test_missing_days_are_built_in_one_pass(self):
+        self.visit(1, depths=(40,))
+        self.visit(10, depths=(40,))
+        with CaptureQueriesContext(connection) as short:
+            self.report(2)
+        ScrollDepthDay.objects.all().delete()
+        with CaptureQueriesContext(connection) as long:
+            self.report(30)
+        self.assertEqual(len(short), len(long))
+        self.assertEqual(ScrollDepthDay.objects.count(), 30)
+        self.assertEqual(self.report(30)['histogram'][40], 2)
+
+
+class BreakpointHeatmapTests(HeatmapTestCase):
+
+    def test_breakpoint_defaults_to_the_widest_class_with_data(self):
+        Session.objects.filter(id=self.session.id).update(viewport={'width': 1000, 'height': 700})
+        ingest_event_batch([self.event(x=12, y=20, page_x=12, page_y=820), self.event(x=40, y=40, page_x=40, page_y=40)])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        path = f'/api/heatmaps/data/{self.site.id}/'
+
+        response = client.get(path, {'group': 'breakpoint'})
+        self.assertEqual(response.data['breakpoint'], 'tablet')
+        self.assertEqual(response.data['total_events'], 2)
+
+        response = client.get(path, {'group': 'breakpoint', 'breakpoint': 'desktop'})
+        self.assertEqual(response.data['total_events'], 0)
+        self.assertEqual(client.get(path, {'group': 'breakpoint', 'breakpoint': 'watch'}).status_code, 400)
+
+    @override_settings(HEATMAP_BREAKPOINTS=[('narrow', 0), ('wide', 900)])
+    def test_legacy_rows_without_width_are_classed_by_device(self):
+        phone = Session.objects.create(site=self.site, device_type='mobile', browser='b', os='o', viewport={})
+        kiosk = Session.objects.create(site=self.site, device_type='kiosk', browser='b', os='o', viewport={})
+        ingest_event_batch([self.event(x=1, y=1), self.event(x=1, y=1, session=phone), self.event(x=1, y=1, session=kiosk)])
+        self.assertFalse(Event.objects.filter(viewport_width__isnull=False).exists())
+        classes = dict(Event.objects.annotate(width_class=width_class()).values_list('session__device_type', 'width_class'))
+        self.assertEqual(classes, {'desktop': 'wide', 'mobile': 'narrow', 'kiosk': 'wide'})
+
+
+class SqlBucketTests(HeatmapTestCase):
+
+    VALUES = [0, 4, 5, 5.5, 6, 14.9, 15, 25, 35, 44.99, -0.5, -4, -5, -5.7, -6, -15, -25, -35, 1234.5, -999.5]
+
+    def test_sql_buckets_match_tile_cell(self):
+        ingest_event_batch([self.event(x=x, y=-y) for x, y in zip(self.VALUES, reversed(self.VALUES))])
+        events = Event.objects.filter(event_type='click')
+        for resolution in (1, 3, 10, 50):
+            expected = Counter(
+                tiles.tile_cell('click', data, resolution) for data in events.values_list('data', flat=True)
+            )
+            self.assertEqual(sql_counts(events, 'click', resolution), expected, f'resolution {resolution}')
+
+    def test_scroll_buckets_match_tile_cell(self):
+        ingest_event_batch([self.event('scroll', y=y, percentage=1) for y in self.VALUES])
+        events = Event.objects.filter(event_type='scroll')
+        expected = Counter(tiles.tile_cell('scroll', data, 50) for data in events.values_list('data', flat=True))
+        self.assertEqual(sql_counts(events, 'scroll', 50), expected)
+
+
+@override_settings(TASK_WORKER_IN_PROCESS=False)
+class HeatmapGenerationTests(HeatmapTestCase):
+
+    def post(self, **data):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.post(f'/api/heatmaps/generate/{self.site.id}/', data, format='json')
+
+    def test_invalid_requests_are_rejected_before_queueing(self):
+        for data in ({}, {'page_url': '/', 'days': 'week'}, {'page_url': '/', 'days': 0},
+                     {'page_url': '/', 'days': True}, {'page_url': '/', 'days': 1.5}):
+            self.assertEqual(self.post(**data).status_code, 400, data)
+        self.assertFalse(Job.objects.exists())
+
+    def test_valid_request_is_queued(self):
+        response = self.post(page_url='/pricing', days='7')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Job.objects.get().args, [self.site.id, '/pricing', 'click', 'desktop', 7])
+
+
+class TrackingScriptTests(HeatmapTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.url = f'/api/heatmaps/tracking-script/{self.site.id}/'
+
+    def get(self, **headers):
+        return self.client.get(self.url, **headers)
+
+    def test_identity_without_accept_encoding(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertIn(str(self.site.tracking_id), response.content.decode('utf-8'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertNotIn('Cookie', response['Vary'])
+
+    def test_gzip_is_negotiated(self):
+        identity = self.get().content
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), identity)
+        self.assertEqual(self.get(HTTP_ACCEPT_ENCODING='gzip;q=0').get('Content-Encoding'), None)
+
+    @unittest.skipIf(brotli is None, 'brotli is not installed')
+    def test_br_is_preferred(self):
+        identity = self.get().content
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), identity)
+
+    def test_etag_differs_per_encoding(self):
+        self.assertNotEqual(self.get()['ETag'], self.get(HTTP_ACCEPT_ENCODING='gzip')['ETag'])
+
+    def test_conditional_get_returns_304(self):
+        etag = self.get(HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        # Any encoding of the same script still matches, also weakened by a proxy
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=f'W/{etag}').status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_unknown_site_is_404(self):
+        self.assertEqual(self.client.get('/api/heatmaps/tracking-script/999999/').status_code, 404)
@@ -0,0 +1,313 @@
+"""
+Incremental heatmap tiles
+
+Every ingested click, mouse move and scroll event is bucketed into a daily
+HeatmapTile for its (site, page, device, event type, day), so reading a
+heatmap sums a few small tiles instead of scanning raw events.
+
+Ingest does not write tiles itself: once its transaction commits, the
+batch's cell counts are merged into a per-process buffer, and a background
+flusher writes each touched tile once every HEATMAP_TILE_FLUSH_INTERVAL
+seconds. Concurrent batches for a busy page no longer queue on the tile row
+lock, and the JSON counts are rewritten once per interval instead of once
+per batch. Tiles may lag ingest by up to the interval; counts buffered in a
+process that is killed are lost until the day is rebuilt with
+`manage.py backfill_heatmap_tiles`.
+
+A rebuild stamps the tiles it writes with rebuilt_at, the time it started
+reading events. Every process may still hold buffered counts of events the
+rebuild already read, so buffered counts keep their commit time, in slices
+of up to SLICE_SECONDS, and the flusher skips slices committed before the
+tile's rebuilt_at. Only a slice that straddles the rebuild start is applied
+whole, which can count the events of that one slice twice.
+"""
+import atexit
+import logging
+import threading
+from datetime import timedelta
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from events.models import Event
+from heatmaps.models import HeatmapTile
+
+logger = logging.getLogger(__name__)
+
+# Grid resolution in pixels per tiled event type
+TILE_RESOLUTION = {
+    'click': 10,
+    'mouse_move': 10,
+    'scroll': 50,
+}
+
+# Buffered counts merged into one slice per tile, see the module docstring
+SLICE_SECONDS = 1
+
+
+def tile_cell(event_type, data, resolution=None):
+    """
+    Return the (x, y) grid cell an event falls into, or None if the event
+    has no usable coordinates. Scroll events only carry a depth, so they are
+    bucketed on y with x fixed at 0.
+    """
+    resolution = resolution or TILE_RESOLUTION[event_type]
+    try:
+        if event_type == 'scroll':
+            return 0, round(int(data['y']) / resolution) * resolution
+        return (
+            round(int(data['x']) / resolution) * resolution,
+            round(int(data['y']) / resolution) * resolution,
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _group_events(rows):
+    """
+    Group (session_id, site_id, device_type, page_id, page_url, event_type,
+    data, timestamp) rows by tile key. page_url is the canonical URL.
+    """
+    groups = defaultdict(lambda: {'cells': Counter(), 'sessions': set(), 'events': 0, 'page_url': None})
+    for session_id, site_id, device_type, page_id, page_url, event_type, data, timestamp in rows:
+        if event_type not in TILE_RESOLUTION or not isinstance(data, dict) or page_id is None:
+            continue
+        cell = tile_cell(event_type, data)
+        if cell is None:
+            continue
+        day = timezone.localtime(timestamp).date()
+        group = groups[(site_id, page_id, device_type, event_type, day)]
+        group['page_url'] = page_url
+        group['cells'][cell] += 1
+        group['sessions'].add(session_id)
+        group['events'] += 1
+    return groups
+
+
+def _seen_sessions(key, session_ids):
+    """Sessions that already have stored events for this tile"""
+    site_id, page_id, device_type, event_type, day = key
+    return set(Event.objects.filter(
+        session_id__in=session_ids,
+        page_id=page_id,
+        event_type=event_type,
+        timestamp__date=day
+    ).values_list('session_id', flat=True).distinct())
+
+
+def _merge(target, delta):
+    target['cells'].update(delta['cells'])
+    target['sessions'] += delta['sessions']
+    target['events'] += delta['events']
+
+
+class TileBuffer:
+    """Tile deltas waiting to be written, merged across batches"""
+
+    def __init__(self, interval=None):
+        self.interval = interval if interval is not None else settings.HEATMAP_TILE_FLUSH_INTERVAL
+        # tile key -> slices of {'cells', 'sessions', 'events', 'page_url', 'first_at', 'last_at'}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = None
+        self.metrics = {'batches': 0, 'flushes': 0, 'tiles_written': 0}
+
+    def add(self, deltas, committed_at=None):
+        """
+        Merge {key: delta} of events committed at committed_at (now by
+        default) and flush now when no interval is configured
+        """
+        committed_at = committed_at or timezone.now()
+        with self._lock:
+            self.metrics['batches'] += 1
+            for key, delta in deltas.items():
+                slices = self._pending.setdefault(key, [])
+                if slices and committed_at - slices[-1]['first_at'] < timedelta(seconds=SLICE_SECONDS):
+                    _merge(slices[-1], delta)
+                    slices[-1]['last_at'] = committed_at
+                else:
+                    slices.append({
+                        'cells': Counter(delta['cells']), 'sessions': delta['sessions'], 'events': delta['events'],
+                        'page_url': delta['page_url'], 'first_at': committed_at, 'last_at': committed_at,
+                    })
+        if not self.interval:
+            try:
+                return self.flush()
+            except Exception:
+                # The events are committed, the failed tiles stay pending
+                logger.exception('Heatmap tile flush failed')
+                return 0
+        self.ensure_worker()
+        return 0
+
+    def flush(self):
+        """Write every pending tile, each in its own short transaction"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            for index, (key, slices) in enumerate(pending.items()):
+                try:
+                    _write_tile(key, slices)
+                except Exception:
+                    # Put back what was not written, the next flush retries it
+                    self.add_back(list(pending.items())[index:])
+                    raise
+            self.metrics['flushes'] += 1
+            self.metrics['tiles_written'] += len(pending)
+            return len(pending)
+
+    def add_back(self, items):
+        """Requeue unwritten slices ahead of those added since"""
+        with self._lock:
+            for key, slices in items:
+                self._pending[key] = slices + self._pending.get(key, [])
+
+    def ensure_worker(self):
+        """Start the background flusher thread if it is not already running"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name='heatmap-tile-flusher', daemon=True)
+            self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Heatmap tile flush failed')
+            finally:
+                close_old_connections()
+
+    def stats(self):
+        return {**self.metrics, 'pending': len(self._pending), 'interval_seconds': self.interval}
+
+
+def _write_tile(key, slices):
+    site_id, page_id, device_type, event_type, day = key
+    with transaction.atomic():
+        tile, created = HeatmapTile.objects.select_for_update().get_or_create(
+            site_id=site_id,
+            page_id=page_id,
+            device_type=device_type,
+            event_type=event_type,
+            day=day,
+            defaults={'resolution': TILE_RESOLUTION[event_type], 'page_url': slices[0]['page_url']}
+        )
+        counts = tile.counts
+        for delta in slices:
+            if tile.rebuilt_at is not None and delta['last_at'] < tile.rebuilt_at:
+                continue  # Committed before the rebuild, which already counted these events
+            for (x, y), count in delta['cells'].items():
+                cell_key = f"{x},{y}"
+                counts[cell_key] = counts.get(cell_key, 0) + count
+            tile.event_count += delta['events']
+            tile.session_count += delta['sessions']
+        tile.counts = counts
+        tile.save(update_fields=['counts', 'event_count', 'session_count', 'updated_at'])
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_tile_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = TileBuffer()
+                atexit.register(_flush_at_exit)
+    return _buffer
+
+
+def _flush_at_exit():
+    try:
+        _buffer.flush()
+    except Exception:
+        pass  # Database may already be gone
+
+
+def record_heatmap_tiles(cleaned, sessions):
+    """
+    Fold a batch of cleaned events (see events.ingest) into their tiles.
+    Events must already carry 'page_id' and 'canonical_url' (see
+    events.ingest.assign_pages). Must run inside the ingest transaction and
+    before the events are inserted, so that session counts only include new
+    sessions. The counts reach the tile buffer when the transaction commits.
+    """
+    groups = _group_events(
+        (e['session_id'], *sessions[e['session_id']], e['page_id'], e['canonical_url'],
+         e['event_type'], e['data'], e['timestamp'])
+        for e in cleaned
+    )
+
+    deltas = {}
+    for key, group in groups.items():
+        new_sessions = group['sessions'] - _seen_sessions(key, group['sessions'])
+        deltas[key] = {
+            'cells': group['cells'],
+            'sessions': len(new_sessions),
+            'events': group['events'],
+            'page_url': group['page_url'],
+        }
+    if deltas:
+        transaction.on_commit(lambda: get_tile_buffer().add(deltas))
+
+
+def flush_heatmap_tiles():
+    """Write buffered tile counts now; returns the number of tiles written"""
+    return get_tile_buffer().flush()
+
+
+def rebuild_heatmap_tiles(day, site_id=None):
+    """
+    Recompute all tiles for one day from raw events, replacing existing ones.
+    Events without a page (see backfill_event_pages) are skipped. Counts
+    still buffered in any process for events committed before the rebuild
+    started are dropped when flushed. Returns the number of tiles written.
+    """
+    rebuilt_at = timezone.now()
+    events = Event.objects.filter(
+        timestamp__date=day,
+        event_type__in=TILE_RESOLUTION.keys()
+    )
+    tiles = HeatmapTile.objects.filter(day=day)
+    if site_id is not None:
+        events = events.filter(session__site_id=site_id)
+        tiles = tiles.filter(site_id=site_id)
+
+    groups = _group_events(events.values_list(
+        'session_id', 'session__site_id', 'session__device_type',
+        'page_id', 'page__url', 'event_type', 'data', 'timestamp'
+    ).iterator(chunk_size=5000))
+
+    with transaction.atomic():
+        tiles.delete()
+        HeatmapTile.objects.bulk_create([
+            HeatmapTile(
+                site_id=key[0],
+                page_id=key[1],
+                page_url=group['page_url'],
+                device_type=key[2],
+                event_type=key[3],
+                day=key[4],
+                resolution=TILE_RESOLUTION[key[3]],
+                counts={f"{x},{y}": count for (x, y), count in group['cells'].items()},
+                event_count=group['events'],
+                session_count=len(group['sessions']),
+                rebuilt_at=rebuilt_at,
+            )
+            for key, group in groups.items()
+        ], batch_size=500)
+    return len(groups)
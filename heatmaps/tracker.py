@@ -0,0 +1,427 @@
+"""
+Tracking script delivery
+
+The tracker is the same for every site apart from the API base URL and the
+tracking id, so each (api_base, tracking_id) pair is built and minified once
+and kept in memory together with its gzip/brotli variants and a strong ETag.
+Site ids are mapped to tracking ids through the default cache;
+SiteViewSet invalidates that entry when a site changes or is deleted.
+
+Bump TRACKER_VERSION when TRACKER_SOURCE changes so browsers and CDNs
+holding an old copy get a new ETag.
+"""
+import gzip
+import hashlib
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.core.cache import cache
+from sites.models import Site
+
+try:
+    import brotli
+except ImportError:  # br variants are optional
+    brotli = None
+
+TRACKER_VERSION = 4
+KEY_PREFIX = 'tracking_script_site:'
+MISSING = ''  # Cached tracking id for unknown sites
+
+CompiledScript = namedtuple('CompiledScript', ['etag', 'identity', 'gzip', 'br'])
+
+TRACKER_SOURCE = r"""
+(function() {
+    'use strict';
+    const FLUSH_INTERVAL = 5000;          // Time-based flush
+    const MAX_BATCH_EVENTS = 50;          // Size-based flush
+    const MAX_BEACON_BYTES = 60000;       // sendBeacon payloads are capped at 64KB
+    const MOUSE_MOVE_THROTTLE = 100;
+    const MOUSE_MOVE_MIN_DISTANCE = 10;   // Pixels; smaller moves are coalesced
+    const MOUSE_TRAIL_MAX_AGE = 30000;    // A trail alone is only flushed after this long
+    const MAX_RETRY_BATCHES = 20;         // Bounded offline queue, oldest batches dropped
+    const RETRY_BASE_DELAY = 1000;
+    const RETRY_MAX_DELAY = 60000;
+    const API_BASE = '__API_BASE__';
+    const TRACKING_ID = '__TRACKING_ID__';
+    const encoder = new TextEncoder();
+
+    // Payload limits are in bytes; string length counts UTF-16 code units
+    function byteLength(text) {
+        return encoder.encode(text).length;
+    }
+
+    class HotjarClone {
+        constructor(trackingId) {
+            this.trackingId = trackingId;
+            this.sessionId = null;
+            this.eventQueue = [];
+            this.mouseTrail = [];
+            this.lastMouse = null;
+            this.retryQueue = [];
+            this.retryDelay = RETRY_BASE_DELAY;
+            this.retryTimer = null;
+            this.init();
+        }
+
+        async init() {
+            await this.createSession();
+            if (this.sessionId) {
+                this.setupEventListeners();
+                this.startBatchSender();
+            }
+        }
+
+        async createSession() {
+            try {
+                const response = await fetch(`${API_BASE}/sessions/`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({
+                        tracking_id: this.trackingId,
+                        device_type: /Mobile|Android|iPhone/i.test(navigator.userAgent) ? 'mobile' : 'desktop',
+                        browser: navigator.userAgent.substring(0, 100),
+                        os: navigator.platform.substring(0, 100),
+                        viewport: { width: window.innerWidth, height: window.innerHeight }
+                    })
+                });
+                if (response.ok) {
+                    const data = await response.json();
+                    this.sessionId = data.id;
+                    console.log('Tracking initialized');
+                }
+            } catch (e) {
+                console.error('Tracking init failed:', e);
+            }
+        }
+
+        setupEventListeners() {
+            document.addEventListener('click', (e) => this.trackClick(e));
+
+            let lastMouseMove = 0;
+            document.addEventListener('mousemove', (e) => {
+                const now = Date.now();
+                if (now - lastMouseMove > MOUSE_MOVE_THROTTLE) {
+                    this.trackMouseMove(e);
+                    lastMouseMove = now;
+                }
+            });
+
+            let scrollTimeout;
+            window.addEventListener('scroll', () => {
+                clearTimeout(scrollTimeout);
+                scrollTimeout = setTimeout(() => this.trackScroll(), 100);
+            });
+
+            // Hand whatever is left to the browser when the page goes away
+            document.addEventListener('visibilitychange', () => {
+                if (document.visibilityState === 'hidden') {
+                    this.flushWithBeacon();
+                }
+            });
+            window.addEventListener('pagehide', () => this.flushWithBeacon());
+            window.addEventListener('online', () => this.retryNow());
+        }
+
+        trackClick(event) {
+            const target = event.target;
+            const rect = target.getBoundingClientRect ? target.getBoundingClientRect() : null;
+            this.queueEvent({
+                event_type: 'click',
+                timestamp: new Date().toISOString(),
+                session: this.sessionId,
+                page_url: window.location.href,
+                data: {
+                    x: event.clientX,
+                    y: event.clientY,
+                    page_x: event.pageX,
+                    page_y: event.pageY,
+                    viewport: this.viewport(),
+                    target: target.tagName,
+                    id: target.id,
+                    classes: Array.from(target.classList || []),
+                    selector: this.selectorFor(target),
+                    // Position inside the clicked element, 0..1 on each axis
+                    offset_x: rect && rect.width ? (event.clientX - rect.left) / rect.width : null,
+                    offset_y: rect && rect.height ? (event.clientY - rect.top) / rect.height : null
+                }
+            });
+        }
+
+        viewport() {
+            return { width: window.innerWidth, height: window.innerHeight };
+        }
+
+        selectorFor(element) {
+            // Short path up to the nearest id, stable across screen sizes
+            const parts = [];
+            while (element && element.nodeType === 1 && parts.length < 5) {
+                let part = element.tagName.toLowerCase();
+                if (element.id) {
+                    parts.unshift(`${part}#${element.id}`);
+                    break;
+                }
+                const parent = element.parentElement;
+                if (parent) {
+                    const siblings = Array.from(parent.children).filter((child) => child.tagName === element.tagName);
+                    if (siblings.length > 1) {
+                        part += `:nth-of-type(${siblings.indexOf(element) + 1})`;
+                    }
+                }
+                parts.unshift(part);
+                element = parent;
+            }
+            return parts.join(' > ');
+        }
+
+        trackMouseMove(event) {
+            // Points close to the last recorded one add nothing to the trail
+            const last = this.lastMouse;
+            if (last && Math.abs(event.clientX - last.x) < MOUSE_MOVE_MIN_DISTANCE &&
+                Math.abs(event.clientY - last.y) < MOUSE_MOVE_MIN_DISTANCE) {
+                return;
+            }
+            this.lastMouse = { x: event.clientX, y: event.clientY };
+            this.mouseTrail.push({
+                event_type: 'mouse_move',
+                timestamp: new Date().toISOString(),
+                session: this.sessionId,
+                page_url: window.location.href,
+                data: {
+                    x: event.clientX,
+                    y: event.clientY,
+                    page_x: event.pageX,
+                    page_y: event.pageY,
+                    viewport: this.viewport()
+                },
+                queuedAt: Date.now()
+            });
+            if (this.pendingCount() >= MAX_BATCH_EVENTS) {
+                this.sendEvents();
+            }
+        }
+
+        trackScroll() {
+            const scrollPercentage = Math.round(
+                (window.scrollY / (document.body.scrollHeight - window.innerHeight)) * 100
+            );
+            this.queueEvent({
+                event_type: 'scroll',
+                timestamp: new Date().toISOString(),
+                session: this.sessionId,
+                page_url: window.location.href,
+                data: { y: window.scrollY, percentage: scrollPercentage, viewport: this.viewport() }
+            });
+        }
+
+        queueEvent(event) {
+            this.eventQueue.push(event);
+            if (this.pendingCount() >= MAX_BATCH_EVENTS) {
+                this.sendEvents();
+            }
+        }
+
+        pendingCount() {
+            return this.eventQueue.length + this.mouseTrail.length;
+        }
+
+        takePending() {
+            const trail = this.mouseTrail.splice(0).map(({ queuedAt, ...event }) => event);
+            return this.eventQueue.splice(0).concat(trail);
+        }
+
+        startBatchSender() {
+            setInterval(() => {
+                // Mouse trails alone do not justify a request until they get old
+                const trailDue = this.mouseTrail.length > 0 &&
+                    Date.now() - this.mouseTrail[0].queuedAt >= MOUSE_TRAIL_MAX_AGE;
+                if (this.eventQueue.length > 0 || trailDue) {
+                    this.sendEvents();
+                }
+            }, FLUSH_INTERVAL);
+        }
+
+        sendEvents() {
+            const events = this.takePending();
+            if (events.length > 0) {
+                this.postBatch(events);
+            }
+        }
+
+        postBatch(events) {
+            const body = JSON.stringify(events);
+            return fetch(`${API_BASE}/events/`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: body,
+                keepalive: byteLength(body) < MAX_BEACON_BYTES  // keepalive bodies share the beacon limit
+            }).then((response) => {
+                if (response.ok) {
+                    this.retryDelay = RETRY_BASE_DELAY;
+                    return;
+                }
+                // Throttled or server trouble: keep the batch; other 4xx will never succeed
+                if (response.status === 429 || response.status >= 500) {
+                    const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+                    this.queueRetry(events, retryAfter > 0 ? retryAfter * 1000 : null);
+                }
+            }).catch(() => this.queueRetry(events, null));
+        }
+
+        queueRetry(events, delay) {
+            this.retryQueue.push(events);
+            while (this.retryQueue.length > MAX_RETRY_BATCHES) {
+                this.retryQueue.shift();
+            }
+            if (this.retryTimer) {
+                return;
+            }
+            const wait = delay || this.retryDelay;
+            this.retryDelay = Math.min(this.retryDelay * 2, RETRY_MAX_DELAY);
+            this.retryTimer = setTimeout(() => this.retryNow(), wait + Math.random() * 1000);
+        }
+
+        retryNow() {
+            clearTimeout(this.retryTimer);
+            this.retryTimer = null;
+            const batches = this.retryQueue.splice(0);
+            if (batches.length > 0) {
+                this.postBatch([].concat(...batches));
+            }
+        }
+
+        flushWithBeacon() {
+            const events = [].concat(...this.retryQueue.splice(0), this.takePending());
+            if (events.length === 0) {
+                return;
+            }
+            if (!navigator.sendBeacon) {
+                this.postBatch(events);
+                return;
+            }
+            // text/plain keeps the beacon a simple cross-origin request; the API parses it as JSON
+            let chunk = [];
+            let size = 2;
+            const send = () => {
+                const body = new Blob([JSON.stringify(chunk)], { type: 'text/plain' });
+                if (!navigator.sendBeacon(`${API_BASE}/events/`, body)) {
+                    this.postBatch(chunk);
+                }
+                chunk = [];
+                size = 2;
+            };
+            for (const event of events) {
+                const eventSize = byteLength(JSON.stringify(event)) + 1;
+                if (chunk.length > 0 && size + eventSize > MAX_BEACON_BYTES) {
+                    send();
+                }
+                chunk.push(event);
+                size += eventSize;
+            }
+            send();
+        }
+    }
+
+    new HotjarClone(TRACKING_ID);
+})();
+"""
+
+
+def minify_js(source):
+    """
+    Conservative minification: drops indentation, blank lines and full-line
+    // comments. Line breaks are kept so automatic semicolon insertion is
+    unaffected.
+    """
+    lines = []
+    for line in source.splitlines():
+        line = line.strip()
+        if line and not line.startswith('//'):
+            lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def build_tracking_script(api_base, tracking_id):
+    source = TRACKER_SOURCE.replace('__API_BASE__', api_base).replace('__TRACKING_ID__', str(tracking_id))
+    return minify_js(source)
+
+
+def compile_tracking_script(api_base, tracking_id):
+    body = build_tracking_script(api_base, tracking_id).encode('utf-8')
+    digest = hashlib.sha1(f'{TRACKER_VERSION}:'.encode('utf-8') + body).hexdigest()[:20]
+    return CompiledScript(
+        etag=digest,
+        identity=body,
+        # mtime=0 keeps the gzip bytes stable across processes
+        gzip=gzip.compress(body, compresslevel=9, mtime=0),
+        br=brotli.compress(body) if brotli is not None else None,
+    )
+
+
+_compiled = OrderedDict()  # (api_base, tracking_id) -> CompiledScript
+_compiled_lock = threading.Lock()
+
+
+def get_compiled_script(api_base, tracking_id):
+    key = (api_base, str(tracking_id))
+    with _compiled_lock:
+        script = _compiled.get(key)
+        if script is not None:
+            _compiled.move_to_end(key)
+            return script
+    script = compile_tracking_script(api_base, tracking_id)
+    with _compiled_lock:
+        _compiled[key] = script
+        while len(_compiled) > settings.TRACKING_SCRIPT_CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return script
+
+
+def site_tracking_id(site_id):
+    """Tracking id of a site, or None for unknown sites, cached"""
+    key = f'{KEY_PREFIX}{site_id}'
+    tracking_id = cache.get(key)
+    if tracking_id is None:
+        tracking_id = Site.objects.filter(id=site_id).values_list('tracking_id', flat=True).first()
+        tracking_id = str(tracking_id) if tracking_id else MISSING
+        cache.set(key, tracking_id, settings.TRACKING_SCRIPT_SITE_TTL)
+    return tracking_id or None
+
+
+def invalidate_tracking_script(site_id):
+    cache.delete(f'{KEY_PREFIX}{site_id}')
+
+
+def pick_encoding(script, accept_encoding):
+    """Return (content_encoding, body) for the client's Accept-Encoding"""
+    accepted = {
+        token.split(';')[0].strip().lower()
+        for token in (accept_encoding or '').split(',')
+        if not re.search(r';\s*q=0(\.0*)?\s*$', token)
+    }
+    if script.br is not None and 'br' in accepted:
+        return 'br', script.br
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip', script.gzip
+    return None, script.identity
+
+
+def etag_for(script, encoding):
+    """Strong ETag per representation: the content digest plus the encoding"""
+    return f'"{script.etag}-{encoding}"' if encoding else f'"{script.etag}"'
+
+
+def etag_matches(script, if_none_match):
+    """
+    True when the client already has this script in any encoding. Proxies
+    may weaken the tag (W/) after recompressing, so the comparison is weak.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip().removeprefix('W/').strip('"')
+        if tag.split('-')[0] == script.etag:
+            return True
+    return False
@@ -2,7 +2,7 @@ from rest_framework.routers import DefaultRouter
 from django.urls import path
 from .views import HeatmapDataViewSet
 from .api_views import trigger_heatmap_generation, get_tracking_script
-from .heatmap_views import get_heatmap_data, get_page_screenshot
+from .heatmap_views import get_heatmap_data, get_page_screenshot, get_heatmap_cache_stats, get_element_clicks
 
 router = DefaultRouter()
 router.register(r'', HeatmapDataViewSet, basename='heatmap')
@@ -11,5 +11,7 @@ urlpatterns = [
     path('generate/<int:site_id>/', trigger_heatmap_generation, name='generate_heatmap'),
     path('tracking-script/<int:site_id>/', get_tracking_script, name='tracking_script'),
     path('data/<int:site_id>/', get_heatmap_data, name='heatmap_data'),
+    path('elements/<int:site_id>/', get_element_clicks, name='element_clicks'),
     path('screenshot/<int:site_id>/', get_page_screenshot, name='page_screenshot'),
+    path('cache/stats/', get_heatmap_cache_stats, name='heatmap_cache_stats'),
 ] + router.urls
@@ -0,0 +1,111 @@
+"""
+Compression helpers for rrweb recording payloads
+
+gzip/zlib come from the standard library. zstd needs the optional
+`zstandard` package; without it zstd request bodies are rejected with 415
+and chunks are stored with zlib.
+"""
+import io
+import zlib
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# zlib wbits that accept both gzip and zlib headers
+AUTO_HEADER_WBITS = 32 + zlib.MAX_WBITS
+
+
+class UnsupportedEncoding(Exception):
+    """Raised for a Content-Encoding or codec this server cannot decode"""
+
+
+class PayloadTooLarge(Exception):
+    """Raised when a compressed payload expands past the configured limit"""
+
+
+class CorruptPayload(ValueError):
+    """Raised when compressed data cannot be decoded"""
+
+
+def zstd_available():
+    return zstandard is not None
+
+
+def default_codec():
+    """Codec used for new recording chunks"""
+    codec = getattr(settings, 'RECORDING_CHUNK_CODEC', 'zstd')
+    if codec == 'zstd' and not zstd_available():
+        return 'zlib'
+    return codec
+
+
+def compress(data, codec):
+    if codec == 'zlib':
+        return zlib.compress(data, ZLIB_LEVEL)
+    if codec == 'zstd' and zstd_available():
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise UnsupportedEncoding(codec)
+
+
+def decompress(data, codec, max_size=None):
+    """
+    Decompress data written with the given codec ('zlib', 'gzip', 'zstd' or
+    'identity'). If max_size is set, raise PayloadTooLarge instead of
+    inflating more than that many bytes.
+    """
+    try:
+        return _decompress(data, codec, max_size)
+    except zlib.error as e:
+        raise CorruptPayload(str(e))
+    except Exception as e:
+        if zstd_available() and isinstance(e, zstandard.ZstdError):
+            raise CorruptPayload(str(e))
+        raise
+
+
+def _decompress(data, codec, max_size):
+    if codec == 'identity':
+        if max_size is not None and len(data) > max_size:
+            raise PayloadTooLarge()
+        return data
+
+    if codec in ('zlib', 'gzip'):
+        decompressor = zlib.decompressobj(AUTO_HEADER_WBITS)
+        if max_size is None:
+            return decompressor.decompress(data) + decompressor.flush()
+        output = decompressor.decompress(data, max_size + 1)
+        if len(output) > max_size:
+            raise PayloadTooLarge()
+        return output
+
+    if codec == 'zstd' and zstd_available():
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+        output = reader.read() if max_size is None else reader.read(max_size + 1)
+        if max_size is not None and len(output) > max_size:
+            raise PayloadTooLarge()
+        return output
+
+    raise UnsupportedEncoding(codec)
+
+
+def decode_content(body, content_encoding, max_size):
+    """
+    Undo an HTTP Content-Encoding header on a request body. Stacked encodings
+    ("gzip, zstd") are removed in reverse order of application.
+    """
+    encodings = [e.strip().lower() for e in (content_encoding or '').split(',') if e.strip()]
+    for encoding in reversed(encodings):
+        if encoding == 'x-gzip':
+            encoding = 'gzip'
+        if encoding == 'deflate':
+            encoding = 'zlib'
+        if encoding not in ('gzip', 'zlib', 'zstd', 'identity'):
+            raise UnsupportedEncoding(encoding)
+        body = decompress(body, encoding, max_size)
+    return body
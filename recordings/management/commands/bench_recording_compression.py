@@ -0,0 +1,125 @@
+import gzip
+import json
+import random
+import time
+from django.core.management.base import BaseCommand
+from recordings.compression import compress, decompress, zstd_available
+
+BATCH_INTERVAL_MS = 5000
+
+
+class Command(BaseCommand):
+    help = 'Benchmark bytes on the wire, bytes stored and CPU cost of recording compression'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='JSON file with a list of real rrweb events (default: synthetic session)')
+        parser.add_argument('--nodes', type=int, default=3000, help='DOM nodes in each synthetic full snapshot')
+        parser.add_argument('--minutes', type=int, default=5, help='Length of the synthetic session')
+
+    def handle(self, *args, **options):
+        if options['file']:
+            with open(options['file']) as f:
+                events = json.load(f)
+        else:
+            events = self.synthetic_session(options['nodes'], options['minutes'])
+
+        batches = self.split_batches(events)
+        raw = [json.dumps({'session_id': 1, 'events': b}, separators=(',', ':')).encode() for b in batches]
+        raw_total = sum(len(r) for r in raw)
+        self.stdout.write(
+            f"{len(events)} events in {len(batches)} tracker batches, {raw_total / 1e6:.2f} MB of JSON\n"
+        )
+
+        codecs = [('gzip', lambda d: gzip.compress(d, 6)), ('zlib', lambda d: compress(d, 'zlib'))]
+        if zstd_available():
+            codecs.append(('zstd', lambda d: compress(d, 'zstd')))
+        else:
+            self.stdout.write('zstandard is not installed, skipping zstd\n')
+
+        self.stdout.write(
+            f"{'codec':<8} {'bytes':>12} {'ratio':>7} {'compress ms/MB':>15} {'decompress ms/MB':>17}"
+        )
+        self.stdout.write(f"{'none':<8} {raw_total:>12} {1:>7.1f} {'-':>15} {'-':>17}")
+        for name, func in codecs:
+            start = time.process_time()
+            packed = [func(r) for r in raw]
+            compress_cpu = time.process_time() - start
+
+            start = time.process_time()
+            for p in packed:
+                decompress(p, name)
+            decompress_cpu = time.process_time() - start
+
+            size = sum(len(p) for p in packed)
+            mb = raw_total / 1e6
+            self.stdout.write(
+                f"{name:<8} {size:>12} {raw_total / size:>7.1f} "
+                f"{compress_cpu * 1000 / mb:>15.1f} {decompress_cpu * 1000 / mb:>17.1f}"
+            )
+
+        self.stdout.write(
+            '\nWire: the tracker sends gzip via CompressionStream. Stored: one chunk per '
+            'batch using RECORDING_CHUNK_CODEC. Previously both were the uncompressed JSON size.'
+        )
+
+    def split_batches(self, events):
+        """Group events the way the tracker flushes them, every BATCH_INTERVAL_MS"""
+        batches, current, window_end = [], [], None
+        for event in events:
+            timestamp = event.get('timestamp', 0)
+            if window_end is None:
+                window_end = timestamp + BATCH_INTERVAL_MS
+            if timestamp >= window_end and current:
+                batches.append(current)
+                current = []
+                window_end = timestamp + BATCH_INTERVAL_MS
+            current.append(event)
+        if current:
+            batches.append(current)
+        return batches
+
+    def synthetic_session(self, nodes, minutes):
+        """rrweb-shaped session: full snapshot every 30s plus mouse, scroll and mutation traffic"""
+        rng = random.Random(42)
+        tags = ['div', 'span', 'a', 'p', 'li', 'img', 'button', 'section']
+        classes = ['container', 'row', 'col-md-6', 'card', 'card-body', 'btn btn-primary', 'nav-item', 'text-muted']
+        words = 'the quick brown fox jumps over a lazy dog pricing features about contact'.split()
+
+        def snapshot(timestamp):
+            children = []
+            for node_id in range(nodes):
+                children.append({
+                    'type': 2,
+                    'tagName': rng.choice(tags),
+                    'attributes': {'class': rng.choice(classes), 'data-id': str(node_id % 50)},
+                    'childNodes': [{'type': 3, 'textContent': ' '.join(rng.choices(words, k=4)), 'id': nodes + node_id}],
+                    'id': node_id,
+                })
+            return {
+                'type': 2,
+                'data': {'node': {'type': 0, 'childNodes': children, 'id': 0}, 'initialOffset': {'left': 0, 'top': 0}},
+                'timestamp': timestamp,
+            }
+
+        events = []
+        start = 1_700_000_000_000
+        end = start + minutes * 60_000
+        timestamp = start
+        while timestamp < end:
+            if (timestamp - start) % 30_000 < 50:
+                events.append({'type': 4, 'data': {'href': 'https://example.com/pricing', 'width': 1920, 'height': 1080}, 'timestamp': timestamp})
+                events.append(snapshot(timestamp))
+            kind = rng.random()
+            if kind < 0.6:
+                events.append({'type': 3, 'data': {'source': 1, 'positions': [
+                    {'x': rng.randint(0, 1920), 'y': rng.randint(0, 1080), 'id': rng.randint(0, nodes), 'timeOffset': -i * 20}
+                    for i in range(5)
+                ]}, 'timestamp': timestamp})
+            elif kind < 0.8:
+                events.append({'type': 3, 'data': {'source': 3, 'id': 1, 'x': 0, 'y': rng.randint(0, 8000)}, 'timestamp': timestamp})
+            else:
+                events.append({'type': 3, 'data': {'source': 0, 'texts': [], 'attributes': [
+                    {'id': rng.randint(0, nodes), 'attributes': {'class': rng.choice(classes)}}
+                ], 'removes': [], 'adds': []}, 'timestamp': timestamp})
+            timestamp += 50
+        return events
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recordings', '0002_alter_recording_options_remove_recording_storage_url_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recording',
+            name='chunk_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recording',
+            name='first_event_timestamp',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='recording',
+            name='last_event_timestamp',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='RecordingChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.IntegerField()),
+                ('codec', models.CharField(choices=[('zlib', 'zlib')], default='zlib', max_length=10)),
+                ('data', models.BinaryField()),
+                ('event_count', models.IntegerField()),
+                ('first_timestamp', models.BigIntegerField(null=True)),
+                ('last_timestamp', models.BigIntegerField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('recording', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='recordings.recording')),
+            ],
+            options={
+                'ordering': ['sequence'],
+                'unique_together': {('recording', 'sequence')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recordings', '0003_recording_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recordingchunk',
+            name='snapshot_timestamp',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recordings', '0004_recordingchunk_snapshot_timestamp'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recordingchunk',
+            name='codec',
+            field=models.CharField(choices=[('zlib', 'zlib'), ('zstd', 'zstd')], default='zlib', max_length=10),
+        ),
+    ]
@@ -12,8 +12,39 @@ class Recording(models.Model):
     has_rage_clicks = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Running aggregates maintained as chunks are appended (rrweb ms timestamps)
+    chunk_count = models.IntegerField(default=0)
+    first_event_timestamp = models.BigIntegerField(null=True, blank=True)
+    last_event_timestamp = models.BigIntegerField(null=True, blank=True)
+
     class Meta:
         ordering = ['-created_at']
 
     def __str__(self):
         return f"Recording {self.recording_id}"
+
+
+class RecordingChunk(models.Model):
+    """
+    One compressed batch of rrweb events, appended per tracker flush
+    """
+    CODECS = [
+        ('zlib', 'zlib'),
+        ('zstd', 'zstd'),
+    ]
+    recording = models.ForeignKey(Recording, on_delete=models.CASCADE, related_name='chunks')
+    sequence = models.IntegerField()
+    codec = models.CharField(max_length=10, choices=CODECS, default='zlib')
+    data = models.BinaryField()  # JSON list of rrweb events, compressed with `codec`
+    event_count = models.IntegerField()
+    first_timestamp = models.BigIntegerField(null=True)
+    last_timestamp = models.BigIntegerField(null=True)
+    snapshot_timestamp = models.BigIntegerField(null=True)  # First full snapshot in this chunk, used for seeking
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['sequence']
+        unique_together = ['recording', 'sequence']
+
+    def __str__(self):
+        return f"Chunk {self.sequence} of {self.recording_id}"
@@ -0,0 +1,35 @@
+import json
+from django.conf import settings
+from rest_framework.exceptions import ParseError, UnsupportedMediaType
+from rest_framework.parsers import JSONParser
+from recordings.compression import (
+    decode_content, UnsupportedEncoding, PayloadTooLarge, CorruptPayload
+)
+
+
+class CompressedJSONParser(JSONParser):
+    """
+    JSON parser that accepts gzip/deflate/zstd compressed request bodies
+    according to the Content-Encoding header
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        content_encoding = request.META.get('HTTP_CONTENT_ENCODING')
+        if not content_encoding:
+            return super().parse(stream, media_type, parser_context)
+
+        body = stream.read() if stream is not None else b''
+        try:
+            body = decode_content(body, content_encoding, settings.RECORDING_MAX_DECOMPRESSED_BYTES)
+        except UnsupportedEncoding as e:
+            raise UnsupportedMediaType(f"Content-Encoding {e}")
+        except PayloadTooLarge:
+            raise ParseError('Decompressed payload is too large')
+        except CorruptPayload as e:
+            raise ParseError(f'Invalid compressed payload - {e}')
+
+        try:
+            return json.loads(body.decode(settings.DEFAULT_CHARSET))
+        except ValueError as e:
+            raise ParseError(f'JSON parse error - {e}')
@@ -1,16 +1,23 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, parser_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from django.http import StreamingHttpResponse
+from django.views.decorators.gzip import gzip_page
 from recordings.models import Recording
 from events.models import Session
-from django.utils import timezone
+from events.session_cache import get_session_cache
+from sites.limits import over_daily_quota
+from recordings.parsers import CompressedJSONParser
+from recordings.storage import append_events, load_recording_events, iter_recording_events
 import json
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@parser_classes([CompressedJSONParser])
 def save_recording_events(request):
     """
     Save rrweb recording events for a session
+    Accepts gzip, deflate or zstd request bodies via Content-Encoding
     """
     session_id = request.data.get('session_id')
     events = request.data.get('events', [])
@@ -18,44 +25,24 @@ def save_recording_events(request):
     if not session_id or not events:
         return Response({'error': 'session_id and events are required'}, status=400)
     
-    try:
-        session = Session.objects.get(id=session_id)
-    except Session.DoesNotExist:
-        return Response({'error': 'Session not found'}, status=404)
-    
-    # Get or create recording for this session
-    recording, created = Recording.objects.get_or_create(
-        session=session,
-        defaults={
-            'recording_id': f"rec_{session_id}",
-            'duration': 0,
-            'event_count': 0,
-            'recording_data': []
-        }
-    )
-    
-    # Append new events to existing recording data
-    existing_data = recording.recording_data or []
-    existing_data.extend(events)
-    recording.recording_data = existing_data
-    recording.event_count = len(existing_data)
+    if not isinstance(events, list) or not all(isinstance(e, dict) for e in events):
+        return Response({'error': 'events must be a list of objects'}, status=400)
     
-    # Update duration based on timestamps
-    if existing_data:
-        first_timestamp = existing_data[0].get('timestamp', 0)
-        last_timestamp = existing_data[-1].get('timestamp', 0)
-        recording.duration = int((last_timestamp - first_timestamp) / 1000)  # Convert to seconds
-    
-    # Check for errors and rage clicks in events
-    has_errors = any(e.get('type') == 5 and 'error' in str(e.get('data', {})) for e in events)
-    has_rage_clicks = any(e.get('type') == 5 and 'rage' in str(e.get('data', {})) for e in events)
+    try:
+        session_id = int(session_id)
+    except (TypeError, ValueError):
+        return Response({'error': 'session_id must be an integer'}, status=400)
     
-    if has_errors:
-        recording.has_errors = True
-    if has_rage_clicks:
-        recording.has_rage_clicks = True
+    # Validated from the session cache; only the primary key is needed to append
+    info = get_session_cache().get(session_id)
+    if not info.is_valid:
+        return Response({'error': 'Session not found'}, status=404)
+    if over_daily_quota(info.site_id):
+        return Response({'error': 'Daily event quota exceeded'}, status=429)
+    session = Session(id=session_id, site_id=info.site_id, device_type=info.device_type)
     
-    recording.save()
+    # Each flush is stored as its own compressed chunk
+    recording = append_events(session, events)
     
     return Response({
         'success': True,
@@ -64,6 +51,7 @@ def save_recording_events(request):
     })
 
 
+@gzip_page
 @api_view(['GET'])
 def get_recording_data(request, recording_id):
     """
@@ -79,8 +67,60 @@ def get_recording_data(request, recording_id):
         'session_id': recording.session.id,
         'duration': recording.duration,
         'event_count': recording.event_count,
-        'events': recording.recording_data,
+        'events': load_recording_events(recording),
         'has_errors': recording.has_errors,
         'has_rage_clicks': recording.has_rage_clicks,
         'created_at': recording.created_at.isoformat()
     })
+
+
+@gzip_page
+@api_view(['GET'])
+def stream_recording_data(request, recording_id):
+    """
+    Stream recording events for playback as NDJSON. The first line holds the
+    recording metadata, each following line is one rrweb event.
+
+    Query params:
+    - offset: number of events to skip from the start of the recording
+    - from_timestamp: rrweb timestamp (ms) to seek to; streaming starts at the
+      last full snapshot before it so the player can rebuild the page
+    """
+    try:
+        recording = Recording.objects.select_related('session').get(
+            recording_id=recording_id,
+            session__site__owner=request.user
+        )
+    except Recording.DoesNotExist:
+        return Response({'error': 'Recording not found'}, status=404)
+    
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+        from_timestamp = request.GET.get('from_timestamp')
+        from_timestamp = int(from_timestamp) if from_timestamp else None
+    except ValueError:
+        return Response({'error': 'offset and from_timestamp must be integers'}, status=400)
+    
+    metadata = {
+        'recording_id': recording.recording_id,
+        'session_id': recording.session.id,
+        'duration': recording.duration,
+        'event_count': recording.event_count,
+        'first_event_timestamp': recording.first_event_timestamp,
+        'last_event_timestamp': recording.last_event_timestamp,
+        'offset': offset,
+        'from_timestamp': from_timestamp,
+        'has_errors': recording.has_errors,
+        'has_rage_clicks': recording.has_rage_clicks,
+        'created_at': recording.created_at.isoformat()
+    }
+    
+    def lines():
+        yield json.dumps(metadata) + '\n'
+        for batch in iter_recording_events(recording, offset=offset, from_timestamp=from_timestamp):
+            yield ''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in batch)
+    
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Let nginx-style proxies pass chunks through
+    return response
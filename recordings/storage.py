@@ -0,0 +1,197 @@
+"""
+Append-only chunk storage for rrweb recordings
+
+Each tracker flush is stored as its own compressed RecordingChunk row with a
+sequence number, so saving a batch costs O(batch) instead of rewriting the
+whole session. Duration, event count and the error/rage flags are kept as
+running aggregates on Recording.
+
+Recordings created before chunking keep their events in
+Recording.recording_data; they are read as an implicit first chunk and
+migrated into a real chunk the next time events are appended.
+"""
+import json
+from django.db import transaction
+from recordings.compression import compress, decompress, default_codec
+from recordings.models import Recording, RecordingChunk
+
+# rrweb EventType values
+FULL_SNAPSHOT = 2
+META = 4
+
+
+def encode_events(events, codec):
+    """Serialize and compress a list of rrweb events"""
+    payload = json.dumps(events, separators=(',', ':')).encode('utf-8')
+    return compress(payload, codec)
+
+
+def decode_chunk(chunk):
+    """Return the list of rrweb events stored in a chunk"""
+    return json.loads(decompress(bytes(chunk.data), chunk.codec))
+
+
+def _timestamps(events):
+    timestamps = [e.get('timestamp') for e in events if isinstance(e.get('timestamp'), (int, float))]
+    if not timestamps:
+        return None, None
+    return int(min(timestamps)), int(max(timestamps))
+
+
+def _first_snapshot_timestamp(events):
+    timestamps = [
+        e.get('timestamp') for e in events
+        if e.get('type') == FULL_SNAPSHOT and isinstance(e.get('timestamp'), (int, float))
+    ]
+    return int(min(timestamps)) if timestamps else None
+
+
+def _has_errors(events):
+    return any(e.get('type') == 5 and 'error' in str(e.get('data', {})) for e in events)
+
+
+def _has_rage_clicks(events):
+    return any(e.get('type') == 5 and 'rage' in str(e.get('data', {})) for e in events)
+
+
+def _add_chunk(recording, events):
+    """Store events as the next chunk and fold them into the running aggregates"""
+    first, last = _timestamps(events)
+    codec = default_codec()
+
+    RecordingChunk.objects.create(
+        recording=recording,
+        sequence=recording.chunk_count,
+        codec=codec,
+        data=encode_events(events, codec),
+        event_count=len(events),
+        first_timestamp=first,
+        last_timestamp=last,
+        snapshot_timestamp=_first_snapshot_timestamp(events),
+    )
+
+    recording.chunk_count += 1
+    recording.event_count += len(events)
+    if first is not None:
+        if recording.first_event_timestamp is None or first < recording.first_event_timestamp:
+            recording.first_event_timestamp = first
+        if recording.last_event_timestamp is None or last > recording.last_event_timestamp:
+            recording.last_event_timestamp = last
+        recording.duration = int((recording.last_event_timestamp - recording.first_event_timestamp) / 1000)
+
+    if _has_errors(events):
+        recording.has_errors = True
+    if _has_rage_clicks(events):
+        recording.has_rage_clicks = True
+
+
+def append_events(session, events):
+    """
+    Append a batch of rrweb events to the session's recording, creating the
+    recording on first use. Returns the updated Recording.
+    """
+    with transaction.atomic():
+        recording, created = Recording.objects.get_or_create(
+            session=session,
+            defaults={'recording_id': f"rec_{session.id}"}
+        )
+        # Serialize concurrent flushes for the same session so sequence
+        # numbers and aggregates stay consistent
+        recording = Recording.objects.select_for_update().get(pk=recording.pk)
+
+        if recording.recording_data:
+            legacy = recording.recording_data
+            recording.event_count = 0
+            _add_chunk(recording, legacy)
+            recording.recording_data = []
+
+        _add_chunk(recording, events)
+        recording.save(update_fields=[
+            'recording_data', 'chunk_count', 'event_count', 'duration',
+            'first_event_timestamp', 'last_event_timestamp',
+            'has_errors', 'has_rage_clicks',
+        ])
+
+    return recording
+
+
+def _keyframe_index(events, from_timestamp):
+    """
+    Index of the last full snapshot at or before from_timestamp, backed up to
+    its Meta event so the player can rebuild the page from there
+    """
+    index = None
+    for i, event in enumerate(events):
+        timestamp = event.get('timestamp')
+        if event.get('type') == FULL_SNAPSHOT and isinstance(timestamp, (int, float)) and timestamp <= from_timestamp:
+            index = i
+    if index is None:
+        return 0
+    if index > 0 and events[index - 1].get('type') == META:
+        index -= 1
+    return index
+
+
+def iter_recording_events(recording, offset=0, from_timestamp=None):
+    """
+    Yield lists of events starting at the given position, decompressing one
+    chunk at a time. Chunks before the start position are skipped using their
+    stored metadata, so the cost of the first batch does not depend on the
+    recording length.
+
+    offset skips that many events from the start of the recording.
+    from_timestamp (rrweb ms) starts at the last full snapshot at or before
+    that time; the player fast-forwards from there. If both are given the
+    later position wins.
+    """
+    if recording.recording_data:
+        # Pre-chunking recording kept in a single row
+        events = recording.recording_data
+        start = offset
+        if from_timestamp is not None:
+            start = max(start, _keyframe_index(events, from_timestamp))
+        yield events[start:]
+        return
+
+    chunks = recording.chunks.order_by('sequence')
+
+    # Locate the chunk holding the requested offset
+    start_sequence, skip = None, offset
+    if offset:
+        for sequence, event_count in chunks.values_list('sequence', 'event_count'):
+            if skip < event_count:
+                start_sequence = sequence
+                break
+            skip -= event_count
+    else:
+        start_sequence = chunks.values_list('sequence', flat=True).first()
+    if start_sequence is None:
+        return
+
+    keyframe_sequence = None
+    if from_timestamp is not None:
+        # The last chunk whose first snapshot is not after the seek point
+        # holds the keyframe
+        keyframe_sequence = chunks.filter(
+            snapshot_timestamp__lte=from_timestamp,
+            sequence__gte=start_sequence
+        ).order_by('-sequence').values_list('sequence', flat=True).first()
+        if keyframe_sequence is not None and keyframe_sequence > start_sequence:
+            start_sequence, skip = keyframe_sequence, 0
+
+    for chunk in chunks.filter(sequence__gte=start_sequence).iterator():
+        events = decode_chunk(chunk)
+        if chunk.sequence == start_sequence:
+            if chunk.sequence == keyframe_sequence:
+                skip = max(skip, _keyframe_index(events, from_timestamp))
+            events = events[skip:]
+        if events:
+            yield events
+
+
+def load_recording_events(recording):
+    """Return every event of a recording as a single list"""
+    events = []
+    for batch in iter_recording_events(recording):
+        events.extend(batch)
+    return events
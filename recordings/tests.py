@@ -1,3 +1,143 @@
-from django.test import TestCase
+import gzip
+import json
+import unittest
+import zlib
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from events.models import Session
+from events.session_cache import get_session_cache
+from recordings.compression import PayloadTooLarge, decode_content, zstandard
+from recordings.models import Recording
+from recordings.storage import FULL_SNAPSHOT, META, append_events, iter_recording_events
+from sites.models import Site
 
-# Create your tests here.
+INCREMENTAL = 3
+
+
+def event(event_type, timestamp):
+    return {'type': event_type, 'timestamp': timestamp, 'data': {}}
+
+
+def keyframe(timestamp):
+    return [event(META, timestamp), event(FULL_SNAPSHOT, timestamp)]
+
+
+CHUNKS = [
+    keyframe(1000) + [event(INCREMENTAL, 1100), event(INCREMENTAL, 1200)],
+    [event(INCREMENTAL, 1300), event(INCREMENTAL, 1400)],
+    keyframe(2000) + [event(INCREMENTAL, 2100)] + keyframe(2500) + [event(INCREMENTAL, 2600)],
+    [event(INCREMENTAL, 2700)],
+    keyframe(3000) + [event(INCREMENTAL, 3100)],
+]
+
+
+def expected_start(events, offset, from_timestamp):
+    """Later of offset and the Meta event before the last snapshot at or before from_timestamp"""
+    start = offset
+    if from_timestamp is not None:
+        snapshots = [
+            i for i, e in enumerate(events)
+            if e['type'] == FULL_SNAPSHOT and e['timestamp'] <= from_timestamp
+        ]
+        if snapshots:
+            index = snapshots[-1]
+            if index > 0 and events[index - 1]['type'] == META:
+                index -= 1
+            start = max(start, index)
+    return start
+
+
+class RecordingSeekTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='owner', password='secret')
+        site = Site.objects.create(owner=user, name='Shop', domain='shop.example.com')
+        self.session = Session.objects.create(site=site, device_type='desktop', browser='b', os='o', viewport={})
+        self.events = [e for chunk in CHUNKS for e in chunk]
+
+    def read(self, recording, offset=0, from_timestamp=None):
+        return [e for batch in iter_recording_events(recording, offset, from_timestamp) for e in batch]
+
+    def assertSeeks(self, recording):
+        for offset in range(len(self.events) + 2):
+            for from_timestamp in (None, 0, 1000, 1150, 1999, 2000, 2300, 2500, 2650, 2999, 3000, 5000):
+                start = expected_start(self.events, offset, from_timestamp)
+                self.assertEqual(
+                    self.read(recording, offset, from_timestamp), self.events[start:],
+                    f'offset={offset} from_timestamp={from_timestamp}'
+                )
+
+    def test_chunked_recording_seeks_like_a_flat_list(self):
+        for chunk in CHUNKS:
+            recording = append_events(self.session, chunk)
+        self.assertEqual(recording.chunk_count, len(CHUNKS))
+        self.assertSeeks(recording)
+
+    def test_legacy_recording_seeks_like_a_flat_list(self):
+        recording = Recording.objects.create(
+            session=self.session, recording_id='rec_legacy', recording_data=self.events
+        )
+        self.assertSeeks(recording)
+
+
+class CompressedPayloadTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='owner', password='secret')
+        site = Site.objects.create(owner=user, name='Shop', domain='shop.example.com')
+        self.session = Session.objects.create(site=site, device_type='desktop', browser='b', os='o', viewport={})
+        get_session_cache().clear()
+        self.client = APIClient()
+        self.payload = json.dumps({
+            'session_id': self.session.id, 'events': keyframe(1000) + [event(INCREMENTAL, 1100)]
+        }).encode('utf-8')
+
+    def post(self, body, encoding):
+        return self.client.generic(
+            'POST', '/api/track/recording-events/', body,
+            content_type='application/json', HTTP_CONTENT_ENCODING=encoding
+        )
+
+    def assertStored(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        events = [e for batch in iter_recording_events(Recording.objects.get(session=self.session)) for e in batch]
+        self.assertEqual(len(events), 3)
+
+    def test_gzip_body(self):
+        self.assertStored(self.post(gzip.compress(self.payload), 'gzip'))
+
+    def test_deflate_body(self):
+        self.assertStored(self.post(zlib.compress(self.payload), 'deflate'))
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd_body(self):
+        self.assertStored(self.post(zstandard.ZstdCompressor().compress(self.payload), 'zstd'))
+
+    def test_stacked_encodings_are_undone_in_reverse(self):
+        self.assertStored(self.post(zlib.compress(gzip.compress(self.payload)), 'gzip, deflate'))
+
+    def test_unknown_encoding_is_unsupported(self):
+        self.assertEqual(self.post(self.payload, 'br').status_code, 415)
+
+    def test_corrupt_body_is_rejected(self):
+        self.assertEqual(self.post(b'not gzip at all', 'gzip').status_code, 400)
+
+    @override_settings(RECORDING_MAX_DECOMPRESSED_BYTES=64 * 1024)
+    def test_decompression_bomb_is_rejected(self):
+        bomb = gzip.compress(b' ' * (8 * 1024 * 1024))
+        self.assertLess(len(bomb), 64 * 1024)
+        response = self.post(bomb, 'gzip')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('too large', str(response.data['detail']))
+        self.assertFalse(Recording.objects.exists())
+
+    def test_limit_applies_to_every_codec(self):
+        data = b'x' * 2048
+        bodies = {'gzip': gzip.compress(data), 'zlib': zlib.compress(data), 'identity': data}
+        if zstandard is not None:
+            bodies['zstd'] = zstandard.ZstdCompressor().compress(data)
+        for encoding, body in bodies.items():
+            self.assertEqual(decode_content(body, encoding, 2048), data)
+            with self.assertRaises(PayloadTooLarge, msg=encoding):
+                decode_content(body, encoding, 2047)
@@ -0,0 +1,106 @@
+"""
+Coalesced Site activity heartbeats
+
+Ingestion calls record_site_activity for every request, but
+Site.is_connected / last_activity_at are written at most once per site
+every SITE_HEARTBEAT_INTERVAL seconds. Activity is collected in memory and
+written for all due sites with one UPDATE. Across processes, a key in the
+default cache with the interval as timeout lets only the first process
+write a given site.
+
+last_activity_at may lag real activity by up to the interval, which is far
+below the 5 minute window Site.connection_status looks at.
+"""
+import atexit
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from sites.models import Site
+
+KEY_PREFIX = 'site_heartbeat:'
+
+
+class Heartbeats:
+
+    def __init__(self, interval=None):
+        self.interval = interval if interval is not None else settings.SITE_HEARTBEAT_INTERVAL
+        self._pending = set()
+        self._written_at = {}  # site id -> monotonic time of our last write
+        self._lock = threading.Lock()
+        self.metrics = {'recorded': 0, 'writes': 0, 'sites_written': 0}
+
+    def record(self, site_ids):
+        """Note activity for these sites and write the ones that are due"""
+        now = time.monotonic()
+        with self._lock:
+            self.metrics['recorded'] += 1
+            self._pending.update(site_ids)
+            due = {
+                site_id for site_id in self._pending
+                if now - self._written_at.get(site_id, float('-inf')) >= self.interval
+            }
+            if not due:
+                return 0
+            self._pending -= due
+            for site_id in due:
+                self._written_at[site_id] = now
+        return self._write(due)
+
+    def flush(self):
+        """Write every pending site regardless of the interval"""
+        with self._lock:
+            due, self._pending = self._pending, set()
+            now = time.monotonic()
+            for site_id in due:
+                self._written_at[site_id] = now
+        return self._write(due, force=True)
+
+    def _write(self, site_ids, force=False):
+        if not force and self.interval:
+            # Another process may have written this site within the interval
+            site_ids = [
+                site_id for site_id in site_ids
+                if cache.add(f'{KEY_PREFIX}{site_id}', 1, timeout=self.interval)
+            ]
+        if not site_ids:
+            return 0
+        updated = Site.objects.filter(id__in=site_ids).update(
+            is_connected=True,
+            last_activity_at=timezone.now()
+        )
+        self.metrics['writes'] += 1
+        self.metrics['sites_written'] += updated
+        return updated
+
+    def stats(self):
+        return {**self.metrics, 'pending': len(self._pending), 'interval_seconds': self.interval}
+
+
+_heartbeats = None
+_heartbeats_lock = threading.Lock()
+
+
+def get_heartbeats():
+    global _heartbeats
+    if _heartbeats is None:
+        with _heartbeats_lock:
+            if _heartbeats is None:
+                _heartbeats = Heartbeats()
+                atexit.register(_flush_at_exit)
+    return _heartbeats
+
+
+def _flush_at_exit():
+    try:
+        _heartbeats.flush()
+    except Exception:
+        pass  # Database may already be gone
+
+
+def record_site_activity(site_ids):
+    """Mark sites as active; writes are coalesced, see module docstring"""
+    if not site_ids:
+        return 0
+    return get_heartbeats().record(site_ids)
@@ -0,0 +1,286 @@
+"""
+Server-side sampling and ingestion limits per site
+
+Site.settings keys (defaults from settings.INGEST_*):
+    sampling_rate       fraction of new sessions that are recorded, 0..1
+    events_per_second   token bucket refill rate for events and sessions
+    burst               token bucket size
+    daily_event_quota   events accepted per calendar day, None for unlimited
+
+Sampling is decided once per session from a hash of its session_id UUID,
+so the same session id always gets the same answer. Unsampled sessions are
+never created and the tracker stays idle.
+
+Limits are checked from the request body and the session cache, before
+any serializer validation or database write. The token buckets are kept
+per process. Daily quota usage and the per-site counters live in the
+default cache, which is shared when that cache is Redis. Quota is reserved
+with one atomic incr and handed back when the total passes the quota, so
+concurrent requests cannot overshoot it. A batch spanning several sites is
+charged to all of them or, when any is over its limits, to none.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, time as dt_time, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from sites.models import Site
+
+SitePolicy = namedtuple('SitePolicy', ['site_id', 'sampling_rate', 'rate', 'burst', 'daily_quota'])
+
+COUNTERS = (
+    'events_accepted', 'events_rejected_rate', 'events_rejected_quota',
+    'sessions_accepted', 'sessions_sampled_out', 'sessions_rejected_rate',
+)
+
+
+class LimitExceeded(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+def _setting(site_settings, key, default, cast):
+    value = (site_settings or {}).get(key, default)
+    if value is None:
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _build_policy(site_id, site_settings):
+    return SitePolicy(
+        site_id=site_id,
+        sampling_rate=min(max(_setting(site_settings, 'sampling_rate', 1.0, float), 0.0), 1.0),
+        rate=_setting(site_settings, 'events_per_second', settings.INGEST_EVENTS_PER_SECOND, float),
+        burst=_setting(site_settings, 'burst', settings.INGEST_BURST, float),
+        daily_quota=_setting(site_settings, 'daily_event_quota', settings.INGEST_DAILY_EVENT_QUOTA, int),
+    )
+
+
+_policies = {}  # ('id', site_id) or ('tracking', tracking_id) -> (SitePolicy, expires_at)
+_policies_lock = threading.Lock()
+
+
+def get_site_policy(site_id=None, tracking_id=None):
+    """
+    Policy of a site by id or tracking id, cached for SITE_POLICY_TTL
+    seconds. Returns None for unknown sites and malformed tracking ids.
+    """
+    if tracking_id is None:
+        key = ('id', site_id)
+        sites = Site.objects.filter(id=site_id)
+    else:
+        try:
+            tracking_id = uuid.UUID(str(tracking_id))
+        except ValueError:
+            return None
+        key = ('tracking', str(tracking_id))
+        sites = Site.objects.filter(tracking_id=tracking_id)
+
+    now = time.monotonic()
+    entry = _policies.get(key)
+    if entry is not None and entry[1] > now:
+        return entry[0]
+
+    row = sites.values_list('id', 'settings').first()
+    if row is None:
+        # Only real sites are cached, so clients cannot grow the cache with made up ids
+        return None
+    policy = _build_policy(*row)
+    with _policies_lock:
+        _policies[key] = (policy, now + settings.SITE_POLICY_TTL)
+    return policy
+
+
+def invalidate_site_policy(site):
+    with _policies_lock:
+        _policies.pop(('id', site.id), None)
+        _policies.pop(('tracking', str(site.tracking_id)), None)
+
+
+def is_sampled(session_uuid, sampling_rate):
+    """Deterministic session sampling on the session UUID"""
+    if sampling_rate >= 1:
+        return True
+    digest = hashlib.sha1(str(session_uuid).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64 < sampling_rate
+
+
+class TokenBucket:
+
+    def __init__(self, burst):
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait(self, cost, rate, burst):
+        """
+        Refill, then return 0 when cost tokens can be taken or the seconds
+        to wait. A batch larger than the bucket is admitted only from a full
+        bucket and drives it negative, so the average rate still holds.
+        """
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        needed = min(cost, burst)
+        if needed <= self.tokens:
+            return 0
+        if rate <= 0:
+            return 24 * 60 * 60
+        return (needed - self.tokens) / rate
+
+    def take(self, cost, rate, burst):
+        """Remove cost tokens; returns 0 on success or the seconds to wait"""
+        wait = self.wait(cost, rate, burst)
+        if not wait:
+            self.tokens -= cost
+        return wait
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def _take_tokens(charges):
+    """
+    Take each [(policy, cost)] from its site's bucket, all or none. Returns
+    (site_id, seconds to wait) of the first site short of tokens, or (None, 0).
+    """
+    with _buckets_lock:
+        taken = []
+        for policy, cost in charges:
+            if policy.rate is None or policy.burst is None:
+                continue
+            bucket = _buckets.get(policy.site_id)
+            if bucket is None:
+                bucket = _buckets[policy.site_id] = TokenBucket(policy.burst)
+            wait = bucket.wait(cost, policy.rate, policy.burst)
+            if wait:
+                return policy.site_id, wait
+            taken.append((bucket, cost))
+        for bucket, cost in taken:
+            bucket.tokens -= cost
+    return None, 0
+
+
+def _day_key(site_id, name, day=None):
+    return f'ingest:{site_id}:{(day or timezone.localdate()).isoformat()}:{name}'
+
+
+def _count(site_id, name, amount=1):
+    key = _day_key(site_id, name)
+    if cache.add(key, amount, timeout=2 * 24 * 60 * 60):
+        return amount
+    try:
+        return cache.incr(key, amount)
+    except ValueError:
+        cache.set(key, amount, timeout=2 * 24 * 60 * 60)
+        return amount
+
+
+def _reserve_quota(site_id, count, quota):
+    """Count events as accepted unless that passes the quota, in one atomic incr"""
+    if _count(site_id, 'events_accepted', count) <= quota:
+        return True
+    _release_quota(site_id, count)
+    return False
+
+
+def _release_quota(site_id, count):
+    try:
+        cache.decr(_day_key(site_id, 'events_accepted'), count)
+    except ValueError:
+        pass  # Expired in the meantime
+
+
+def _seconds_until_midnight():
+    now = timezone.localtime()
+    midnight = timezone.make_aware(datetime.combine(now.date() + timedelta(days=1), dt_time.min))
+    return (midnight - now).total_seconds()
+
+
+def admit_events(site_counts):
+    """
+    Charge {site_id: event_count} against each site's quota and rate limit.
+    Raises LimitExceeded for the first site over its limits, in which case
+    no site is charged.
+    """
+    charges = []
+    for site_id, count in site_counts.items():
+        policy = get_site_policy(site_id)
+        if policy is not None:
+            charges.append((policy, count))
+
+    reserved = {}
+    try:
+        for policy, count in charges:
+            if policy.daily_quota is None:
+                continue
+            if not _reserve_quota(policy.site_id, count, policy.daily_quota):
+                _count(policy.site_id, 'events_rejected_quota', count)
+                raise LimitExceeded('daily_quota', _seconds_until_midnight())
+            reserved[policy.site_id] = count
+
+        site_id, wait = _take_tokens(charges)
+        if wait:
+            _count(site_id, 'events_rejected_rate', site_counts[site_id])
+            raise LimitExceeded('rate', wait)
+    except LimitExceeded:
+        for site_id, count in reserved.items():
+            _release_quota(site_id, count)
+        raise
+
+    # Sites with a quota were counted when it was reserved
+    for site_id, count in site_counts.items():
+        if site_id not in reserved:
+            _count(site_id, 'events_accepted', count)
+
+
+def admit_session(policy, session_uuid):
+    """
+    Decide whether a new session is recorded. Returns False when it is
+    sampled out, raises LimitExceeded when the site is over its rate.
+    """
+    if not is_sampled(session_uuid, policy.sampling_rate):
+        _count(policy.site_id, 'sessions_sampled_out')
+        return False
+    _, wait = _take_tokens([(policy, 1)])
+    if wait:
+        _count(policy.site_id, 'sessions_rejected_rate')
+        raise LimitExceeded('rate', wait)
+    return True
+
+
+def record_session(site_id):
+    _count(site_id, 'sessions_accepted')
+
+
+def over_daily_quota(site_id):
+    """Cheap check for endpoints that do not count against the quota themselves"""
+    policy = get_site_policy(site_id)
+    if policy is None or policy.daily_quota is None:
+        return False
+    return cache.get(_day_key(site_id, 'events_accepted'), 0) >= policy.daily_quota
+
+
+def site_ingest_stats(site, day=None):
+    """Today's counters and the limits in force for a site"""
+    counters = cache.get_many([_day_key(site.id, name, day) for name in COUNTERS])
+    policy = _build_policy(site.id, site.settings)
+    return {
+        'date': (day or timezone.localdate()).isoformat(),
+        'counters': {name: counters.get(_day_key(site.id, name, day), 0) for name in COUNTERS},
+        'limits': {
+            'sampling_rate': policy.sampling_rate,
+            'events_per_second': policy.rate,
+            'burst': policy.burst,
+            'daily_event_quota': policy.daily_quota,
+        },
+    }
@@ -1,3 +1,149 @@
+import uuid
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIClient
+from events.models import Session
+from sites import limits
+from sites.models import Site
 
-# Create your tests here.
+
+class TokenBucketTests(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(limits.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_takes_tokens_until_empty(self):
+        bucket = limits.TokenBucket(10)
+        self.assertEqual(bucket.take(6, 5, 10), 0)
+        self.assertEqual(bucket.take(4, 5, 10), 0)
+        self.assertAlmostEqual(bucket.take(1, 5, 10), 0.2)
+
+    def test_refills_at_rate_up_to_burst(self):
+        bucket = limits.TokenBucket(10)
+        bucket.take(10, 5, 10)
+        self.now += 1
+        self.assertEqual(bucket.take(5, 5, 10), 0)
+        self.assertGreater(bucket.take(1, 5, 10), 0)
+        self.now += 60
+        self.assertEqual(bucket.take(10, 5, 10), 0)
+        self.assertGreater(bucket.take(1, 5, 10), 0)
+
+    def test_oversized_batch_is_charged_in_full(self):
+        bucket = limits.TokenBucket(2000)
+        self.assertEqual(bucket.take(5000, 200, 2000), 0)
+        self.assertEqual(bucket.tokens, -3000)
+        # The debt is paid off at the refill rate before anything else gets in
+        self.assertAlmostEqual(bucket.take(5000, 200, 2000), 25)
+        self.now += 10
+        self.assertGreater(bucket.take(1, 200, 2000), 0)
+        self.now += 15
+        self.assertEqual(bucket.take(5000, 200, 2000), 0)
+
+
+class SitePolicyTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', password='secret')
+        self.site = Site.objects.create(
+            owner=self.user, name='Shop', domain='shop.example.com', settings={'sampling_rate': 0.5}
+        )
+        self.client = APIClient()
+        limits._policies.clear()
+        limits._buckets.clear()
+        cache.clear()
+
+    def session_body(self, **fields):
+        return {
+            'tracking_id': str(self.site.tracking_id),
+            'device_type': 'desktop',
+            'browser': 'Chrome',
+            'os': 'Linux',
+            'viewport': {'width': 1280, 'height': 800},
+            **fields,
+        }
+
+    def test_malformed_tracking_id_is_a_bad_request(self):
+        self.assertIsNone(limits.get_site_policy(tracking_id='garbage'))
+        response = self.client.post('/api/track/sessions/', self.session_body(tracking_id='garbage'), format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_sites_are_not_cached(self):
+        for _ in range(3):
+            self.assertIsNone(limits.get_site_policy(tracking_id=uuid.uuid4()))
+        self.assertEqual(limits._policies, {})
+        self.assertEqual(limits.get_site_policy(tracking_id=self.site.tracking_id).site_id, self.site.id)
+        self.assertEqual(len(limits._policies), 1)
+
+    def test_sampling_is_deterministic(self):
+        ids = [uuid.uuid4() for _ in range(2000)]
+        sampled = [limits.is_sampled(session_id, 0.3) for session_id in ids]
+        self.assertEqual(sampled, [limits.is_sampled(session_id, 0.3) for session_id in ids])
+        self.assertAlmostEqual(sum(sampled) / len(ids), 0.3, delta=0.05)
+
+    def test_resent_session_id_returns_the_existing_session(self):
+        session_id = next(i for i in iter(uuid.uuid4, None) if limits.is_sampled(i, 0.5))
+        first = self.client.post('/api/track/sessions/', self.session_body(session_id=str(session_id)), format='json')
+        self.assertEqual(first.status_code, 201)
+        again = self.client.post('/api/track/sessions/', self.session_body(session_id=str(session_id)), format='json')
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data['id'], first.data['id'])
+        self.assertEqual(Session.objects.filter(session_id=session_id).count(), 1)
+
+    def test_sampled_out_session_is_not_stored(self):
+        session_id = next(i for i in iter(uuid.uuid4, None) if not limits.is_sampled(i, 0.5))
+        response = self.client.post('/api/track/sessions/', self.session_body(session_id=str(session_id)), format='json')
+        self.assertEqual(response.data['sampled'], False)
+        self.assertFalse(Session.objects.exists())
+
+
+class AdmitEventsTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='owner', password='secret')
+        self.shop = Site.objects.create(owner=user, name='Shop', domain='shop.example.com')
+        self.blog = Site.objects.create(
+            owner=user, name='Blog', domain='blog.example.com',
+            settings={'daily_event_quota': 100, 'events_per_second': 1, 'burst': 50}
+        )
+        limits._policies.clear()
+        limits._buckets.clear()
+        cache.clear()
+        patcher = mock.patch.object(limits.time, 'monotonic', lambda: 1000.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def accepted(self, site):
+        return cache.get(limits._day_key(site.id, 'events_accepted'), 0)
+
+    def test_rejected_batch_charges_no_site(self):
+        limits.admit_events({self.shop.id: 10, self.blog.id: 50})
+        shop_tokens = limits._buckets[self.shop.id].tokens
+        with self.assertRaises(limits.LimitExceeded) as raised:
+            limits.admit_events({self.shop.id: 10, self.blog.id: 10})
+        self.assertEqual(raised.exception.reason, 'rate')
+        self.assertEqual(limits._buckets[self.shop.id].tokens, shop_tokens)
+        self.assertEqual((self.accepted(self.shop), self.accepted(self.blog)), (10, 50))
+
+    def test_quota_rejection_hands_back_other_reservations(self):
+        cache.set(limits._day_key(self.blog.id, 'events_accepted'), 95)
+        other = Site.objects.create(
+            owner=self.shop.owner, name='Docs', domain='docs.example.com', settings={'daily_event_quota': 100}
+        )
+        with self.assertRaises(limits.LimitExceeded) as raised:
+            limits.admit_events({other.id: 20, self.blog.id: 10})
+        self.assertEqual(raised.exception.reason, 'daily_quota')
+        self.assertEqual((self.accepted(other), self.accepted(self.blog)), (0, 95))
+        limits.admit_events({self.blog.id: 5})
+        self.assertEqual(self.accepted(self.blog), 100)
+
+    def test_concurrent_reservations_do_not_overshoot_the_quota(self):
+        # Another request reserved in between this request's check and its count
+        cache.set(limits._day_key(self.blog.id, 'events_accepted'), 60)
+        self.assertTrue(limits._reserve_quota(self.blog.id, 40, 100))
+        self.assertFalse(limits._reserve_quota(self.blog.id, 1, 100))
+        self.assertEqual(self.accepted(self.blog), 100)
@@ -1,6 +1,10 @@
 from rest_framework import viewsets, permissions
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from .models import Site
 from .serializers import SiteSerializer
+from .limits import invalidate_site_policy, site_ingest_stats
+from heatmaps.tracker import invalidate_tracking_script
 
 class SiteViewSet(viewsets.ModelViewSet):
     serializer_class = SiteSerializer
@@ -11,3 +15,19 @@ class SiteViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
+
+    def perform_update(self, serializer):
+        site = serializer.save()
+        # Drop cached views of the site (limits, tracking script lookup)
+        invalidate_site_policy(site)
+        invalidate_tracking_script(site.id)
+
+    def perform_destroy(self, instance):
+        invalidate_site_policy(instance)
+        invalidate_tracking_script(instance.id)
+        instance.delete()
+
+    @action(detail=True, methods=['get'])
+    def ingestion(self, request, pk=None):
+        """Today's ingestion counters and limits for the site"""
+        return Response(site_ingest_stats(self.get_object()))